@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.employees.utilization_records import backfill_utilization_records, refresh_utilization_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute queued UtilizationRecord weeks (run it from cron as the scheduled pipeline), "
+        "or backfill every ISO week of a date range with --from/--to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", help="Backfill start date (YYYY-MM-DD).")
+        parser.add_argument("--to", dest="end", help="Backfill end date (YYYY-MM-DD, default today).")
+        parser.add_argument("--employee", action="append", dest="employees", help="Restrict the backfill to an employee id (repeatable).")
+
+    def handle(self, *args, **options):
+        if not options["start"]:
+            written = refresh_utilization_records()
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {written} utilization records."))
+            return
+        try:
+            start = date.fromisoformat(options["start"])
+            end = date.fromisoformat(options["end"]) if options["end"] else date.today()
+        except ValueError as exc:
+            raise CommandError(f"Invalid date: {exc}")
+        if end < start:
+            raise CommandError("--to must not be before --from.")
+        written = backfill_utilization_records(start, end, employee_ids=options["employees"])
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {written} utilization records for {start}..{end}."))
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:43
+
+from django.db import migrations, models
+
+
+def mark_existing_runs_completed(apps, schema_editor):
+    """Runs made before progress tracking finished (or failed) in one transaction."""
+    PayrollRun = apps.get_model("employees", "PayrollRun")
+    PayrollRun.objects.update(status="completed", finished_at=models.F("processed_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0006_alter_resourceassignment_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payrollrun',
+            name='chunk_size',
+            field=models.PositiveIntegerField(default=500),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='chunks_completed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='cursor',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='elapsed_seconds',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='employees_processed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='employees_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='last_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='payrollrun',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(mark_existing_runs_completed, migrations.RunPython.noop),
+    ]
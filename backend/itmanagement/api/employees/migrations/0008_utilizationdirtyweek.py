@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0007_payrollrun_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtilizationDirtyWeek',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField()),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dirty_utilization_weeks', to='employees.employee')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['queued_at'], name='employees_u_queued__e7d349_idx')],
+                'unique_together': {('employee', 'week_start')},
+            },
+        ),
+    ]
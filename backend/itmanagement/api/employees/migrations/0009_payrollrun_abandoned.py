@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+def mark_abandoned_runs(apps, schema_editor):
+    """
+    Fresh runs used to leave the period's earlier unfinished runs resumable;
+    abandon every running or failed run older than the period's newest run.
+    """
+    PayrollRun = apps.get_model("employees", "PayrollRun")
+    periods = PayrollRun.objects.values_list("period_start", "period_end").distinct()
+    for period_start, period_end in periods:
+        runs = PayrollRun.objects.filter(period_start=period_start, period_end=period_end)
+        newest = runs.order_by("-processed_at", "-pk").first()
+        runs.filter(status__in=["running", "failed"]).exclude(pk=newest.pk).update(status="abandoned")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0008_utilizationdirtyweek'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payrollrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('abandoned', 'Abandoned')], default='running', max_length=20),
+        ),
+        migrations.RunPython(mark_abandoned_runs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='payrollrun',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'running')), fields=('period_start', 'period_end'), name='employees_payrollrun_one_running_per_period'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 22:20
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def queue_legacy_records(apps, schema_editor):
+    """
+    UtilizationRecords written before the dirty-week queue existed were never
+    queued, so fresh_records() would serve their old figures (capacity_hours
+    was often left at 0); queue every weekly record for recomputation.
+    """
+    UtilizationRecord = apps.get_model("employees", "UtilizationRecord")
+    UtilizationDirtyWeek = apps.get_model("employees", "UtilizationDirtyWeek")
+    now = timezone.now()
+    rows = UtilizationRecord.objects.values_list("employee_id", "period_start", "period_end").iterator(chunk_size=2000)
+    UtilizationDirtyWeek.objects.bulk_create(
+        [
+            UtilizationDirtyWeek(employee_id=employee_id, week_start=period_start, queued_at=now)
+            for employee_id, period_start, period_end in rows
+            # other periods are never read as weekly records
+            if period_start.weekday() == 0 and period_end == period_start + timedelta(days=6)
+        ],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('employees', '0010_leaverequest_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_legacy_records, migrations.RunPython.noop),
+    ]
@@ -297,6 +297,7 @@ class LeaveRequest(models.Model):
     manager = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="leave_approvals")
     requested_at = models.DateTimeField(auto_now_add=True)
     decided_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def duration_days(self) -> Decimal:
         return Decimal((self.end_date - self.start_date).days + 1).quantize(TWOPLACES)
@@ -349,12 +350,45 @@ class PayrollConfig(models.Model):
 
 
 class PayrollRun(models.Model):
+    """
+    A payroll for one period. Payslips are written in employee-id ordered
+    chunks; `cursor` is the last employee whose payslip is committed, so an
+    unfinished run is resumed from there (see payroll.run_payroll). A run
+    replaced by a fresh one is abandoned and never resumed.
+    """
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+        ABANDONED = "abandoned", "Abandoned"
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     period_start = models.DateField()
     period_end = models.DateField()
     processed_at = models.DateTimeField(auto_now_add=True)
     processed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     note = models.TextField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+    cursor = models.UUIDField(null=True, blank=True)
+    chunk_size = models.PositiveIntegerField(default=500)
+    employees_total = models.PositiveIntegerField(default=0)
+    employees_processed = models.PositiveIntegerField(default=0)
+    chunks_completed = models.PositiveIntegerField(default=0)
+    elapsed_seconds = models.FloatField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period_start", "period_end"], condition=models.Q(status="running"),
+                name="employees_payrollrun_one_running_per_period",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Payroll {self.period_start}→{self.period_end} ({self.status}, {self.employees_processed}/{self.employees_total})"
 
 
 
@@ -484,4 +518,23 @@ class UtilizationRecord(models.Model):
         ordering = ["-period_start"]
         indexes = [
             models.Index(fields=["employee", "period_start", "period_end"]),
-        ]
\ No newline at end of file
+        ]
+
+
+class UtilizationDirtyWeek(models.Model):
+    """
+    An (employee, ISO week) whose UtilizationRecord is out of date. Queued by
+    the utilization signals, drained by utilization.refresh_utilization_records().
+    """
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name="dirty_utilization_weeks")
+    week_start = models.DateField()
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ("employee", "week_start")
+        indexes = [
+            models.Index(fields=["queued_at"]),
+        ]
+
+    def __str__(self):
+        return f"{self.employee_id} week of {self.week_start}"
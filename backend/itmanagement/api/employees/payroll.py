@@ -0,0 +1,408 @@
+"""
+Payroll engine.
+
+A run walks the active employees in id order, chunk by chunk:
+- a chunk's inputs (base salary, overtime hours, approved leave overlapping
+  the period with its leave type's accrual) come from three grouped queries,
+  and the PayrollConfig is read once per run;
+- payslip figures are plain Decimal arithmetic on those inputs and are
+  computed in a process pool, while the next chunk is loaded;
+- each chunk's payslips are upserted in their own transaction together with
+  the run's cursor, so a failed run resumes after its last committed chunk
+  instead of starting over. The run row is locked while a chunk is written
+  and the chunk is dropped if the cursor moved meanwhile, so concurrent
+  calls for a period share its run without writing a chunk twice.
+
+simulate_payroll() runs the same loading and computation without writing and
+diffs the result against an earlier run, for trying out PayrollConfig changes.
+"""
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .models import Employee, LeaveRequest, OvertimeRecord, PayrollConfig, PayrollRun, Payslip
+from .utils import q2
+
+logger = logging.getLogger(__name__)
+
+WORKING_DAYS_IN_MONTH = 22  # standard working days for the unpaid-leave day rate
+CONFIG_FIELDS = (
+    "basic_percent", "hra_percent", "pf_employee_percent", "pf_employer_percent",
+    "esi_employee_percent", "esi_employer_percent", "income_tax_percent", "overtime_hour_rate",
+)
+PAYSLIP_FIELDS = (
+    "gross", "basic", "hra", "overtime_pay", "pf_employee", "esi_employee",
+    "income_tax", "other_deductions", "net_pay", "line_items",
+)
+HUNDRED = Decimal("100")
+RESUMABLE = [PayrollRun.Status.RUNNING, PayrollRun.Status.FAILED]
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_workers())
+    return _pool
+
+
+def _reset_pool():
+    """Drop a broken pool (a worker died) so the next run starts a fresh one."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _workers():
+    return getattr(settings, "PAYROLL_WORKERS", None) or os.cpu_count() or 1
+
+
+def payroll_config(config=None):
+    """The payroll percentages as a plain dict; defaults when no PayrollConfig exists."""
+    config = config or PayrollConfig.objects.first() or PayrollConfig()
+    return {name: getattr(config, name) for name in CONFIG_FIELDS}
+
+
+def load_payroll_inputs(employees, period_start, period_end):
+    """
+    [(employee_id, base_salary, overtime_hours, [(leave_start, leave_end,
+    accrual_per_month), ...]), ...] for `employees` ((id, base_salary)
+    pairs), from one overtime and one leave query.
+    """
+    ids = [employee_id for employee_id, _ in employees]
+    overtime = dict(
+        OvertimeRecord.objects.filter(employee_id__in=ids, date__range=(period_start, period_end))
+        .values("employee_id").annotate(hours=Sum("hours")).order_by()
+        .values_list("employee_id", "hours")
+    )
+    leaves = defaultdict(list)
+    approved = LeaveRequest.objects.filter(
+        employee_id__in=ids, status=LeaveRequest.Status.APPROVED,
+        start_date__lte=period_end, end_date__gte=period_start,
+    ).values_list("employee_id", "start_date", "end_date", "leave_type__accrual_per_month")
+    for employee_id, start_date, end_date, accrual in approved:
+        leaves[employee_id].append((start_date, end_date, accrual))
+    return [
+        (employee_id, base_salary, overtime.get(employee_id) or Decimal("0.00"), leaves.get(employee_id, []))
+        for employee_id, base_salary in employees
+    ]
+
+
+def compute_payslip(base_salary, ot_hours, leaves, period_start, period_end, cfg):
+    """Payslip field values for one employee; pure, so it can run in a worker process."""
+    base = q2(base_salary)
+    basic = q2(base * cfg["basic_percent"] / HUNDRED)
+    hra = q2(base * cfg["hra_percent"] / HUNDRED)
+    overtime_pay = q2(ot_hours * cfg["overtime_hour_rate"])
+
+    leave_days = 0
+    unpaid_leave_days = 0
+    for start_date, end_date, accrual in leaves:
+        days_in_period = (min(end_date, period_end) - max(start_date, period_start)).days + 1
+        leave_days += days_in_period
+        # leave types that accrue nothing are unpaid
+        if not accrual:
+            unpaid_leave_days += days_in_period
+
+    daily_salary = q2(base / WORKING_DAYS_IN_MONTH)
+    leave_deduction = q2(daily_salary * unpaid_leave_days)
+    gross = q2(basic + hra + overtime_pay - leave_deduction)
+
+    pf_emp = q2(basic * cfg["pf_employee_percent"] / HUNDRED)
+    esi_emp = q2(gross * cfg["esi_employee_percent"] / HUNDRED)
+    income_tax = q2(gross * cfg["income_tax_percent"] / HUNDRED)
+    deductions = q2(pf_emp + esi_emp + income_tax + leave_deduction)
+    net = q2(gross - deductions)
+
+    return {
+        "gross": gross, "basic": basic, "hra": hra, "overtime_pay": overtime_pay,
+        "pf_employee": pf_emp, "esi_employee": esi_emp, "income_tax": income_tax,
+        "other_deductions": leave_deduction, "net_pay": net,
+        "line_items": {
+            "structure": {"basic": float(basic), "hra": float(hra)},
+            "overtime": {"hours": float(ot_hours), "amount": float(overtime_pay)},
+            "leave": {
+                "total_leave_days": int(leave_days),
+                "unpaid_leave_days": int(unpaid_leave_days),
+                "daily_salary": float(daily_salary),
+                "leave_deduction": float(leave_deduction),
+            },
+            "deductions": {
+                "pf_employee": float(pf_emp),
+                "esi_employee": float(esi_emp),
+                "income_tax": float(income_tax),
+                "leave_deduction": float(leave_deduction),
+            },
+            "gross": float(gross),
+            "net": float(net),
+        },
+    }
+
+
+def compute_chunk(rows, period_start, period_end, cfg):
+    """[(employee_id, payslip fields), ...] for load_payroll_inputs() rows. Runs in a worker process."""
+    return [
+        (employee_id, compute_payslip(base, ot_hours, leaves, period_start, period_end, cfg))
+        for employee_id, base, ot_hours, leaves in rows
+    ]
+
+
+def _active_employees():
+    return Employee.objects.filter(status=Employee.Status.ACTIVE)
+
+
+def iter_employee_chunks(chunk_size, after=None):
+    """Keyset pages of (id, base_salary) for active employees with id > `after`."""
+    while True:
+        qs = _active_employees()
+        if after is not None:
+            qs = qs.filter(pk__gt=after)
+        chunk = list(qs.order_by("pk").values_list("pk", "base_salary")[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1][0]
+
+
+@transaction.atomic
+def _write_chunk(run_id, after, last_employee_id, results):
+    """
+    Upsert a chunk's payslips and advance the run's cursor from `after` to
+    `last_employee_id`. The run row stays locked meanwhile; if the run is no
+    longer running or another call already moved its cursor, nothing is
+    written. Returns (run, written).
+    """
+    run = PayrollRun.objects.select_for_update().get(pk=run_id)
+    if run.status != PayrollRun.Status.RUNNING or run.cursor != after:
+        return run, False
+    payslips = [
+        Payslip(payroll_run=run, employee_id=employee_id, status=Payslip.Status.FINAL, **fields)
+        for employee_id, fields in results
+    ]
+    Payslip.objects.bulk_create(
+        payslips, batch_size=1000, update_conflicts=True,
+        unique_fields=["payroll_run", "employee"], update_fields=["status", *PAYSLIP_FIELDS],
+    )
+    # progress is committed together with the payslips it describes
+    run.cursor = last_employee_id
+    run.employees_processed += len(payslips)
+    run.chunks_completed += 1
+    run.save(update_fields=["cursor", "employees_processed", "chunks_completed", "updated_at"])
+    return run, True
+
+
+def _claim_run(period_start, period_end, processed_by, chunk_size, resume):
+    """
+    The period's run to work on: its running run, else its newest failed one,
+    else a new run. Without `resume` every resumable run of the period is
+    abandoned first (its payslips back to DRAFT), so it is never picked up
+    again. Only one run per period
+    may be running, so a caller racing another one onto a new or failed run
+    retries and joins it.
+    """
+    for attempt in range(3):
+        try:
+            with transaction.atomic():
+                resumable = PayrollRun.objects.select_for_update().filter(
+                    period_start=period_start, period_end=period_end, status__in=RESUMABLE,
+                )
+                if not resume:
+                    now = timezone.now()
+                    abandoned = [run.pk for run in resumable]
+                    PayrollRun.objects.filter(pk__in=abandoned).update(
+                        status=PayrollRun.Status.ABANDONED, finished_at=now, updated_at=now,
+                    )
+                    # only the fresh run's payslips are final for the period
+                    Payslip.objects.filter(payroll_run__in=abandoned).update(status=Payslip.Status.DRAFT)
+                    resume = True
+                    run = None
+                else:
+                    run = resumable.order_by(
+                        Case(When(status=PayrollRun.Status.RUNNING, then=0), default=1), "-processed_at", "-pk",
+                    ).first()
+                if run is None:
+                    return PayrollRun.objects.create(
+                        period_start=period_start, period_end=period_end, processed_by=processed_by,
+                        chunk_size=chunk_size, employees_total=_active_employees().count(),
+                    )
+                if run.status == PayrollRun.Status.FAILED:
+                    logger.info("Resuming payroll run %s after employee %s", run.pk, run.cursor)
+                    run.status = PayrollRun.Status.RUNNING
+                    run.last_error = ""
+                run.chunk_size = chunk_size
+                run.save(update_fields=["status", "chunk_size", "last_error", "updated_at"])
+                return run
+        except IntegrityError:
+            if attempt == 2:
+                raise
+            logger.info("Another payroll run for %s..%s started meanwhile; joining it", period_start, period_end)
+
+
+def computed_chunks(period_start, period_end, cfg, chunk_size, after=None):
+    """
+    Yield (first id after, last employee id, [(employee_id, payslip fields), ...])
+    per chunk of active employees after `after`, in order. Chunks are computed
+    in the process pool while the following ones are loaded.
+    """
+    workers = _workers()
+    if workers == 1:
+        for employees in iter_employee_chunks(chunk_size, after=after):
+            rows = load_payroll_inputs(employees, period_start, period_end)
+            yield after, employees[-1][0], compute_chunk(rows, period_start, period_end, cfg)
+            after = employees[-1][0]
+        return
+
+    pool = _get_pool()
+    in_flight = deque()
+    try:
+        for employees in iter_employee_chunks(chunk_size, after=after):
+            rows = load_payroll_inputs(employees, period_start, period_end)
+            in_flight.append((after, employees[-1][0], pool.submit(compute_chunk, rows, period_start, period_end, cfg)))
+            after = employees[-1][0]
+            # keep every worker busy while this process loads the next chunk
+            if len(in_flight) > workers:
+                first, last_id, future = in_flight.popleft()
+                yield first, last_id, future.result()
+        while in_flight:
+            first, last_id, future = in_flight.popleft()
+            yield first, last_id, future.result()
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+    finally:
+        for *_, future in in_flight:
+            future.cancel()
+
+
+def _work_run(run, cfg):
+    """
+    Write the run's remaining chunks. When another call has moved the cursor
+    meanwhile, continue from its cursor; stop once the run is no longer
+    running. Returns the run as last read.
+    """
+    while True:
+        for after, last_id, results in computed_chunks(run.period_start, run.period_end, cfg, run.chunk_size, after=run.cursor):
+            run, written = _write_chunk(run.pk, after, last_id, results)
+            if not written:
+                break
+        else:
+            PayrollRun.objects.filter(pk=run.pk, status=PayrollRun.Status.RUNNING).update(
+                status=PayrollRun.Status.COMPLETED, finished_at=timezone.now(), updated_at=timezone.now(),
+            )
+            return run
+        if run.status != PayrollRun.Status.RUNNING:
+            return run
+
+
+def run_payroll(period_start, period_end, processed_by=None, chunk_size=None, resume=True):
+    """
+    Generate FINAL payslips for every active employee. An unfinished run for
+    the same period is resumed from its cursor (and shared with concurrent
+    calls) unless `resume` is False, which abandons it for a new run.
+    Failures are recorded on the returned PayrollRun (status FAILED,
+    last_error) rather than raised.
+    """
+    chunk_size = chunk_size or getattr(settings, "PAYROLL_CHUNK_SIZE", 500)
+    run = _claim_run(period_start, period_end, processed_by, chunk_size, resume)
+    cfg = payroll_config()
+
+    started = time.perf_counter()
+    try:
+        _work_run(run, cfg)
+    except Exception as exc:
+        logger.exception("Payroll run %s failed after employee %s", run.pk, run.cursor)
+        PayrollRun.objects.filter(pk=run.pk, status=PayrollRun.Status.RUNNING).update(
+            status=PayrollRun.Status.FAILED, last_error=str(exc), updated_at=timezone.now(),
+        )
+    PayrollRun.objects.filter(pk=run.pk).update(elapsed_seconds=F("elapsed_seconds") + (time.perf_counter() - started))
+    run.refresh_from_db()
+
+    logger.info(
+        "Payroll run %s %s: %d/%d employees in %d chunks, %.2fs",
+        run.pk, run.status, run.employees_processed, run.employees_total, run.chunks_completed, run.elapsed_seconds,
+    )
+    return run
+
+
+def previous_run(period_start):
+    """The latest completed PayrollRun for a period starting before `period_start`."""
+    return (
+        PayrollRun.objects.filter(status=PayrollRun.Status.COMPLETED, period_start__lt=period_start)
+        .order_by("-period_start", "-processed_at").first()
+    )
+
+
+def _deductions(fields):
+    return fields["pf_employee"] + fields["esi_employee"] + fields["income_tax"] + fields["other_deductions"]
+
+
+def simulate_payroll(period_start, period_end, config_overrides=None, compare_to=None, chunk_size=None):
+    """
+    Compute every active employee's payslip for the period without writing
+    anything, using the stored PayrollConfig with `config_overrides`
+    (field -> value) applied, and diff it per employee against `compare_to`
+    (a PayrollRun; default previous_run()). Employees only in the previous
+    run appear with zero simulated figures.
+    """
+    started = time.perf_counter()
+    cfg = payroll_config()
+    cfg.update({name: Decimal(str(value)) for name, value in (config_overrides or {}).items() if name in CONFIG_FIELDS})
+    chunk_size = chunk_size or getattr(settings, "PAYROLL_CHUNK_SIZE", 500)
+
+    simulated = {}
+    for _, _, results in computed_chunks(period_start, period_end, cfg, chunk_size):
+        for employee_id, fields in results:
+            simulated[employee_id] = (fields["gross"], fields["net_pay"], _deductions(fields))
+
+    compare_to = compare_to if compare_to is not None else previous_run(period_start)
+    previous = {}
+    if compare_to is not None:
+        payslips = Payslip.objects.filter(payroll_run=compare_to).values_list(
+            "employee_id", "gross", "net_pay", "pf_employee", "esi_employee", "income_tax", "other_deductions",
+        )
+        for employee_id, gross, net, *deductions in payslips:
+            previous[employee_id] = (gross, net, sum(deductions, Decimal("0.00")))
+
+    employee_ids = simulated.keys() | previous.keys()
+    codes = dict(Employee.objects.filter(pk__in=employee_ids).values_list("pk", "employee_code"))
+    zero = (Decimal("0.00"),) * 3
+    rows = []
+    totals = dict.fromkeys(("gross", "net", "deductions", "gross_delta", "net_delta", "deductions_delta"), Decimal("0.00"))
+    for employee_id in sorted(employee_ids, key=lambda pk: codes.get(pk, "")):
+        gross, net, deductions = simulated.get(employee_id, zero)
+        prev_gross, prev_net, prev_deductions = previous.get(employee_id, zero)
+        row = {
+            "employee_id": str(employee_id),
+            "employee_code": codes.get(employee_id),
+            "gross": gross, "net": net, "deductions": deductions,
+            "gross_delta": gross - prev_gross,
+            "net_delta": net - prev_net,
+            "deductions_delta": deductions - prev_deductions,
+            "in_previous": employee_id in previous,
+            "in_simulation": employee_id in simulated,
+        }
+        for key in totals:
+            totals[key] += row[key]
+        rows.append(row)
+
+    return {
+        "period_start": period_start,
+        "period_end": period_end,
+        "config": cfg,
+        "compared_to": compare_to.pk if compare_to is not None else None,
+        "employees": len(simulated),
+        "totals": totals,
+        "rows": rows,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+    }
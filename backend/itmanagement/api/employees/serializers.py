@@ -164,7 +164,13 @@ class PayrollConfigSerializer(serializers.ModelSerializer):
     class Meta: model = PayrollConfig; fields = "__all__"
 
 class PayrollRunSerializer(serializers.ModelSerializer):
-    class Meta: model = PayrollRun; fields = "__all__"
+    class Meta:
+        model = PayrollRun
+        fields = "__all__"
+        read_only_fields = [
+            "status", "cursor", "employees_total", "employees_processed", "chunks_completed",
+            "elapsed_seconds", "last_error", "updated_at", "finished_at",
+        ]
 
 class PayslipSerializer(serializers.ModelSerializer):
     class Meta:
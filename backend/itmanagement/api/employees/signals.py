@@ -3,9 +3,10 @@ from .models import LeaveRequest, LeaveBalance, Employee, EmployeeContract
 from .utils import approve_leave
 from api.dailytask.models import TaskTimeLog
 from .models import *
-from .utils import compute_utilization
+from .utilization_records import mark_employee_dirty, mark_weeks_dirty, schedule_utilization_refresh
 from datetime import date, timedelta
-from django.db.models.signals import post_save, post_delete , pre_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete , pre_save, post_init
 @receiver(post_save, sender=Employee)
 def create_default_leave_balances(sender, instance, created, **kwargs):
     if created:
@@ -34,46 +35,67 @@ def current_week_range():
     return start, end
 
 
+# UtilizationRecord weeks are recomputed by utilization_records.refresh_utilization_records();
+# these receivers only queue the weeks a change touches, before and after the change.
+
+def _queue(signal, mark, employee_id, *args):
+    if signal is post_delete:
+        # the delete may be cascading from the employee itself; queue only if it survives
+        transaction.on_commit(lambda: Employee.objects.filter(pk=employee_id).exists() and mark(employee_id, *args))
+    else:
+        mark(employee_id, *args)
+
+@receiver(post_init, sender=TaskTimeLog)
+def _remember_timelog_week(sender, instance, **kwargs):
+    d = instance.__dict__
+    instance._utilization_key = (d.get("user_id"), d.get("date"))
+
+
 @receiver([post_save, post_delete], sender=TaskTimeLog)
-def refresh_util_on_timelog_change(sender, instance, **kwargs):
-    """
-    Lightweight example: update current-week cached UtilizationRecord for that employee.
-    """
-    if not instance.user_id:
-        return
-    from .models import Employee
-    emp = Employee.objects.filter(user_id=instance.user_id).first()
-    if not emp:
-        return
-    start, end = current_week_range()
-    metrics = compute_utilization(emp.id, start, end)
-    UtilizationRecord.objects.update_or_create(
-        employee=emp, period_start=start, period_end=end,
-        defaults={
-            "hours_logged": metrics["hours"],
-            "capacity_hours": metrics["capacity"],
-            "utilization_percent": metrics["util_percent"],
-        }
-    )
+def queue_util_on_timelog_change(sender, instance, signal, **kwargs):
+    keys = {getattr(instance, "_utilization_key", (None, None)), (instance.user_id, instance.date)}
+    instance._utilization_key = (instance.user_id, instance.date)
+    employees = dict(Employee.objects.filter(user_id__in=[user_id for user_id, _ in keys if user_id]).values_list("user_id", "id"))
+    for user_id, day in keys:
+        if user_id in employees and day:
+            _queue(signal, mark_weeks_dirty, employees[user_id], day, day)
+    schedule_utilization_refresh()
+
+
+@receiver(post_init, sender=ResourceAssignment)
+@receiver(post_init, sender=LeaveRequest)
+def _remember_utilization_range(sender, instance, **kwargs):
+    d = instance.__dict__
+    instance._utilization_range = (d.get("employee_id"), d.get("start_date"), d.get("end_date"), d.get("status"))
+
+
+def _queue_range_change(instance, signal, counts):
+    previous = getattr(instance, "_utilization_range", None)
+    current = (instance.employee_id, instance.start_date, instance.end_date, getattr(instance, "status", None))
+    instance._utilization_range = current
+    for employee_id, start, end, status in {previous, current} - {None}:
+        if start and end and counts(status):
+            _queue(signal, mark_weeks_dirty, employee_id, start, end)
+    schedule_utilization_refresh()
 
 
 @receiver([post_save, post_delete], sender=ResourceAssignment)
-def refresh_util_on_assignment_change(sender, instance, **kwargs):
-    """
-    Also refresh weekly cache when assignments change.
-    """
-    start, end = current_week_range()
-    m = compute_utilization(instance.employee_id, start, end)
-    UtilizationRecord.objects.update_or_create(
-        employee_id=instance.employee_id, period_start=start, period_end=end,
-        defaults={
-            "hours_logged": m["hours"],
-            "capacity_hours": m["capacity"],
-            "utilization_percent": m["util_percent"],
-        }
-    )
+def queue_util_on_assignment_change(sender, instance, signal, **kwargs):
+    _queue_range_change(instance, signal, lambda status: True)
+
+
+@receiver([post_save, post_delete], sender=LeaveRequest)
+def queue_util_on_leave_change(sender, instance, signal, **kwargs):
+    # only approved leave reduces capacity
+    _queue_range_change(instance, signal, lambda status: status == LeaveRequest.Status.APPROVED)
+
+
+@receiver([post_save, post_delete], sender=EmployeeContract)
+def queue_util_on_contract_change(sender, instance, signal, **kwargs):
+    _queue(signal, mark_employee_dirty, instance.employee_id)
+    schedule_utilization_refresh()
 
 @receiver(pre_save, sender=EmployeeContract)
 def set_contract_status(sender, instance, **kwargs):
     if instance.is_expired:
-        instance.status = instance.Status.EXPIRED
\ No newline at end of file
+        instance.status = instance.Status.EXPIRED
@@ -1,5 +1,6 @@
 
 from datetime import date, timedelta
+from django.core.cache import cache
 from django.core.mail import send_mail
 from background_task import background
 from .models import EmployeeContract, Certification, Employee
@@ -41,3 +42,11 @@ def schedule_monthly_payroll(period_start_str, period_end_str, processed_by_id):
     processed_by = User.objects.filter(id=processed_by_id).first()
     generate_payroll_run(ps, pe, processed_by)
 
+
+@background(schedule=0)
+def refresh_utilization_records_task():
+    """Background task: recompute queued UtilizationRecord weeks (see schedule_utilization_refresh)."""
+    from .utilization_records import REFRESH_KEY, refresh_utilization_records
+    # release the debounce slot first so changes made during the refresh queue another one
+    cache.delete(REFRESH_KEY)
+    refresh_utilization_records()
@@ -1,3 +1,471 @@
-from django.test import TestCase
+import threading
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.dailytask.models import DailyTask, TaskTimeLog
+from api.organizations.models import Organization
+from api.partners.models import Partner
+from api.projects.models import Client, Project
+from api.users.models import User
+from . import payroll
+from .models import (
+    Employee, EmployeeContract, LeaveRequest, LeaveType, PayrollRun, Payslip, ResourceAssignment,
+    UtilizationDirtyWeek, UtilizationRecord,
+)
+from .payroll import run_payroll
+from .utilization import (
+    batch_utilization, batch_weekly_utilization, employee_utilization, load_utilization_inputs, organization_bands,
+    week_start, weekly_figures,
+)
+from .utilization_records import (
+    backfill_utilization_records, fresh_records, mark_weeks_dirty, refresh_utilization_records, utilization_totals,
+)
+from .utils import compute_utilization
+
+MARCH = (date(2025, 3, 1), date(2025, 3, 31))
+
+
+def make_org(name="Acme"):
+    return Organization.objects.create(
+        name=name, legal_name=name, registration_number=uuid.uuid4().hex, company_email="hr@example.com",
+        company_phone="1", address="1 Main St", city="Pune", state="MH", postal_code="411001", country="India",
+        business_license="org/docs/license.pdf",
+    )
+
+
+def make_employee(org, code, base_salary="22000.00", **fields):
+    user = User.objects.create(username=code, user_type="employee")
+    return Employee.objects.create(
+        user=user, organization=org, employee_code=code, name=code,
+        date_of_joining=date(2024, 1, 1), base_salary=Decimal(base_salary), **fields,
+    )
+
+
+def make_project(name="Portal"):
+    client = Client.objects.create(name="Client", organization="Client Co", email="c@example.com", phone="1")
+    return Project.objects.create(
+        name=name, client=client, start_date=date(2025, 1, 1), end_date=date(2025, 12, 31), department="IT",
+    )
+
+
+def assign(employee, project, start, end, allocation="100.00", planned="40.00"):
+    return ResourceAssignment.objects.create(
+        employee=employee, project=project, start_date=start, end_date=end,
+        allocation_percent=Decimal(allocation), planned_hours_per_week=Decimal(planned),
+    )
+
+
+def approve_leave(employee, start, end):
+    leave_type, _ = LeaveType.objects.get_or_create(name="Casual")
+    return LeaveRequest.objects.create(
+        employee=employee, leave_type=leave_type, start_date=start, end_date=end, status=LeaveRequest.Status.APPROVED,
+    )
+
+
+def log_hours(employee, project, day, hours):
+    """Time log dated `day` (date is auto_now_add, so it is moved afterwards)."""
+    task = DailyTask.objects.create(
+        title="Work", assigned_to=employee.user, due_date=day, priority="Medium", category="Development", project=project,
+    )
+    log = TaskTimeLog.objects.create(task=task, user=employee.user, hours_spent=Decimal(hours))
+    TaskTimeLog.objects.filter(pk=log.pk).update(date=day)
+    return log
+
+
+def failing_chunk(fail_on):
+    """compute_chunk that raises on the `fail_on`-th call (1-based)."""
+    calls = []
+    compute_chunk = payroll.compute_chunk
+
+    def compute(*args):
+        calls.append(args)
+        if len(calls) == fail_on:
+            raise RuntimeError("chunk failed")
+        return compute_chunk(*args)
+    return compute
+
+
+@override_settings(PAYROLL_WORKERS=1)
+class PayrollRunTests(TestCase):
+    def setUp(self):
+        org = make_org()
+        self.employees = [make_employee(org, f"E{i}") for i in range(3)]
+
+    def _run(self, fail_on=None, **kwargs):
+        if fail_on is None:
+            return run_payroll(*MARCH, chunk_size=1, **kwargs)
+        with mock.patch("api.employees.payroll.compute_chunk", side_effect=failing_chunk(fail_on)):
+            return run_payroll(*MARCH, chunk_size=1, **kwargs)
+
+    def test_failed_run_resumes_after_its_last_chunk(self):
+        failed = self._run(fail_on=2)
+        self.assertEqual((failed.status, failed.employees_processed, failed.last_error), (PayrollRun.Status.FAILED, 1, "chunk failed"))
+
+        run = self._run()
+
+        self.assertEqual(run.pk, failed.pk)
+        self.assertEqual((run.status, run.employees_processed, run.chunks_completed), (PayrollRun.Status.COMPLETED, 3, 3))
+        self.assertEqual(Payslip.objects.filter(payroll_run=run, status=Payslip.Status.FINAL).count(), 3)
+
+    def test_fresh_run_abandons_the_unfinished_one(self):
+        old = self._run(fail_on=2)
+        fresh = self._run(fail_on=3, resume=False)
+        self.assertNotEqual(fresh.pk, old.pk)
+
+        run = self._run()
+
+        self.assertEqual(run.pk, fresh.pk)
+        self.assertEqual(run.status, PayrollRun.Status.COMPLETED)
+        old.refresh_from_db()
+        self.assertEqual(old.status, PayrollRun.Status.ABANDONED)
+        self.assertEqual(
+            set(Payslip.objects.filter(status=Payslip.Status.FINAL).values_list("payroll_run_id", flat=True)), {fresh.pk},
+        )
+        self.assertEqual(Payslip.objects.filter(payroll_run=old, status=Payslip.Status.DRAFT).count(), 1)
+
+    @override_settings(PAYROLL_WORKERS=2)
+    def test_broken_pool_is_replaced(self):
+        broken = mock.Mock()
+        broken.submit.return_value.result.side_effect = BrokenProcessPool("worker died")
+
+        with mock.patch.object(payroll, "_pool", broken):
+            run = run_payroll(*MARCH, chunk_size=1)
+            self.assertIsNone(payroll._pool)
+
+        self.assertEqual(run.status, PayrollRun.Status.FAILED)
+        broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    def test_generate_view_reports_a_failed_run(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username="hr", user_type="admin"))
+        body = {"period_start": "2025-03-01", "period_end": "2025-03-31"}
+
+        with mock.patch("api.employees.payroll.compute_chunk", side_effect=RuntimeError("chunk failed")):
+            response = client.post("/api/employees/payroll-runs/generate/", body, format="json")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual((response.data["status"], response.data["last_error"]), ("failed", "chunk failed"))
+
+        response = client.post("/api/employees/payroll-runs/generate/", body, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["status"], "completed")
+
+
+@override_settings(PAYROLL_WORKERS=1)
+class PayrollSimulationTests(TestCase):
+    url = "/api/employees/payroll-runs/simulate/"
+
+    def setUp(self):
+        org = make_org()
+        self.employee = make_employee(org, "E1")
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username="hr", user_type="admin"))
+
+    def _simulate(self, **body):
+        return self.client.post(self.url, {"period_start": "2025-04-01", "period_end": "2025-04-30", **body}, format="json")
+
+    def test_simulation_diffs_against_the_previous_run(self):
+        run = run_payroll(*MARCH)
+
+        response = self._simulate(config={"income_tax_percent": "10"}, compare_to=str(run.pk))
+
+        self.assertEqual(response.status_code, 200)
+        row, = response.data["rows"]
+        # 5% more tax on a gross of 40% + 20% of 22000
+        self.assertEqual((row["gross_delta"], row["net_delta"]), (Decimal("0.00"), Decimal("-660.00")))
+        self.assertFalse(PayrollRun.objects.exclude(pk=run.pk).exists())
+
+    def test_bad_compare_to_is_rejected(self):
+        self.assertEqual(self._simulate(compare_to="not-a-uuid").status_code, 400)
+        self.assertEqual(self._simulate(compare_to=str(uuid.uuid4())).status_code, 404)
+
+    def test_non_finite_config_values_are_rejected(self):
+        for value in ("NaN", "Infinity", "-Infinity", "sNaN", "ten"):
+            with self.subTest(value=value):
+                self.assertEqual(self._simulate(config={"hra_percent": value}).status_code, 400)
+        self.assertEqual(self._simulate(config=["hra_percent"]).status_code, 400)
+
+
+class UtilizationEngineTests(TestCase):
+    """Two weeks from Mon 2025-03-03 to Sun 2025-03-16."""
+
+    def setUp(self):
+        self.org = make_org()
+        self.portal, self.mobile = make_project("Portal"), make_project("Mobile")
+        self.employee = make_employee(self.org, "E1")
+        EmployeeContract.objects.create(
+            employee=self.employee, title="Contract", document="c.pdf", weekly_hours=30,
+            # expired contracts are ignored, so this one must not have ended yet
+            start_date=date(2025, 1, 1), end_date=date(2099, 12, 31),
+        )
+        assign(self.employee, self.portal, date(2025, 3, 3), date(2025, 3, 16))
+        # the second week is over-allocated; allocation is capped at 100%
+        assign(self.employee, self.mobile, date(2025, 3, 10), date(2025, 3, 20), allocation="50.00", planned="20.00")
+        approve_leave(self.employee, date(2025, 3, 4), date(2025, 3, 5))
+        log_hours(self.employee, self.portal, date(2025, 3, 3), "12.00")
+        log_hours(self.employee, self.portal, date(2025, 3, 6), "18.00")
+        log_hours(self.employee, self.mobile, date(2025, 3, 12), "20.00")
+
+    def test_weekly_capacity_sweeps_assignments_and_leave(self):
+        weeks = batch_weekly_utilization([self.employee.pk], date(2025, 3, 3), date(2025, 3, 16))[self.employee.pk]
+
+        self.assertEqual(
+            [(w["week_start"], w["hours"], w["capacity"], w["util_percent"], w["allocation_percent"]) for w in weeks],
+            [
+                # 40h at 100%, less two leave days at 30h / 5 per day
+                (date(2025, 3, 3), Decimal("30.00"), Decimal("28.00"), Decimal("107.14"), Decimal("100.00")),
+                (date(2025, 3, 10), Decimal("20.00"), Decimal("60.00"), Decimal("33.33"), Decimal("100.00")),
+            ],
+        )
+        self.assertEqual(
+            batch_utilization([self.employee.pk], date(2025, 3, 3), date(2025, 3, 16))[self.employee.pk],
+            {"hours": Decimal("50.00"), "capacity": Decimal("88.00"), "util_percent": Decimal("56.82")},
+        )
+
+    def test_partial_weeks_are_prorated(self):
+        # Wed..Sun of the first week: 5/7 of 40h, one leave day and one log in range
+        totals = batch_utilization([self.employee.pk], date(2025, 3, 5), date(2025, 3, 9))[self.employee.pk]
+
+        self.assertEqual(totals, {"hours": Decimal("18.00"), "capacity": Decimal("22.57"), "util_percent": Decimal("79.75")})
+
+    def test_project_limits_assignments_and_logs(self):
+        totals = batch_utilization([self.employee.pk], date(2025, 3, 10), date(2025, 3, 16), project_id=self.mobile.pk)
+
+        # only the mobile assignment (20h at 50%) and its log count
+        self.assertEqual(totals[self.employee.pk], {"hours": Decimal("20.00"), "capacity": Decimal("10.00"), "util_percent": Decimal("200.00")})
+
+    def test_single_employee_helpers_agree_with_the_batch(self):
+        start, end = date(2025, 3, 1), date(2025, 3, 31)
+
+        self.assertEqual(compute_utilization(self.employee.pk, start, end), batch_utilization([self.employee.pk], start, end)[self.employee.pk])
+        with self.assertRaises(Employee.DoesNotExist):
+            employee_utilization(uuid.uuid4(), start, end)
+
+    def test_leave_only_reduces_its_own_weeks_capacity(self):
+        # 40h assigned in the first week, a full week of leave in the unassigned second week
+        employee = make_employee(self.org, "E2")
+        assign(employee, self.portal, date(2025, 3, 3), date(2025, 3, 9))
+        approve_leave(employee, date(2025, 3, 10), date(2025, 3, 14))
+        log_hours(employee, self.portal, date(2025, 3, 4), "30.00")
+        start, end = date(2025, 3, 3), date(2025, 3, 16)
+
+        weeks = weekly_figures(load_utilization_inputs([employee.pk], start, end)[employee.pk], start, end)
+        # before the weekly engine, the range's leave was netted against the range's capacity
+        range_capacity = max(sum(w["capacity"] for w in weeks) - sum(w["leave_hours"] for w in weeks), Decimal("0"))
+        self.assertEqual(range_capacity, Decimal("0"))
+
+        self.assertEqual(
+            compute_utilization(employee.pk, start, end),
+            {"hours": Decimal("30.00"), "capacity": Decimal("40.00"), "util_percent": Decimal("75.00")},
+        )
+
+    def test_batch_queries_do_not_grow_with_employees_or_weeks(self):
+        others = [make_employee(self.org, f"E{i}") for i in range(2, 6)]
+        for employee in others:
+            assign(employee, self.portal, date(2025, 1, 6), date(2025, 6, 29), allocation="50.00")
+            log_hours(employee, self.portal, date(2025, 2, 4), "8.00")
+        ids = [self.employee.pk, *(employee.pk for employee in others), uuid.uuid4()]
+
+        with self.assertNumQueries(5):
+            totals = batch_utilization(ids, date(2025, 1, 1), date(2025, 12, 31))
+
+        self.assertEqual(len(totals), 5)
+        # 25 weeks at 20h
+        self.assertEqual(totals[others[0].pk]["capacity"], Decimal("500.00"))
+        with override_settings(UTILIZATION_BATCH_SIZE=2), self.assertNumQueries(15):
+            batch_utilization(ids, date(2025, 1, 1), date(2025, 12, 31))
+
+
+class UtilizationBandTests(TestCase):
+    url = "/api/employees/utilization/bands/"
+    period = {"start": "2025-03-03", "end": "2025-03-09"}
+
+    def setUp(self):
+        self.org, self.other_org = make_org(), make_org("Globex")
+        project = make_project()
+        self.busy, self.idle = make_employee(self.org, "E1"), make_employee(self.org, "E2")
+        for employee in (self.busy, self.idle):
+            assign(employee, project, date(2025, 3, 3), date(2025, 3, 9))
+        log_hours(self.busy, project, date(2025, 3, 4), "44.00")
+        log_hours(self.idle, project, date(2025, 3, 4), "10.00")
+        self.project = project
+        self.client = APIClient()
+
+    def _get(self, user, **params):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url, {**self.period, **params})
+
+    def test_bands_for_the_callers_organization(self):
+        response = self._get(self.busy.user, limit=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        row, = response.data["results"]
+        self.assertEqual((row["code"], row["util_percent"], row["band"]), ("E1", 110.0, "over"))
+
+        response = self._get(self.busy.user, band="under")
+        self.assertEqual([row["code"] for row in response.data], ["E2"])
+
+    def test_other_organizations_are_staff_only(self):
+        partner = User.objects.create(username="partner", user_type="partner")
+        Partner.objects.create(user=partner, organization=self.other_org)
+        staff = User.objects.create(username="staff", user_type="admin", is_staff=True)
+
+        self.assertEqual(self._get(self.busy.user, organization=str(self.other_org.pk)).status_code, 403)
+        self.assertEqual(self._get(partner, organization=str(self.org.pk)).status_code, 403)
+        self.assertEqual(self._get(partner).data, [])
+        self.assertEqual(self._get(staff, organization=str(self.org.pk)).status_code, 200)
+        self.assertEqual(self._get(staff, organization=str(uuid.uuid4())).status_code, 404)
+        self.assertEqual(self._get(staff).status_code, 400)
+
+    def test_malformed_parameters_are_rejected(self):
+        for params in ({"organization": "acme"}, {"over": "NaN"}, {"under": "Infinity"}, {"start": "March"}):
+            with self.subTest(**params):
+                self.assertEqual(self._get(self.busy.user, **params).status_code, 400)
+
+    def test_cached_bands_follow_data_changes(self):
+        start, end = date(2025, 3, 3), date(2025, 3, 9)
+        organization_bands(self.org.pk, start, end)
+        # a cache hit costs the version stamp and the cache read
+        with self.assertNumQueries(6):
+            organization_bands(self.org.pk, start, end)
+
+        # the version is read from the tables, so no signal or commit hook is needed
+        log_hours(self.idle, self.project, date(2025, 3, 5), "40.00")
+        rows = organization_bands(self.org.pk, start, end)
+
+        self.assertEqual([(row["code"], row["util_percent"]) for row in rows], [("E2", 125.0), ("E1", 110.0)])
+
+
+class UtilizationRecordTests(TestCase):
+    WEEK = date(2025, 3, 3)
+
+    def setUp(self):
+        self.org = make_org()
+        self.project = make_project()
+        self.employee = make_employee(self.org, "E1")
+        assign(self.employee, self.project, date(2025, 3, 3), date(2025, 3, 16))
+        log_hours(self.employee, self.project, date(2025, 3, 4), "30.00")
+        # start from an empty queue; the signals queued the weeks above
+        UtilizationDirtyWeek.objects.all().delete()
+
+    def _queued(self):
+        return set(UtilizationDirtyWeek.objects.values_list("employee_id", "week_start"))
+
+    def _requeue_while_computing(self, target):
+        """Patch target so the week is queued again mid-run, stamped before the run started."""
+        compute = target
+
+        def requeue_then_compute(*args, **kwargs):
+            UtilizationDirtyWeek.objects.update(queued_at=F("queued_at") + timedelta(microseconds=1))
+            return compute(*args, **kwargs)
+        return mock.patch("api.employees.utilization_records.batch_weekly_utilization", side_effect=requeue_then_compute)
+
+    def test_refresh_writes_queued_weeks(self):
+        mark_weeks_dirty(self.employee.pk, self.WEEK, self.WEEK)
+
+        refresh_utilization_records()
+
+        record = UtilizationRecord.objects.get(employee=self.employee, period_start=self.WEEK)
+        self.assertEqual((record.hours_logged, record.capacity_hours), (Decimal("30.00"), Decimal("40.00")))
+        self.assertEqual(self._queued(), set())
+
+    def test_weeks_queued_again_during_a_run_stay_queued(self):
+        mark_weeks_dirty(self.employee.pk, self.WEEK, self.WEEK)
+        UtilizationDirtyWeek.objects.update(queued_at=timezone.now() - timedelta(minutes=1))
+
+        with self._requeue_while_computing(batch_weekly_utilization):
+            refresh_utilization_records()
+        self.assertEqual(self._queued(), {(self.employee.pk, self.WEEK)})
+
+        with self._requeue_while_computing(batch_weekly_utilization):
+            backfill_utilization_records(self.WEEK, self.WEEK + timedelta(days=6))
+        self.assertEqual(self._queued(), {(self.employee.pk, self.WEEK)})
+
+        backfill_utilization_records(self.WEEK, self.WEEK + timedelta(days=6))
+        self.assertEqual(self._queued(), set())
+
+    def test_materialized_weeks_past_the_horizon_are_queued(self):
+        far = week_start(timezone.localdate() + timedelta(weeks=40))
+        backfill_utilization_records(far, far + timedelta(days=6))
+
+        mark_weeks_dirty(self.employee.pk, far - timedelta(weeks=2), far + timedelta(weeks=1, days=6))
+
+        queued = {monday for _, monday in self._queued()}
+        self.assertIn(far, queued)
+        self.assertNotIn(far + timedelta(weeks=1), queued)
+        self.assertEqual(fresh_records([self.employee.pk], far, far), {})
+
+    def test_totals_agree_however_they_are_obtained(self):
+        # a week of leave outweighs the first week's 40h; it must not eat into the second
+        approve_leave(self.employee, date(2025, 3, 3), date(2025, 3, 9))
+        start, end = self.WEEK, date(2025, 3, 16)
+        expected = {"hours": Decimal("30.00"), "capacity": Decimal("40.00"), "util_percent": Decimal("75.00")}
+
+        self.assertEqual(batch_utilization([self.employee.pk], start, end)[self.employee.pk], expected)
+        self.assertEqual(utilization_totals([self.employee.pk], start, end)[self.employee.pk], expected)
+        backfill_utilization_records(start, end)
+        with mock.patch("api.employees.utilization_records.batch_weekly_utilization") as compute:
+            self.assertEqual(utilization_totals([self.employee.pk], start, end)[self.employee.pk], expected)
+        compute.assert_called_once_with([], start, end)
+
+    def test_records_written_before_the_queue_are_recomputed(self):
+        legacy = UtilizationRecord.objects.create(
+            employee=self.employee, period_start=self.WEEK, period_end=self.WEEK + timedelta(days=6),
+            hours_logged=Decimal("8.00"), capacity_hours=Decimal("0.00"), utilization_percent=Decimal("0.00"),
+        )
+        migration = import_module("api.employees.migrations.0011_queue_legacy_utilization_records")
+
+        migration.queue_legacy_records(apps, None)
+
+        self.assertEqual(self._queued(), {(self.employee.pk, self.WEEK)})
+        self.assertEqual(
+            utilization_totals([self.employee.pk], self.WEEK, self.WEEK + timedelta(days=6))[self.employee.pk],
+            {"hours": Decimal("30.00"), "capacity": Decimal("40.00"), "util_percent": Decimal("75.00")},
+        )
+        refresh_utilization_records()
+        legacy.refresh_from_db()
+        self.assertEqual((legacy.hours_logged, legacy.capacity_hours), (Decimal("30.00"), Decimal("40.00")))
+
+
+@skipUnlessDBFeature("has_select_for_update")
+@override_settings(PAYROLL_WORKERS=1)
+class ConcurrentPayrollRunTests(TransactionTestCase):
+    def setUp(self):
+        org = make_org()
+        for i in range(4):
+            make_employee(org, f"E{i}")
+
+    def test_concurrent_runs_share_one_run(self):
+        errors = []
+        barrier = threading.Barrier(3)
+
+        def run():
+            try:
+                barrier.wait()
+                run_payroll(*MARCH, chunk_size=1)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        run = PayrollRun.objects.get()
+        self.assertEqual((run.status, run.employees_processed, run.chunks_completed), (PayrollRun.Status.COMPLETED, 4, 4))
+        self.assertEqual(Payslip.objects.filter(payroll_run=run).count(), 4)
@@ -56,6 +56,7 @@ urlpatterns = [
     path("payroll-runs/", PayrollRunListCreateView.as_view()),
     path("payroll-runs/<uuid:pk>/", PayrollRunDetailView.as_view()),
     path("payroll-runs/generate/", GeneratePayrollRunView.as_view()),
+    path("payroll-runs/simulate/", PayrollSimulationView.as_view()),
     path("payslips/", PayslipListView.as_view()),
     path("payslips/<uuid:pk>/", PayslipDetailView.as_view()),
 
@@ -69,6 +70,7 @@ urlpatterns = [
 
 
     path("utilization/", UtilizationReportView.as_view(), name="resource-utilization"),
+    path("utilization/bands/", UtilizationBandView.as_view(), name="resource-utilization-bands"),
     path("recommendations/", RecommendationView.as_view(), name="resource-recommendations"),
     path("cross-project-split/", CrossProjectSplitView.as_view(), name="resource-cross-split"),
     path("capacity/", CapacityPlanningView.as_view(), name="resource-capacity"),
@@ -0,0 +1,303 @@
+"""
+Utilization engine.
+
+Everything utilization depends on is loaded once per batch of employees, with
+one query each for the employees, their active contracts, approved leave,
+resource assignments and grouped time logs. Capacity is then computed in
+memory: the (clipped Mon..Sun) weeks of the range are walked in order while
+assignments and leaves sorted by start date enter an active set and leave it
+once they end, so each interval is touched a constant number of times however
+many weeks the range covers.
+
+A week's capacity is the planned hours of the overlapping assignments scaled
+by their allocation (capped at 100%) and by the part of the week inside the
+range, less contract_hours / 5 per day of approved leave that week, and never
+below zero. Totals over a range are sums of these weekly figures, however
+they are obtained (see total()).
+
+utilization_records stores these figures per employee and ISO week.
+organization_bands() classifies a whole organization as over/under/optimally
+utilized from those records (or one batch) and caches the sorted rows per
+(organization, period) until the utilization data version moves (any time
+log, assignment, leave, contract or employee change) or
+UTILIZATION_BAND_CACHE_TIMEOUT passes.
+"""
+import hashlib
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Sum
+
+from api.dailytask.models import TaskTimeLog
+
+from .models import Employee, EmployeeContract, LeaveRequest, ResourceAssignment
+from .utils import daterange_weeks, q2
+
+BASE_WEEK_HOURS = Decimal("40.00")
+HUNDRED = Decimal("100")
+ZERO = Decimal("0.00")
+OVER_THRESHOLD = Decimal("100")
+UNDER_THRESHOLD = Decimal("60")
+BANDS_KEY_PREFIX = "employees:utilization_bands"
+
+
+def _batch_size():
+    return getattr(settings, "UTILIZATION_BATCH_SIZE", 1000)
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def load_utilization_inputs(employee_ids, start, end, project_id=None):
+    """
+    {employee_id: {"user_id", "contract_hours", "assignments": [(start, end,
+    allocation_percent, planned_hours_per_week), ...], "leaves": [(start, end),
+    ...], "logged": {week start: hours}}} for the employees that exist.
+    Assignments and logged hours are limited to `project_id` when given.
+    """
+    ids = list(employee_ids)
+    inputs = {
+        employee_id: {"user_id": user_id, "contract_hours": None, "assignments": [], "leaves": [], "logged": defaultdict(Decimal)}
+        for employee_id, user_id in Employee.objects.filter(id__in=ids).values_list("id", "user_id")
+    }
+    if not inputs:
+        return inputs
+
+    contracts = (
+        EmployeeContract.objects.filter(employee_id__in=ids, status=EmployeeContract.Status.ACTIVE)
+        .order_by("employee_id", "-start_date").values_list("employee_id", "weekly_hours")
+    )
+    for employee_id, weekly_hours in contracts:
+        # latest active contract wins
+        if inputs[employee_id]["contract_hours"] is None:
+            inputs[employee_id]["contract_hours"] = weekly_hours
+
+    leaves = LeaveRequest.objects.filter(
+        employee_id__in=ids, status=LeaveRequest.Status.APPROVED, start_date__lte=end, end_date__gte=start,
+    ).values_list("employee_id", "start_date", "end_date")
+    for employee_id, leave_start, leave_end in leaves:
+        inputs[employee_id]["leaves"].append((leave_start, leave_end))
+
+    assignments = ResourceAssignment.objects.filter(employee_id__in=ids, start_date__lte=end, end_date__gte=start)
+    if project_id:
+        assignments = assignments.filter(project_id=project_id)
+    for employee_id, *row in assignments.values_list(
+        "employee_id", "start_date", "end_date", "allocation_percent", "planned_hours_per_week",
+    ).order_by():
+        inputs[employee_id]["assignments"].append(tuple(row))
+
+    by_user = {data["user_id"]: data for data in inputs.values()}
+    logs = TaskTimeLog.objects.filter(user_id__in=list(by_user), date__gte=start, date__lte=end)
+    if project_id:
+        logs = logs.filter(task__project_id=project_id)
+    for user_id, day, hours in logs.values("user_id", "date").annotate(hours=Sum("hours_spent")).order_by() \
+            .values_list("user_id", "date", "hours"):
+        by_user[user_id]["logged"][week_start(day)] += hours or ZERO
+    return inputs
+
+
+def _sweep(intervals, weeks):
+    """
+    Yield the intervals overlapping each of `weeks` (ordered (start, end)
+    pairs); `intervals` are tuples starting with (start, end).
+    """
+    pending = sorted(intervals, key=lambda interval: interval[0])
+    active = []  # heap of (end, seq, interval)
+    i = 0
+    for wk_start, wk_end in weeks:
+        while i < len(pending) and pending[i][0] <= wk_end:
+            heapq.heappush(active, (pending[i][1], i, pending[i]))
+            i += 1
+        while active and active[0][0] < wk_start:
+            heapq.heappop(active)
+        yield [interval for _, _, interval in active]
+
+
+def weekly_figures(data, start, end, base_week_hours=BASE_WEEK_HOURS, use_planned=True):
+    """
+    [{"week_start", "week_end", "allocation_percent", "capacity", "leave_hours",
+    "hours"}, ...] per clipped week of [start, end] for one employee's inputs.
+    Capacity is before leave and unrounded, so weeks can be summed exactly.
+    """
+    weeks = list(daterange_weeks(start, end))
+    per_leave_day = Decimal(data["contract_hours"] or base_week_hours) / Decimal("5")
+    rows = []
+    for (wk_start, wk_end), assignments, leaves in zip(
+        weeks, _sweep(data["assignments"], weeks), _sweep(data["leaves"], weeks),
+    ):
+        frac = Decimal((wk_end - wk_start).days + 1) / Decimal("7")
+        alloc = min(sum((a[2] for a in assignments), Decimal("0")), HUNDRED)
+        hours_per_week = sum((a[3] for a in assignments), Decimal("0")) if use_planned else Decimal(base_week_hours)
+        leave_days = sum((min(e, wk_end) - max(s, wk_start)).days + 1 for s, e in leaves)
+        rows.append({
+            "week_start": wk_start,
+            "week_end": wk_end,
+            "allocation_percent": alloc,
+            "capacity": Decimal(hours_per_week) * (alloc / HUNDRED) * frac,
+            "leave_hours": Decimal(leave_days) * per_leave_day,
+            "hours": data["logged"].get(week_start(wk_start), ZERO),
+        })
+    return rows
+
+
+def utilization_percent(hours, capacity):
+    return q2((hours / capacity * 100) if capacity > 0 else 0)
+
+
+def weekly_row(w):
+    """
+    A weekly_figures() row as reported: hours and capacity net of the week's
+    leave, rounded, with capacity never below zero.
+    """
+    capacity = max(q2(w["capacity"] - w["leave_hours"]), ZERO)
+    hours = q2(w["hours"])
+    return {
+        "week_start": w["week_start"], "week_end": w["week_end"],
+        "hours": hours, "capacity": capacity, "util_percent": utilization_percent(hours, capacity),
+        "allocation_percent": q2(w["allocation_percent"]),
+    }
+
+
+def total(weeks):
+    """
+    Totals of weekly_row()-style rows (or stored weekly records with the same
+    figures). Every range is aggregated this way, whether its weeks come from
+    records or are computed, so a week's leave never eats into another week.
+    (Before this engine, compute_utilization() netted the whole range's leave
+    against the whole range's capacity, so leave in an unassigned week used
+    to lower the capacity of the assigned ones.)
+    """
+    hours = q2(sum((w["hours"] for w in weeks), ZERO))
+    capacity = q2(sum((w["capacity"] for w in weeks), ZERO))
+    return {"hours": hours, "capacity": capacity, "util_percent": utilization_percent(hours, capacity)}
+
+
+def summarize(weeks):
+    """compute_utilization()-style totals for weekly_figures() rows."""
+    return total([weekly_row(w) for w in weeks])
+
+
+def employee_batches(employee_ids):
+    ids = list(dict.fromkeys(employee_ids))
+    size = _batch_size()
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def batch_weekly_utilization(employee_ids, start, end, project_id=None, **capacity_kwargs):
+    """
+    {employee_id: [{"week_start", "week_end", "hours", "capacity",
+    "util_percent", "allocation_percent"}, ...]} for every week of [start,
+    end]; see weekly_row(). Five queries per UTILIZATION_BATCH_SIZE employees.
+    """
+    out = {}
+    for ids in employee_batches(employee_ids):
+        for employee_id, data in load_utilization_inputs(ids, start, end, project_id).items():
+            out[employee_id] = [weekly_row(w) for w in weekly_figures(data, start, end, **capacity_kwargs)]
+    return out
+
+
+def batch_utilization(employee_ids, start, end, project_id=None, **capacity_kwargs):
+    """{employee_id: {"hours", "capacity", "util_percent"}} over [start, end]; see batch_weekly_utilization."""
+    out = {}
+    for ids in employee_batches(employee_ids):
+        for employee_id, data in load_utilization_inputs(ids, start, end, project_id).items():
+            out[employee_id] = summarize(weekly_figures(data, start, end, **capacity_kwargs))
+    return out
+
+
+def average_allocation(employee_ids, start, end):
+    """
+    {employee_id: mean weekly allocation % over [start, end]}, each week's
+    overlapping allocations summed and capped at 100; one assignments query
+    per UTILIZATION_BATCH_SIZE employees.
+    """
+    weeks = list(daterange_weeks(start, end))
+    out = {}
+    for ids in employee_batches(employee_ids):
+        assignments = defaultdict(list)
+        rows = ResourceAssignment.objects.filter(employee_id__in=ids, start_date__lte=end, end_date__gte=start) \
+            .values_list("employee_id", "start_date", "end_date", "allocation_percent").order_by()
+        for employee_id, *row in rows:
+            assignments[str(employee_id)].append(tuple(row))
+        for employee_id in ids:
+            weekly = [
+                min(sum((a[2] for a in active), Decimal("0")), HUNDRED)
+                for active in _sweep(assignments.get(str(employee_id), []), weeks)
+            ]
+            out[employee_id] = q2(sum(weekly, Decimal("0")) / len(weeks)) if weeks else Decimal("0")
+    return out
+
+
+def employee_utilization(employee_id, start, end, project_id=None, **capacity_kwargs):
+    """Weekly figures and totals for one employee; raises Employee.DoesNotExist like the per-employee helpers."""
+    inputs = load_utilization_inputs([employee_id], start, end, project_id)
+    if not inputs:
+        raise Employee.DoesNotExist(f"Employee {employee_id} does not exist")
+    weeks = weekly_figures(next(iter(inputs.values())), start, end, **capacity_kwargs)
+    return weeks, summarize(weeks)
+
+
+def data_version():
+    """
+    Stamp that changes whenever utilization inputs change; part of band cache
+    keys. It is read from the tables, so every process agrees on it: a write
+    moves its table's latest updated_at and a delete its row count.
+    """
+    stamp = tuple(
+        model.objects.aggregate(last=Max("updated_at"), rows=Count("pk"))
+        for model in (TaskTimeLog, ResourceAssignment, LeaveRequest, EmployeeContract, Employee)
+    )
+    return hashlib.sha256(repr(stamp).encode("utf-8")).hexdigest()
+
+
+def band(util_percent, over_threshold=OVER_THRESHOLD, under_threshold=UNDER_THRESHOLD):
+    if util_percent > over_threshold:
+        return "over"
+    if util_percent < under_threshold:
+        return "under"
+    return "optimal"
+
+
+def band_rows(employees, start, end, over_threshold=OVER_THRESHOLD, under_threshold=UNDER_THRESHOLD):
+    """
+    [{"employee_id", "code", "name", "hours", "capacity", "util_percent",
+    "band"}, ...] for an Employee queryset, from one employee query plus
+    fresh weekly records or batch computation (see utilization_totals).
+    """
+    from .utilization_records import utilization_totals
+
+    people = list(employees.values_list("id", "employee_code", "user__first_name", "user__last_name", "user__username"))
+    totals = utilization_totals([person[0] for person in people], start, end)
+    rows = []
+    for employee_id, code, first_name, last_name, username in people:
+        m = totals[employee_id]
+        rows.append({
+            "employee_id": str(employee_id), "code": code,
+            "name": f"{first_name} {last_name}".strip() or username,
+            "hours": float(m["hours"]), "capacity": float(m["capacity"]), "util_percent": float(m["util_percent"]),
+            "band": band(m["util_percent"], over_threshold, under_threshold),
+        })
+    return rows
+
+
+def organization_bands(organization_id, start, end, over_threshold=OVER_THRESHOLD, under_threshold=UNDER_THRESHOLD):
+    """
+    band_rows() for the organization's active employees, most utilized first,
+    cached per (organization, period, thresholds) and utilization data version.
+    """
+    key = "{}:{}:{}:{}:{}:{}:{}".format(
+        BANDS_KEY_PREFIX, data_version(), organization_id, start, end, over_threshold, under_threshold,
+    )
+    rows = cache.get(key)
+    if rows is None:
+        employees = Employee.objects.filter(organization_id=organization_id, status=Employee.Status.ACTIVE)
+        rows = band_rows(employees, start, end, over_threshold, under_threshold)
+        rows.sort(key=lambda row: (-row["util_percent"], row["code"]))
+        cache.set(key, rows, getattr(settings, "UTILIZATION_BAND_CACHE_TIMEOUT", 15 * 60))
+    return rows
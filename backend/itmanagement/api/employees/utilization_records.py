@@ -0,0 +1,245 @@
+"""
+Weekly UtilizationRecord pipeline.
+
+UtilizationRecord holds one row per employee and ISO week (Monday..Sunday).
+Signals on time logs, assignments, leave and contracts queue the weeks they
+touch in UtilizationDirtyWeek; refresh_utilization_records() recomputes just
+those weeks with the batch engine, shortly after the change (debounced
+through schedule_utilization_refresh()) and for the current week of every
+active employee. backfill_utilization_records() materializes any historical
+range.
+
+A record is fresh while its week is not queued. utilization_totals() sums
+fresh records for ranges made of whole weeks and computes everything else,
+so readers never see figures older than the last committed change. A run
+only dequeues the exact queue entries it read before computing; a week
+queued again meanwhile gets a new queued_at and stays queued.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Employee, UtilizationDirtyWeek, UtilizationRecord
+from .utilization import batch_utilization, batch_weekly_utilization, employee_batches, total, week_start
+
+logger = logging.getLogger(__name__)
+
+REFRESH_KEY = "employees:utilization_refresh"
+MAX_PERCENT = Decimal("9999.99")  # largest value UtilizationRecord.utilization_percent holds
+RECORD_FIELDS = ("hours_logged", "capacity_hours", "utilization_percent", "computed_at")
+
+
+def iso_weeks(start, end):
+    """Monday of every ISO week overlapping [start, end]."""
+    monday = week_start(start)
+    while monday <= end:
+        yield monday
+        monday += timedelta(days=7)
+
+
+def _horizon():
+    """Last day future weeks are queued for; assignments often run far ahead."""
+    return timezone.localdate() + timedelta(weeks=getattr(settings, "UTILIZATION_HORIZON_WEEKS", 26))
+
+
+def mark_weeks_dirty(employee_id, start, end):
+    """
+    Queue the employee's weeks overlapping [start, end] for recomputation. Weeks
+    past the horizon are only queued when a record for them was materialized.
+    """
+    if not employee_id or start > end:
+        return
+    horizon = _horizon()
+    weeks = set(iso_weeks(start, min(end, horizon)))
+    if end > horizon:
+        weeks.update(
+            UtilizationRecord.objects.filter(
+                employee_id=employee_id, period_start__gt=week_start(horizon),
+                period_start__range=(week_start(start), end),
+            ).values_list("period_start", flat=True)
+        )
+    now = timezone.now()
+    UtilizationDirtyWeek.objects.bulk_create(
+        [UtilizationDirtyWeek(employee_id=employee_id, week_start=monday, queued_at=now) for monday in sorted(weeks)],
+        batch_size=1000, update_conflicts=True, unique_fields=["employee", "week_start"], update_fields=["queued_at"],
+    )
+
+
+def mark_employee_dirty(employee_id):
+    """Queue every materialized week of the employee (contract hours apply to all of them)."""
+    now = timezone.now()
+    weeks = set(UtilizationRecord.objects.filter(employee_id=employee_id).values_list("period_start", flat=True))
+    weeks.add(week_start(timezone.localdate()))
+    UtilizationDirtyWeek.objects.bulk_create(
+        [UtilizationDirtyWeek(employee_id=employee_id, week_start=monday, queued_at=now) for monday in weeks],
+        batch_size=1000, update_conflicts=True, unique_fields=["employee", "week_start"], update_fields=["queued_at"],
+    )
+
+
+def schedule_utilization_refresh():
+    """
+    Drain the dirty-week queue in the background once the current transaction
+    commits, debounced: changes made while a refresh is pending ride along.
+    """
+    delay = getattr(settings, "UTILIZATION_REFRESH_DELAY", 60)
+
+    def enqueue():
+        if cache.add(REFRESH_KEY, True, delay + 300):
+            from .tasks import refresh_utilization_records_task
+            refresh_utilization_records_task(schedule=delay)
+
+    transaction.on_commit(enqueue)
+
+
+def write_records(weekly):
+    """Upsert batch_weekly_utilization() rows (whole weeks) as UtilizationRecords."""
+    now = timezone.now()
+    records = [
+        UtilizationRecord(
+            employee_id=employee_id, period_start=w["week_start"], period_end=w["week_start"] + timedelta(days=6),
+            hours_logged=w["hours"], capacity_hours=w["capacity"],
+            utilization_percent=min(w["util_percent"], MAX_PERCENT), computed_at=now,
+        )
+        for employee_id, weeks in weekly.items() for w in weeks
+    ]
+    UtilizationRecord.objects.bulk_create(
+        records, batch_size=1000, update_conflicts=True,
+        unique_fields=["employee", "period_start", "period_end"], update_fields=list(RECORD_FIELDS),
+    )
+    return len(records)
+
+
+def _claim(queued):
+    """{queued_at: [pk, ...]} for UtilizationDirtyWeek rows, read before their weeks are computed."""
+    claimed = defaultdict(list)
+    for pk, queued_at in queued:
+        claimed[queued_at].append(pk)
+    return claimed
+
+
+def _dequeue(claimed):
+    """Delete the claimed queue rows that were not queued again since (which moves queued_at)."""
+    if claimed:
+        UtilizationDirtyWeek.objects.filter(
+            reduce(or_, (Q(queued_at=queued_at, pk__in=pks) for queued_at, pks in claimed.items()))
+        ).delete()
+
+
+def refresh_utilization_records():
+    """
+    Recompute the queued weeks, UTILIZATION_BATCH_SIZE employees at a time,
+    plus the current week of active employees that have no record for it.
+    Weeks queued again while a batch is computed stay queued for the next run.
+    Returns the number of records written.
+    """
+    queued = defaultdict(list)
+    for pk, employee_id, monday, queued_at in UtilizationDirtyWeek.objects.values_list("pk", "employee_id", "week_start", "queued_at"):
+        queued[employee_id].append((pk, monday, queued_at))
+
+    written = 0
+    for ids in employee_batches(queued):
+        dirty = {employee_id: {monday for _, monday, _ in queued[employee_id]} for employee_id in ids}
+        first = min(min(weeks) for weeks in dirty.values())
+        last = max(max(weeks) for weeks in dirty.values()) + timedelta(days=6)
+        weekly = batch_weekly_utilization(ids, first, last)
+        with transaction.atomic():
+            written += write_records({
+                employee_id: [w for w in weeks if w["week_start"] in dirty[employee_id]]
+                for employee_id, weeks in weekly.items()
+            })
+            _dequeue(_claim((pk, queued_at) for employee_id in ids for pk, _, queued_at in queued[employee_id]))
+
+    monday = week_start(timezone.localdate())
+    missing = (
+        Employee.objects.filter(status=Employee.Status.ACTIVE)
+        .exclude(utilization_records__period_start=monday).values_list("id", flat=True)
+    )
+    written += backfill_utilization_records(monday, monday + timedelta(days=6), employee_ids=list(missing))
+    logger.info("Refreshed %d utilization records (%d employees queued)", written, len(queued))
+    return written
+
+
+def backfill_utilization_records(start, end, employee_ids=None):
+    """
+    Materialize every ISO week overlapping [start, end] for `employee_ids`
+    (default: all employees), dequeueing the weeks it recomputed. Returns the
+    number of records written.
+    """
+    first, last = week_start(start), week_start(end) + timedelta(days=6)
+    if employee_ids is None:
+        employee_ids = Employee.objects.order_by("pk").values_list("pk", flat=True)
+    written = 0
+    for ids in employee_batches(employee_ids):
+        claimed = _claim(
+            UtilizationDirtyWeek.objects.filter(employee_id__in=ids, week_start__range=(first, last))
+            .values_list("pk", "queued_at")
+        )
+        weekly = batch_weekly_utilization(ids, first, last)
+        with transaction.atomic():
+            written += write_records(weekly)
+            _dequeue(claimed)
+    return written
+
+
+def fresh_records(employee_ids, first_monday, last_monday):
+    """{employee_id: {monday: UtilizationRecord values}} for weekly records that are not queued."""
+    ids = list(employee_ids)
+    queued = set(
+        UtilizationDirtyWeek.objects.filter(employee_id__in=ids, week_start__range=(first_monday, last_monday))
+        .values_list("employee_id", "week_start")
+    )
+    out = defaultdict(dict)
+    rows = UtilizationRecord.objects.filter(
+        employee_id__in=ids, period_start__range=(first_monday, last_monday),
+    ).values("employee_id", "period_start", "period_end", *RECORD_FIELDS)
+    for row in rows:
+        key = (row["employee_id"], row["period_start"])
+        if row["period_start"].weekday() == 0 and row["period_end"] == row["period_start"] + timedelta(days=6) and key not in queued:
+            out[row["employee_id"]][row["period_start"]] = row
+    return out
+
+
+def utilization_record(employee_id, monday):
+    """
+    The employee's UtilizationRecord for the week starting `monday`,
+    recomputed first when missing or queued. Returns (record, computed).
+    """
+    sunday = monday + timedelta(days=6)
+    if fresh_records([employee_id], monday, monday).get(employee_id):
+        return UtilizationRecord.objects.get(employee_id=employee_id, period_start=monday, period_end=sunday), False
+    backfill_utilization_records(monday, sunday, employee_ids=[employee_id])
+    return UtilizationRecord.objects.get(employee_id=employee_id, period_start=monday, period_end=sunday), True
+
+
+def utilization_totals(employee_ids, start, end):
+    """
+    {employee_id: {"hours", "capacity", "util_percent"}} over [start, end],
+    aggregated with utilization.total() like batch_utilization(). Ranges made
+    of whole ISO weeks are read from fresh records where an employee has one
+    for every week and computed otherwise; other ranges are computed.
+    """
+    ids = list(dict.fromkeys(employee_ids))
+    if start > end or start.weekday() != 0 or end.weekday() != 6:
+        return batch_utilization(ids, start, end)
+
+    weeks = list(iso_weeks(start, end))
+    out = {}
+    for batch in employee_batches(ids):
+        for employee_id, by_week in fresh_records(batch, weeks[0], weeks[-1]).items():
+            if len(by_week) == len(weeks):
+                out[employee_id] = total([
+                    {"hours": r["hours_logged"], "capacity": r["capacity_hours"]} for r in by_week.values()
+                ])
+        stale = [employee_id for employee_id in batch if employee_id not in out]
+        for employee_id, rows in batch_weekly_utilization(stale, start, end).items():
+            out[employee_id] = total(rows)
+    return out
@@ -51,91 +51,21 @@ def certifications_expiring_within(days=30):
 
 
 
-@transaction.atomic
-def generate_payslip_for_employee(run: PayrollRun, employee: Employee):
-    cfg = PayrollConfig.objects.first()  
-    base = q2(employee.base_salary)
-
-
-    basic = q2(base * cfg.basic_percent / Decimal("100"))
-    hra = q2(base * cfg.hra_percent / Decimal("100"))
-
-    ot_hours = OvertimeRecord.objects.filter(
-        employee=employee, date__gte=run.period_start, date__lte=run.period_end
-    ).aggregate(total=Sum("hours"))["total"] or Decimal("0.00")
-    overtime_pay = q2(ot_hours * cfg.overtime_hour_rate)
-
-    # Calculate leave deductions
-    leave_days = 0
-    unpaid_leave_days = 0
-    approved_leaves = LeaveRequest.objects.filter(
-        employee=employee, 
-        status=LeaveRequest.Status.APPROVED,
-        start_date__lte=run.period_end, 
-        end_date__gte=run.period_start
-    )
-    
-    for leave in approved_leaves:
-        overlap_start = max(leave.start_date, run.period_start)
-        overlap_end = min(leave.end_date, run.period_end)
-        days_in_period = (overlap_end - overlap_start).days + 1
-        leave_days += days_in_period
-        
-        # Check if this leave type is unpaid (doesn't accrue balance)
-        if not leave.leave_type.accrual_per_month or leave.leave_type.accrual_per_month == 0:
-            unpaid_leave_days += days_in_period
-
-    # Calculate per-day salary deduction for unpaid leave
-    working_days_in_month = 22  # Standard working days
-    daily_salary = q2(base / working_days_in_month)
-    leave_deduction = q2(daily_salary * unpaid_leave_days)
-
-    gross = q2(basic + hra + overtime_pay - leave_deduction)
-
-    pf_emp = q2(basic * cfg.pf_employee_percent / Decimal("100"))
-    esi_emp = q2(gross * cfg.esi_employee_percent / Decimal("100"))
-    income_tax = q2(gross * cfg.income_tax_percent / Decimal("100")) 
-
-    deductions = q2(pf_emp + esi_emp + income_tax + leave_deduction)
-    net = q2(gross - deductions)
-
-    line_items = {
-        "structure": {"basic": float(basic), "hra": float(hra)},
-        "overtime": {"hours": float(ot_hours), "amount": float(overtime_pay)},
-        "leave": {
-            "total_leave_days": int(leave_days),
-            "unpaid_leave_days": int(unpaid_leave_days),
-            "daily_salary": float(daily_salary),
-            "leave_deduction": float(leave_deduction)
-        },
-        "deductions": {
-            "pf_employee": float(pf_emp),
-            "esi_employee": float(esi_emp),
-            "income_tax": float(income_tax),
-            "leave_deduction": float(leave_deduction),
-        },
-        "gross": float(gross),
-        "net": float(net),
-    }
-
+def generate_payslip_for_employee(run: PayrollRun, employee: Employee, cfg=None):
+    from .payroll import compute_payslip, load_payroll_inputs, payroll_config
+    (_, base, ot_hours, leaves), = load_payroll_inputs([(employee.pk, employee.base_salary)], run.period_start, run.period_end)
+    fields = compute_payslip(base, ot_hours, leaves, run.period_start, run.period_end, cfg or payroll_config())
     payslip, _ = Payslip.objects.update_or_create(
         payroll_run=run, employee=employee,
-        defaults=dict(
-            status=Payslip.Status.FINAL,
-            gross=gross, basic=basic, hra=hra, overtime_pay=overtime_pay,
-            pf_employee=pf_emp, esi_employee=esi_emp, income_tax=income_tax,
-            other_deductions=leave_deduction, net_pay=net, line_items=line_items
-        )
+        defaults=dict(status=Payslip.Status.FINAL, **fields),
     )
     return payslip
 
 
-@transaction.atomic
-def generate_payroll_run(period_start, period_end, processed_by):
-    run = PayrollRun.objects.create(period_start=period_start, period_end=period_end, processed_by=processed_by)
-    for emp in Employee.objects.filter(status=Employee.Status.ACTIVE):
-        generate_payslip_for_employee(run, emp)
-    return run
+def generate_payroll_run(period_start, period_end, processed_by, **kwargs):
+    """Chunked, resumable payroll for all active employees; see payroll.run_payroll."""
+    from .payroll import run_payroll
+    return run_payroll(period_start, period_end, processed_by=processed_by, **kwargs)
 
 def daterange_weeks(start: date, end: date):
     """Yield (wk_start, wk_end) tuples (Mon..Sun)."""
@@ -149,7 +79,7 @@ def daterange_weeks(start: date, end: date):
 
 def hours_logged(employee_id, start, end, project_id: int | None = None) -> Decimal:
     qs = TaskTimeLog.objects.filter(
-        user_id=Employee.objects.get(id=employee_id).user_id,
+        user__employee_profile__id=employee_id,
         date__gte=start, date__lte=end
     )
     if project_id:
@@ -172,84 +102,31 @@ def weekly_capacity_hours(
     If use_planned=True, use assignment.planned_hours_per_week * allocation%; otherwise fallback to base_week_hours * sum(allocation%).
     Prorates partial weeks by overlap days/7 and subtracts approved leave at (contract_week_hours/5) per day.
     """
-    emp = Employee.objects.get(id=employee_id)
-    total = Decimal("0.00")
-
-    contract_week_hours = getattr(
-        EmployeeContract.objects.filter(employee=emp, status=EmployeeContract.Status.ACTIVE).order_by("-start_date").first(),
-        "weekly_hours",
-    ) or base_week_hours
-
-
-    leave_days = 0
-    approved = LeaveRequest.objects.filter(
-        employee=emp, status=LeaveRequest.Status.APPROVED,
-        start_date__lte=end, end_date__gte=start
+    from .utilization import employee_utilization
+    _, totals = employee_utilization(
+        employee_id, start, end, project_id=project_id, base_week_hours=base_week_hours, use_planned=use_planned,
     )
-    for lv in approved:
-        s = max(lv.start_date, start); e = min(lv.end_date, end)
-        leave_days += (e - s).days + 1
-    leave_hours = Decimal(leave_days) * (Decimal(contract_week_hours) / Decimal("5"))
-
-    assignments = ResourceAssignment.objects.filter(
-        employee=emp, start_date__lte=end, end_date__gte=start
-    )
-    if project_id:
-        assignments = assignments.filter(project_id=project_id)
-
-    for wk_start, wk_end in daterange_weeks(start, end):
-        overlap_start = max(wk_start, start); overlap_end = min(wk_end, end)
-        days = (overlap_end - overlap_start).days + 1
-        frac = Decimal(days) / Decimal("7")
-
-        if use_planned:
-            qs = assignments.filter(start_date__lte=wk_end, end_date__gte=wk_start)
-            alloc = qs.aggregate(p=Sum("allocation_percent"))["p"] or Decimal("0")
-            alloc = min(alloc, Decimal("100"))
-            planned_sum = qs.aggregate(h=Sum("planned_hours_per_week"))["h"] or Decimal("0")
-            week_cap = (Decimal(planned_sum) * (alloc / Decimal("100"))) * frac
-        else:
-            alloc = assignments.filter(start_date__lte=wk_end, end_date__gte=wk_start)\
-                               .aggregate(p=Sum("allocation_percent"))["p"] or Decimal("0")
-            alloc = min(alloc, Decimal("100"))
-            week_cap = (Decimal(base_week_hours) * (alloc / Decimal("100"))) * frac
-
-        total += week_cap
-
-    total = q2(total - leave_hours)
-    return total if total > 0 else Decimal("0.00")
+    return totals["capacity"]
 
 def compute_utilization(employee_id, start, end, project_id=None):
     """
     Calculate utilization for an employee between start and end dates.
     Returns dict with hours, capacity, and utilization %.
     """
-    hours = hours_logged(employee_id, start, end, project_id=project_id)
-    capacity = weekly_capacity_hours(
-        employee_id, start, end, project_id=project_id, use_planned=True
-    )
-    util = q2((hours / capacity * 100) if capacity > 0 else 0)
-
-    return {
-        "hours": hours,
-        "capacity": capacity,
-        "util_percent": util,
-    }
+    from .utilization import employee_utilization
+    _, totals = employee_utilization(employee_id, start, end, project_id=project_id)
+    return totals
 
 
 def utilization_band(employees_qs, start, end, over_threshold=Decimal("100"), under_threshold=Decimal("60")):
     """
     Classify employees: over/under/optimal utilization.
     """
-    over, under, optimal = [], [], []
-    for emp in employees_qs:
-        m = compute_utilization(emp.id, start, end)
-        rec = {"employee_id": str(emp.id), "code": emp.employee_code, "name": emp.user.get_full_name() or emp.user.username,
-               "hours": float(m["hours"]), "capacity": float(m["capacity"]), "util_percent": float(m["util_percent"])}
-        if m["util_percent"] > over_threshold: over.append(rec)
-        elif m["util_percent"] < under_threshold: under.append(rec)
-        else: optimal.append(rec)
-    return {"over": over, "under": under, "optimal": optimal}
+    from .utilization import band_rows
+    bands = {"over": [], "under": [], "optimal": []}
+    for rec in band_rows(employees_qs, start, end, over_threshold, under_threshold):
+        bands[rec.pop("band")].append(rec)
+    return bands
 
 def _date_overlap(a_start: date, a_end: date, b_start: date, b_end: date) -> bool:
     return not (a_end < b_start or b_end < a_start)
@@ -259,21 +136,8 @@ def _current_assignment_load_percent(employee_id, start, end) -> Decimal:
     Sum allocation% across overlapping assignments per week and average it (capped at 100).
     Returns a percent (0..100).
     """
-    weeks = list(daterange_weeks(start, end))
-    if not weeks:
-        return Decimal("0")
-
-    assigns = ResourceAssignment.objects.filter(
-        employee_id=employee_id, start_date__lte=end, end_date__gte=start
-    )
-
-    weekly_totals = []
-    for wk_start, wk_end in weeks:
-        pct = assigns.filter(start_date__lte=wk_end, end_date__gte=wk_start) \
-                     .aggregate(p=Sum("allocation_percent"))["p"] or Decimal("0")
-        weekly_totals.append(min(pct, Decimal("100")))
-    avg = sum(weekly_totals, Decimal("0")) / Decimal(len(weekly_totals))
-    return q2(avg)
+    from .utilization import average_allocation
+    return average_allocation([employee_id], start, end)[employee_id]
 
 
 def recommend_employees(
@@ -322,12 +186,23 @@ def recommend_employees(
     min_levels = {str(r["skill_id"]): int(r.get("min_level", 3)) for r in requirements}
     req_count = len(skill_ids)
 
+    from .utilization import average_allocation
+    from .utilization_records import utilization_totals
+
     base_ids = EmployeeSkill.objects.filter(skill_id__in=skill_ids) \
                                     .values_list("employee_id", flat=True).distinct()
 
+    candidates = list(Employee.objects.filter(id__in=base_ids).select_related("user"))
+    skills_by_employee = {}
+    for s in EmployeeSkill.objects.filter(employee__in=candidates, skill_id__in=skill_ids):
+        skills_by_employee.setdefault(s.employee_id, []).append(s)
+    ids = [emp.id for emp in candidates]
+    utilization = utilization_totals(ids, start, end)
+    allocation = average_allocation(ids, start, end)
+
     results = []
-    for emp in Employee.objects.filter(id__in=base_ids).select_related("user"):
-        skills = list(EmployeeSkill.objects.filter(employee=emp, skill_id__in=skill_ids))
+    for emp in candidates:
+        skills = skills_by_employee.get(emp.id, [])
         have = {str(s.skill_id): s for s in skills}
 
         covered = sum(1 for sid in skill_ids if str(sid) in have)
@@ -342,7 +217,7 @@ def recommend_employees(
                 fit_parts.append(min(1.0, lvl / min_req))
         level_fit = (sum(fit_parts) / len(fit_parts)) if fit_parts else 0.0
 
-        util = compute_utilization(emp.id, start, end) 
+        util = utilization[emp.id]
         free_capacity = float(max(Decimal("0.00"), util["capacity"] - util["hours"])) 
         free_capacity_score = float(min(1.0, (free_capacity / float(desired_hours_per_week))) if desired_hours_per_week > 0 else 0.0)
 
@@ -350,7 +225,7 @@ def recommend_employees(
         utilization_score = max(0.0, min(1.0, (100.0 - util_percent) / 100.0))
 
         if exclude_heavily_booked:
-            avg_planned_pct = float(_current_assignment_load_percent(emp.id, start, end))
+            avg_planned_pct = float(allocation[emp.id])
             if avg_planned_pct >= float(heavy_booking_threshold_percent):
                 continue
 
@@ -373,7 +248,7 @@ def recommend_employees(
             "weights_used": norm_w,
             "details": {
                 "desired_hours_per_week": float(desired_hours_per_week),
-                "avg_planned_allocation_percent": float(_current_assignment_load_percent(emp.id, start, end)),
+                "avg_planned_allocation_percent": float(allocation[emp.id]),
                 "skills_present": [
                     {
                         "skill_id": str(s.skill_id),
@@ -1,3 +1,4 @@
+import uuid
 from rest_framework import generics, status, permissions
 from rest_framework.response import Response
 from django.contrib.auth.hashers import make_password
@@ -438,9 +439,57 @@ class GeneratePayrollRunView(generics.GenericAPIView):
         period_start = datetime.strptime(ps, "%Y-%m-%d").date()
         period_end = datetime.strptime(pe, "%Y-%m-%d").date()
         run = generate_payroll_run(period_start, period_end, processed_by=request.user)
+        if run.status == PayrollRun.Status.FAILED:
+            # resumable: posting the period again continues after the last committed chunk
+            return Response(PayrollRunSerializer(run).data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if run.status == PayrollRun.Status.ABANDONED:
+            # a fresh run for the period replaced this one meanwhile
+            return Response(PayrollRunSerializer(run).data, status=status.HTTP_409_CONFLICT)
         return Response(PayrollRunSerializer(run).data, status=status.HTTP_201_CREATED)
 
 
+class PayrollSimulationView(APIView):
+    """
+    POST {"period_start", "period_end", "config": {<PayrollConfig field>: value}, "compare_to": <run id>}
+    Computes the period's payslips with the config overrides applied, writes
+    nothing, and returns per-employee gross/net/deduction deltas against
+    `compare_to` (default: the latest completed earlier run).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        from .payroll import CONFIG_FIELDS, simulate_payroll
+        try:
+            period_start = datetime.strptime(request.data.get("period_start", ""), "%Y-%m-%d").date()
+            period_end = datetime.strptime(request.data.get("period_end", ""), "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return Response({"error": "period_start and period_end are required (YYYY-MM-DD)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        overrides = request.data.get("config") or {}
+        if not isinstance(overrides, dict):
+            return Response({"error": "config must be an object of PayrollConfig fields"}, status=status.HTTP_400_BAD_REQUEST)
+        unknown = set(overrides) - set(CONFIG_FIELDS)
+        if unknown:
+            return Response({"error": f"Unknown config fields: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            overrides = {name: Decimal(str(value)) for name, value in overrides.items()}
+        except ArithmeticError:
+            return Response({"error": "Config values must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        # Decimal() accepts "NaN" and "Infinity", which would poison every payslip
+        if not all(value.is_finite() for value in overrides.values()):
+            return Response({"error": "Config values must be finite numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        compare_to = None
+        if request.data.get("compare_to"):
+            try:
+                compare_to_id = uuid.UUID(str(request.data["compare_to"]))
+            except ValueError:
+                return Response({"error": "compare_to must be a payroll run id"}, status=status.HTTP_400_BAD_REQUEST)
+            compare_to = get_object_or_404(PayrollRun, pk=compare_to_id)
+        result = simulate_payroll(period_start, period_end, config_overrides=overrides, compare_to=compare_to)
+        return Response(result)
+
+
 class PayslipListView(generics.ListAPIView):
     queryset = Payslip.objects.select_related("employee", "payroll_run")
     serializer_class = PayslipSerializer
@@ -534,30 +583,83 @@ class UtilizationReportView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        util_data = compute_utilization(emp.id, week_start, week_end)
-
-        record, created = UtilizationRecord.objects.update_or_create(
-            employee=emp,
-            period_start=week_start,
-            defaults={
-                "period_end": week_end,
-                "hours_logged": util_data["hours"],
-                "utilization_percent": util_data["util_percent"],
-            }
-        )
+        # served from the weekly record unless it is missing or queued for recomputation
+        from .utilization_records import utilization_record
+        record, created = utilization_record(emp.id, week_start)
 
         return Response({
             "employee_id": str(emp.id),
             "employee_name": str(emp),
             "week_start": week_start,
             "week_end": week_end,
-            "hours_logged": util_data["hours"],
-            "capacity_hours": util_data["capacity"],
-            "utilization_percent": util_data["util_percent"],
+            "hours_logged": record.hours_logged,
+            "capacity_hours": record.capacity_hours,
+            "utilization_percent": record.utilization_percent,
             "record_created": created,
+            "computed_at": record.computed_at,
         })
 
 
+class UtilizationBandView(APIView):
+    """
+    GET ?start=&end=[&organization=][&band=over|under|optimal][&ordering=util_percent|-util_percent]
+    [&over=100&under=60][&limit=&offset=]
+    Utilization bands for every active employee of the organization (default:
+    the requester's own), most utilized first, paginated with limit/offset.
+    Only staff may ask for an organization other than their own.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        from rest_framework.pagination import LimitOffsetPagination
+        from .utilization import OVER_THRESHOLD, UNDER_THRESHOLD, organization_bands
+
+        try:
+            start = datetime.strptime(request.query_params.get("start", ""), "%Y-%m-%d").date()
+            end = datetime.strptime(request.query_params.get("end", ""), "%Y-%m-%d").date()
+        except ValueError:
+            return Response({"error": "start and end are required (YYYY-MM-DD)"}, status=status.HTTP_400_BAD_REQUEST)
+        if end < start:
+            return Response({"error": "end must not be before start"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            over = Decimal(request.query_params.get("over", OVER_THRESHOLD))
+            under = Decimal(request.query_params.get("under", UNDER_THRESHOLD))
+        except ArithmeticError:
+            return Response({"error": "over and under must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        if not (over.is_finite() and under.is_finite()):
+            return Response({"error": "over and under must be finite numbers"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # employees see their organization's bands and partners their firm's; staff see any
+        own = set(Employee.objects.filter(user=request.user).values_list("organization_id", flat=True))
+        own |= set(Partner.objects.filter(user=request.user).values_list("organization_id", flat=True))
+        organization_id = request.query_params.get("organization")
+        if organization_id:
+            try:
+                organization_id = uuid.UUID(organization_id)
+            except ValueError:
+                return Response({"error": "organization must be a UUID"}, status=status.HTTP_400_BAD_REQUEST)
+        elif len(own) == 1:
+            organization_id, = own
+        else:
+            return Response({"error": "organization is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if not request.user.is_staff and organization_id not in own:
+            return Response({"error": "You can only view your own organization"}, status=status.HTTP_403_FORBIDDEN)
+        organization = get_object_or_404(Organization, pk=organization_id)
+
+        rows = organization_bands(organization.pk, start, end, over, under)
+        band = request.query_params.get("band")
+        if band:
+            rows = [row for row in rows if row["band"] == band]
+        if request.query_params.get("ordering") == "util_percent":
+            rows = rows[::-1]
+
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        if page is None:
+            return Response(rows)
+        return paginator.get_paginated_response(page)
+
+
 class CrossProjectSplitView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:39
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def drop_duplicate_reports(apps, schema_editor):
+    """Keep the newest row per (category, period); update_or_create could race into duplicates."""
+    ExpenseReport = apps.get_model("expense", "ExpenseReport")
+    duplicated = (
+        ExpenseReport.objects.values("category_id", "period_start", "period_end")
+        .annotate(rows=Count("id")).filter(rows__gt=1)
+    )
+    for group in duplicated:
+        rows = ExpenseReport.objects.filter(
+            category_id=group["category_id"], period_start=group["period_start"], period_end=group["period_end"],
+        ).order_by("-created_at")
+        ExpenseReport.objects.filter(pk__in=list(rows.values_list("pk", flat=True)[1:])).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expense', '0003_expense_period'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_reports, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='expensereport',
+            unique_together={('category', 'period_start', 'period_end')},
+        ),
+    ]
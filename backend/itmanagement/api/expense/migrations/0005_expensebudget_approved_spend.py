@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:41
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_approved_spend(apps, schema_editor):
+    Expense = apps.get_model("expense", "Expense")
+    ExpenseBudget = apps.get_model("expense", "ExpenseBudget")
+    spend = (
+        Expense.objects.filter(
+            category_id=OuterRef("category_id"), status="Approved",
+            created_at__date__gte=OuterRef("start_date"), created_at__date__lte=OuterRef("end_date"),
+        )
+        .values("category_id").annotate(total=Sum("amount")).values("total")
+    )
+    ExpenseBudget.objects.update(
+        approved_spend=Coalesce(Subquery(spend), Value(Decimal("0.00")), output_field=DecimalField(max_digits=14, decimal_places=2))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expense', '0004_expensereport_unique_period'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensebudget',
+            name='approved_spend',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=14),
+        ),
+        migrations.RunPython(count_approved_spend, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,6 @@
 import uuid
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from api.financial_analytics.models import CostCenter
@@ -25,6 +25,8 @@ class ExpenseBudget(models.Model):
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     start_date = models.DateField()
     end_date = models.DateField()
+    # approved expenses of the category dated inside the window, kept current by the expense signals
+    approved_spend = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"), editable=False)
     class Meta:
         unique_together = ("category", "start_date", "end_date")
     def __str__(self):
@@ -63,6 +65,11 @@ class Expense(models.Model):
     def __str__(self):
         return f"{self.title} | {self.amount} | {self.status}"
 
+    def save(self, *args, **kwargs):
+        # budget spend counters are adjusted in post_save; keep both in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class PartnerExpenseAllocation(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -85,6 +92,8 @@ class ExpenseReport(models.Model):
     period_start = models.DateField()
     period_end = models.DateField()
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        unique_together = ("category", "period_start", "period_end")
     def __str__(self):
         return f"{self.category.name} | {self.period_start} → {self.period_end} | OverBudget={self.over_budget}"
 
@@ -21,6 +21,16 @@ class PartnerExpenseAllocationSerializer(serializers.ModelSerializer):
         fields = ["id", "partner", "partner_username", "amount"]
 
 
+class ExpenseListSerializer(serializers.ListSerializer):
+    """Loads the budget windows of every listed category once for the over_budget column."""
+
+    def to_representation(self, data):
+        from .utils import budget_windows
+        expenses = list(data.all() if hasattr(data, "all") else data)
+        self.child.context["budget_windows"] = budget_windows({e.category_id for e in expenses if e.category_id})
+        return super().to_representation(expenses)
+
+
 class ExpenseSerializer(serializers.ModelSerializer):
     allocations = PartnerExpenseAllocationSerializer(many=True, read_only=True)
     submitted_by_username = serializers.ReadOnlyField(source="submitted_by.username")
@@ -31,10 +41,14 @@ class ExpenseSerializer(serializers.ModelSerializer):
         model = Expense
         fields = "__all__"
         read_only_fields = ["status", "submitted_by", "approved_by", "created_at", "updated_at", "allocations"]
+        list_serializer_class = ExpenseListSerializer
 
     def get_over_budget(self, obj):
-        from .utils import validate_expense_budget
-        return validate_expense_budget(obj)
+        from .utils import is_over_budget, validate_expense_budget
+        windows = self.context.get("budget_windows")
+        if windows is None:
+            return validate_expense_budget(obj)
+        return is_over_budget(obj, windows.get(obj.category_id, []))
     
     def validate_amount(self, value):
         if value <= 0:
@@ -0,0 +1,41 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Expense, ExpenseBudget
+from .utils import budget_contribution, adjust_budget_spend, recount_budget_spend, stored_budget_contribution
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_delete, sender=Expense)
+def _lock_budget_contribution(sender, instance, **kwargs):
+    # Expense.save() and deletes run in a transaction, which holds the row lock until the counters are adjusted
+    instance._budget_contribution = None if instance._state.adding else stored_budget_contribution(instance.pk)
+
+
+@receiver(post_save, sender=Expense)
+def _expense_saved(sender, instance, **kwargs):
+    """Move the expense's amount between budget spend counters on approval, rejection and edits."""
+    previous, current = getattr(instance, "_budget_contribution", None), budget_contribution(instance)
+    if previous != current:
+        if previous:
+            adjust_budget_spend(previous[0], previous[1], -previous[2])
+        if current:
+            adjust_budget_spend(*current)
+    instance._budget_contribution = current
+
+
+@receiver(post_delete, sender=Expense)
+def _expense_deleted(sender, instance, **kwargs):
+    previous = getattr(instance, "_budget_contribution", None)
+    if previous:
+        adjust_budget_spend(previous[0], previous[1], -previous[2])
+
+
+@receiver(post_save, sender=ExpenseBudget)
+def _count_budget_spend(sender, instance, **kwargs):
+    """
+    Budget writes are rare, so each one recounts its window instead of
+    trusting the in-memory counter, which the expense signals update in SQL.
+    """
+    recount_budget_spend(instance.pk)
+    instance.refresh_from_db(fields=["approved_spend"])
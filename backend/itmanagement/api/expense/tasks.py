@@ -0,0 +1,19 @@
+import logging
+from datetime import date
+
+from background_task import background
+from django.core.cache import cache
+
+from .utils import refresh_expense_reports, _report_refresh_key
+
+logger = logging.getLogger(__name__)
+
+
+@background(schedule=0)
+def refresh_expense_reports_task(start_date, end_date):
+    """Background task: regenerate stored expense reports overlapping the dates (see schedule_expense_report_refresh)."""
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    # release the debounce slot first so changes made during the refresh queue another one
+    cache.delete(_report_refresh_key(start_date, end_date))
+    count = refresh_expense_reports(start_date, end_date)
+    logger.info("Refreshed %d expense report periods overlapping %s..%s", count, start_date, end_date)
@@ -1,3 +1,216 @@
-from django.test import TestCase
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.users.models import User
+from .models import Expense, ExpenseBudget, ExpenseCategory, ExpenseReport
+from .utils import generate_expense_report, rebuild_budget_spend, refresh_expense_reports, schedule_expense_report_refresh
+
+MARCH = (date(2025, 3, 1), date(2025, 3, 31))
+
+
+def make_user(username="submitter", **fields):
+    return User.objects.create(username=username, user_type="employee", **fields)
+
+
+def make_expense(category, amount, day, status=Expense.Status.APPROVED, user=None):
+    """Expense dated `day` (created_at is auto_now_add, so it is moved afterwards)."""
+    user = user or User.objects.get_or_create(username="submitter", defaults={"user_type": "employee"})[0]
+    expense = Expense.objects.create(title="Taxi", amount=Decimal(amount), category=category, submitted_by=user, status=status)
+    Expense.objects.filter(pk=expense.pk).update(created_at=timezone.make_aware(datetime.combine(day, datetime.min.time())))
+    expense.refresh_from_db()
+    return expense
+
+
+class ExpenseReportTests(TestCase):
+    def setUp(self):
+        self.travel = ExpenseCategory.objects.create(name="Travel")
+        self.meals = ExpenseCategory.objects.create(name="Meals")
+        ExpenseBudget.objects.create(category=self.travel, amount=Decimal("100.00"), start_date=date(2025, 3, 1), end_date=date(2025, 3, 31))
+        ExpenseBudget.objects.create(category=self.travel, amount=Decimal("50.00"), start_date=date(2025, 2, 15), end_date=date(2025, 3, 5))
+        ExpenseBudget.objects.create(category=self.meals, amount=Decimal("10.00"), start_date=date(2025, 3, 1), end_date=date(2025, 3, 31))
+
+    def _rows(self):
+        return {
+            r.category_id: (r.total_budget, r.total_expense, r.percentage_used, r.over_budget)
+            for r in ExpenseReport.objects.filter(period_start=MARCH[0], period_end=MARCH[1])
+        }
+
+    def test_budgets_and_approved_spend_per_category(self):
+        make_expense(self.travel, "60.00", date(2025, 3, 31))  # the last day of the period counts
+        make_expense(self.travel, "500.00", date(2025, 3, 10), status=Expense.Status.PENDING)
+        make_expense(self.travel, "40.00", date(2025, 4, 1))
+        make_expense(self.meals, "200.00", date(2025, 3, 2))
+
+        with self.assertNumQueries(3):
+            generate_expense_report(*MARCH)
+
+        self.assertEqual(self._rows(), {
+            self.travel.pk: (Decimal("150.00"), Decimal("60.00"), Decimal("40.00"), False),
+            # 2000% does not fit the column
+            self.meals.pk: (Decimal("10.00"), Decimal("200.00"), Decimal("999.99"), True),
+        })
+
+    def test_regenerating_updates_the_stored_rows(self):
+        generate_expense_report(*MARCH)
+        make_expense(self.travel, "30.00", date(2025, 3, 3))
+
+        generate_expense_report(*MARCH)
+
+        self.assertEqual(ExpenseReport.objects.count(), 2)
+        self.assertEqual(self._rows()[self.travel.pk][1], Decimal("30.00"))
+
+    def test_refresh_only_touches_overlapping_periods(self):
+        generate_expense_report(*MARCH)
+        generate_expense_report(date(2025, 5, 1), date(2025, 5, 31))
+        make_expense(self.travel, "30.00", date(2025, 3, 3))
+
+        self.assertEqual(refresh_expense_reports(date(2025, 3, 3), date(2025, 3, 3)), 1)
+        self.assertEqual(self._rows()[self.travel.pk][1], Decimal("30.00"))
+
+    def test_refreshes_are_debounced(self):
+        cache.clear()
+        with mock.patch("api.expense.tasks.refresh_expense_reports_task") as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_expense_report_refresh(date(2025, 3, 3))
+                schedule_expense_report_refresh(date(2025, 3, 3))
+
+        task.assert_called_once_with("2025-03-03", "2025-03-03", schedule=30)
+
+    def test_report_view_computes_a_new_period_once(self):
+        client = APIClient()
+        client.force_authenticate(make_user("viewer"))
+        make_expense(self.travel, "60.00", date(2025, 3, 20))
+        params = {"start_date": "2025-03-01", "end_date": "2025-03-31"}
+
+        response = client.get(reverse("expense-report"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+        with mock.patch("api.expense.views.generate_expense_report") as generate:
+            client.get(reverse("expense-report"), params)
+        generate.assert_not_called()
+
+
+class BudgetSpendTests(TestCase):
+    def setUp(self):
+        self.travel = ExpenseCategory.objects.create(name="Travel")
+        self.march = ExpenseBudget.objects.create(category=self.travel, amount=Decimal("100.00"), start_date=date(2025, 3, 1), end_date=date(2025, 3, 31))
+        self.quarter = ExpenseBudget.objects.create(category=self.travel, amount=Decimal("300.00"), start_date=date(2025, 1, 1), end_date=date(2025, 3, 31))
+        self.expense = make_expense(self.travel, "40.00", date(2025, 3, 10), status=Expense.Status.PENDING)
+
+    def _spend(self):
+        return dict(ExpenseBudget.objects.values_list("start_date", "approved_spend"))
+
+    def _approve(self, expense):
+        expense.status = Expense.Status.APPROVED
+        expense.save()
+
+    def test_counters_follow_approval_edits_and_deletes(self):
+        self._approve(self.expense)
+        self.assertEqual(self._spend(), {date(2025, 3, 1): Decimal("40.00"), date(2025, 1, 1): Decimal("40.00")})
+
+        self.expense.amount = Decimal("25.00")
+        self.expense.save()
+        self.assertEqual(self._spend()[date(2025, 3, 1)], Decimal("25.00"))
+
+        self.expense.status = Expense.Status.REJECTED
+        self.expense.save()
+        self.assertEqual(self._spend()[date(2025, 3, 1)], Decimal("0.00"))
+
+        self._approve(self.expense)
+        self.expense.delete()
+        self.assertEqual(self._spend(), {date(2025, 3, 1): Decimal("0.00"), date(2025, 1, 1): Decimal("0.00")})
+
+    def test_rebuild_recounts_writes_that_skipped_the_signals(self):
+        Expense.objects.filter(pk=self.expense.pk).update(status=Expense.Status.APPROVED)
+
+        rebuild_budget_spend()
+
+        self.assertEqual(self._spend(), {date(2025, 3, 1): Decimal("40.00"), date(2025, 1, 1): Decimal("40.00")})
+
+    def test_stale_copies_approve_once(self):
+        first, second = Expense.objects.get(pk=self.expense.pk), Expense.objects.get(pk=self.expense.pk)
+
+        self._approve(first)
+        self._approve(second)
+
+        self.assertEqual(self._spend()[date(2025, 3, 1)], Decimal("40.00"))
+        second.status = Expense.Status.REJECTED
+        second.save()
+        first.delete()
+        self.assertEqual(self._spend()[date(2025, 3, 1)], Decimal("0.00"))
+
+    def test_budget_saves_recount_their_window(self):
+        stale = ExpenseBudget.objects.get(pk=self.march.pk)
+        self._approve(self.expense)
+
+        stale.amount = Decimal("120.00")
+        stale.save()
+
+        self.assertEqual(stale.approved_spend, Decimal("40.00"))
+        self.assertEqual(self._spend()[date(2025, 3, 1)], Decimal("40.00"))
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentBudgetSpendTests(TransactionTestCase):
+    def _run(self, *targets):
+        errors = []
+        barrier = threading.Barrier(len(targets))
+
+        def run(target):
+            try:
+                barrier.wait()
+                target()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def setUp(self):
+        self.travel = ExpenseCategory.objects.create(name="Travel")
+        self.budget = ExpenseBudget.objects.create(
+            category=self.travel, amount=Decimal("100.00"), start_date=date(2025, 3, 1), end_date=date(2025, 3, 31),
+        )
+        self.expenses = [make_expense(self.travel, "10.00", date(2025, 3, 10), status=Expense.Status.PENDING) for _ in range(3)]
+
+    def _approve(self, expense_id):
+        def target():
+            expense = Expense.objects.get(pk=expense_id)
+            expense.status = Expense.Status.APPROVED
+            expense.save()
+        return target
+
+    def _spend(self):
+        self.budget.refresh_from_db()
+        return self.budget.approved_spend
+
+    def test_concurrent_approvals_of_one_expense_count_once(self):
+        self._run(*[self._approve(e.pk) for e in self.expenses for _ in range(3)])
+
+        self.assertEqual(self._spend(), Decimal("30.00"))
+
+    def test_budget_saves_keep_concurrent_approvals(self):
+        def save_budget():
+            budget = ExpenseBudget.objects.get(pk=self.budget.pk)
+            budget.amount = Decimal("150.00")
+            budget.save()
+
+        self._run(*[self._approve(e.pk) for e in self.expenses], *[save_budget] * 3)
+
+        self.assertEqual(self._spend(), Decimal("30.00"))
@@ -1,11 +1,17 @@
 from decimal import Decimal
-from django.db.models import Sum
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, Q, F, OuterRef, Subquery, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from .models import *
 from django.contrib.auth import get_user_model
 from django.core.mail import send_mail
 
 User = get_user_model()
+MAX_PERCENTAGE = Decimal("999.99")
 
 def compute_partner_allocations(expense: Expense, ratios: dict):
     allocations = []
@@ -23,51 +29,80 @@ def compute_partner_allocations(expense: Expense, ratios: dict):
 
 
 def generate_expense_report(start_date, end_date, persist=True):
-    categories = ExpenseBudget.objects.values_list("category", flat=True).distinct()
+    """
+    Budget vs approved spend for every budgeted category over
+    [start_date, end_date]: one grouped query for budgets, one for expenses
+    and, with persist, one upsert of the ExpenseReport rows.
+    """
+    overlapping = Q(budgets__start_date__lte=end_date, budgets__end_date__gte=start_date)
+    budgets = (
+        ExpenseCategory.objects.filter(budgets__isnull=False)
+        .values("id").annotate(total_budget=Sum("budgets__amount", filter=overlapping)).order_by()
+    )
+    spent = dict(
+        Expense.objects.filter(status=Expense.Status.APPROVED, created_at__date__range=(start_date, end_date))
+        .values("category_id").annotate(total=Sum("amount")).order_by()
+        .values_list("category_id", "total")
+    )
+
     reports = []
-    for cat_id in categories:
-        # Aggregate budget
-        budget_agg = ExpenseBudget.objects.filter(
-            category_id=cat_id,
-            start_date__lte=end_date,
-            end_date__gte=start_date
-        ).aggregate(total_budget=Sum("amount"))
-        total_budget = budget_agg["total_budget"] or Decimal("0.00")
-
-        # Aggregate approved expenses
-        expense_agg = Expense.objects.filter(
-            category_id=cat_id,
-            status="Approved",
-            created_at__gte=start_date,
-            created_at__lte=end_date
-        ).aggregate(total_expense=Sum("amount"))
-        total_expense = expense_agg["total_expense"] or Decimal("0.00")
-
-        over_budget = total_expense > total_budget
+    for row in budgets:
+        total_budget = row["total_budget"] or Decimal("0.00")
+        total_expense = spent.get(row["id"]) or Decimal("0.00")
         percentage_used = (total_expense / total_budget * 100).quantize(TWOPLACES) if total_budget > 0 else Decimal("0.00")
-
-        report_data = {
-            "category_id": cat_id,
+        reports.append({
+            "category_id": row["id"],
             "total_budget": total_budget,
             "total_expense": total_expense,
-            "over_budget": over_budget,
-            "percentage_used": percentage_used,
+            "over_budget": total_expense > total_budget,
+            # percentage_used holds at most 999.99
+            "percentage_used": min(percentage_used, MAX_PERCENTAGE),
             "period_start": start_date,
-            "period_end": end_date
-        }
-
-        if persist:
-            ExpenseReport.objects.update_or_create(
-                category_id=cat_id,
-                period_start=start_date,
-                period_end=end_date,
-                defaults=report_data
-            )
-
-        reports.append(report_data)
+            "period_end": end_date,
+        })
+
+    if persist and reports:
+        ExpenseReport.objects.bulk_create(
+            [ExpenseReport(**r) for r in reports], batch_size=1000, update_conflicts=True,
+            unique_fields=["category", "period_start", "period_end"],
+            update_fields=["total_budget", "total_expense", "over_budget", "percentage_used"],
+        )
     return reports
 
 
+def refresh_expense_reports(start_date, end_date):
+    """Regenerate every stored report period overlapping [start_date, end_date]; returns the period count."""
+    periods = (
+        ExpenseReport.objects.filter(period_start__lte=end_date, period_end__gte=start_date)
+        .values_list("period_start", "period_end").distinct().order_by()
+    )
+    periods = list(periods)
+    for period_start, period_end in periods:
+        generate_expense_report(period_start, period_end)
+    return len(periods)
+
+
+def _report_refresh_key(start_date, end_date):
+    return f"expense:report_refresh:{start_date}:{end_date}"
+
+
+def schedule_expense_report_refresh(start_date, end_date=None):
+    """
+    Refresh stored reports covering the dates once the current transaction
+    commits, in the background and debounced: while a refresh for the range
+    is pending, further changes ride along with it.
+    """
+    end_date = end_date or start_date
+    delay = getattr(settings, "EXPENSE_REPORT_REFRESH_DELAY", 30)
+
+    def enqueue():
+        if cache.add(_report_refresh_key(start_date, end_date), True, delay + 300):
+            from .tasks import refresh_expense_reports_task
+            refresh_expense_reports_task(start_date.isoformat(), end_date.isoformat(), schedule=delay)
+
+    transaction.on_commit(enqueue)
+
+
 def notify_managers_new_expense(expense: Expense):
     managers = User.objects.filter(is_staff=True)
     emails = [m.email for m in managers if m.email]
@@ -91,21 +126,93 @@ def create_audit_log(expense: Expense, old_status: str, new_status: str, user, n
     )
 
 
+def budget_contribution(expense):
+    """
+    (category_id, day, amount) an expense (instance or dict of its stored
+    values) adds to budget spend counters, or None if it adds nothing.
+    """
+    d = expense if isinstance(expense, dict) else expense.__dict__
+    if d.get("status") != Expense.Status.APPROVED or d.get("category_id") is None or d.get("created_at") is None:
+        return None
+    return (d["category_id"], timezone.localdate(d["created_at"]), d.get("amount") or Decimal("0.00"))
+
+
+def adjust_budget_spend(category_id, day, delta):
+    """Add `delta` to the spend counter of every budget window of the category containing `day`."""
+    ExpenseBudget.objects.filter(category_id=category_id, start_date__lte=day, end_date__gte=day).update(
+        approved_spend=F("approved_spend") + delta
+    )
+
+
+def _window_spend():
+    """Approved spend for the category/window of the outer ExpenseBudget row."""
+    spend = (
+        Expense.objects.filter(
+            category_id=OuterRef("category_id"), status=Expense.Status.APPROVED,
+            created_at__date__gte=OuterRef("start_date"), created_at__date__lte=OuterRef("end_date"),
+        )
+        .values("category_id").annotate(total=Sum("amount")).values("total")
+    )
+    return Coalesce(Subquery(spend), Value(Decimal("0.00")), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def stored_budget_contribution(expense_id):
+    """
+    budget_contribution() of the stored expense row, locked until the
+    transaction ends so concurrent saves of one expense see each other's
+    changes instead of each applying the same delta.
+    """
+    row = (
+        Expense.objects.select_for_update().filter(pk=expense_id)
+        .values("status", "category_id", "created_at", "amount").first()
+    )
+    return budget_contribution(row) if row else None
+
+
+def recount_budget_spend(budget_id):
+    """
+    Recount one budget's spend counter in SQL. The row is locked first, so
+    approvals that already added to it have committed and are counted; later
+    ones add their delta on top of the recount.
+    """
+    with transaction.atomic():
+        list(ExpenseBudget.objects.select_for_update().filter(pk=budget_id).values_list("pk"))
+        ExpenseBudget.objects.filter(pk=budget_id).update(approved_spend=_window_spend())
+
+
+def rebuild_budget_spend():
+    """Recompute every budget's spend counter in one UPDATE, e.g. after bulk expense writes."""
+    return ExpenseBudget.objects.update(approved_spend=_window_spend())
+
+
+def budget_windows(category_ids):
+    """{category_id: [(start_date, end_date, amount, approved_spend), ...]} in one query."""
+    windows = {}
+    rows = ExpenseBudget.objects.filter(category_id__in=category_ids).values_list(
+        "category_id", "start_date", "end_date", "amount", "approved_spend",
+    )
+    for category_id, *window in rows:
+        windows.setdefault(category_id, []).append(tuple(window))
+    return windows
+
+
+def is_over_budget(expense, windows):
+    """
+    True if approved spend in the category's budget windows covering the
+    expense date, plus the expense itself when it is not approved yet,
+    exceeds their budget. `windows` is the category's budget_windows() entry.
+    """
+    day = timezone.localdate(expense.created_at)
+    budget = spent = Decimal("0.00")
+    for start_date, end_date, amount, approved_spend in windows:
+        if start_date <= day <= end_date:
+            budget += amount
+            spent += approved_spend
+    if expense.status != Expense.Status.APPROVED:
+        spent += expense.amount
+    return spent > budget
+
+
 def validate_expense_budget(expense: Expense):
     """Check if expense exceeds current budget."""
-    start_date = expense.created_at.date()
-    end_date = start_date
-    budget = ExpenseBudget.objects.filter(
-        category=expense.category,
-        start_date__lte=end_date,
-        end_date__gte=start_date
-    ).aggregate(total_budget=Sum("amount"))["total_budget"] or Decimal("0.00")
-
-    approved_expenses = Expense.objects.filter(
-        category=expense.category,
-        status="Approved"
-    ).aggregate(total_expense=Sum("amount"))["total_expense"] or Decimal("0.00")
-
-    if approved_expenses + expense.amount > budget:
-        return True  # over budget
-    return False
+    return is_over_budget(expense, budget_windows([expense.category_id]).get(expense.category_id, []))
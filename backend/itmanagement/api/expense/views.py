@@ -5,10 +5,12 @@ from .models import *
 from .serializers import *
 from .utils import *
 from django.contrib.auth import get_user_model
-import csv
 from django.db.models import Sum
+from django.utils import timezone
 from datetime import datetime
 from decimal import Decimal
+from api.financial_analytics.rollups import schedule_expense_rollup_refresh
+from api.financial_analytics.exports import ExportError, export_rows
 User = get_user_model()
 
 class ExpenseCategoryListCreateView(generics.ListCreateAPIView):
@@ -27,7 +29,11 @@ class ExpenseListCreateView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Expense.objects.filter(submitted_by=self.request.user)
+        return (
+            Expense.objects.filter(submitted_by=self.request.user)
+            .select_related("submitted_by", "approved_by")
+            .prefetch_related("allocations__partner", "partners")
+        )
 
     def perform_create(self, serializer):
         expense = serializer.save(submitted_by=self.request.user)
@@ -43,9 +49,7 @@ class ExpenseListCreateView(generics.ListCreateAPIView):
                 )
         # Notify managers
         notify_managers_new_expense(expense)
-        # Generate/Update report
-        from .utils import generate_expense_report
-        generate_expense_report(expense.created_at.date(), expense.created_at.date())
+        # new expenses are pending, so reports only change once one is approved
 
 
 class ExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -61,15 +65,22 @@ class ExpenseDetailView(generics.RetrieveUpdateDestroyAPIView):
         if status_val in ["Approved", "Rejected"] and self.request.user.is_staff:
             serializer.save(status=status_val, approved_by=self.request.user)
             create_audit_log(expense, old_status, status_val, self.request.user)
-            # Auto-update expense report when approved
-            if status_val == "Approved":
-                from .utils import generate_expense_report
-                generate_expense_report(expense.created_at.date(), expense.created_at.date())
         else:
             # Check for edits other than status
             serializer.save()
             # Log changes
             create_audit_log(expense, old_status, expense.status, self.request.user, notes="Edited fields other than status")
+        # Keep the daily expense rollup and stored reports in step with approvals and edits
+        if Expense.Status.APPROVED in (old_status, expense.status):
+            schedule_expense_rollup_refresh(expense)
+            schedule_expense_report_refresh(timezone.localdate(expense.created_at))
+
+    def perform_destroy(self, instance):
+        was_approved = instance.status == Expense.Status.APPROVED
+        instance.delete()
+        if was_approved:
+            schedule_expense_rollup_refresh(instance)
+            schedule_expense_report_refresh(timezone.localdate(instance.created_at))
 
 
 class ExpenseBudgetListCreateView(generics.ListCreateAPIView):
@@ -77,12 +88,25 @@ class ExpenseBudgetListCreateView(generics.ListCreateAPIView):
     serializer_class = ExpenseBudgetSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_create(self, serializer):
+        budget = serializer.save()
+        schedule_expense_report_refresh(budget.start_date, budget.end_date)
+
 
 class ExpenseBudgetDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = ExpenseBudget.objects.all()
     serializer_class = ExpenseBudgetSerializer
     permission_classes = [IsAuthenticated]
 
+    def perform_update(self, serializer):
+        old_start, old_end = serializer.instance.start_date, serializer.instance.end_date
+        budget = serializer.save()
+        schedule_expense_report_refresh(min(old_start, budget.start_date), max(old_end, budget.end_date))
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        schedule_expense_report_refresh(instance.start_date, instance.end_date)
+
 
 class ExpenseReportView(generics.ListAPIView):
     serializer_class = ExpenseReportSerializer
@@ -103,10 +127,12 @@ class ExpenseReportView(generics.ListAPIView):
             start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
             end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
 
-        # Generate/update reports for the period
-        generate_expense_report(start_date, end_date)
-
         queryset = ExpenseReport.objects.filter(period_start=start_date, period_end=end_date)
+        # stored reports are kept current by the background refresh; a period
+        # nobody has asked for yet is computed once here
+        if not queryset.exists():
+            generate_expense_report(start_date, end_date)
+        queryset = queryset.select_related("category")
         if category_id:
             queryset = queryset.filter(category_id=category_id)
         return queryset
@@ -114,7 +140,14 @@ class ExpenseReportView(generics.ListAPIView):
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
         include_partner = request.query_params.get("include_partner", "false").lower() == "true"
-        export_csv = request.query_params.get("export_csv", "false").lower() == "true"
+        export_format = request.query_params.get("export")
+        if request.query_params.get("export_csv", "false").lower() == "true":
+            export_format = export_format or "csv"
+
+        partners = _partner_allocations(queryset) if include_partner else {}
+
+        if export_format:
+            return self._export(queryset, include_partner, partners, export_format)
 
         serializer = self.get_serializer(queryset, many=True)
         data = serializer.data
@@ -122,44 +155,50 @@ class ExpenseReportView(generics.ListAPIView):
         # Partner breakdown
         if include_partner:
             for report in data:
-                cat_id = report["category"]
-                approved_expenses = Expense.objects.filter(
-                    category_id=cat_id, status="Approved",
-                    created_at__gte=report["period_start"],
-                    created_at__lte=report["period_end"]
-                )
-                partner_allocations = PartnerExpenseAllocation.objects.filter(expense__in=approved_expenses)
-                partners_data = partner_allocations.values("partner__username").annotate(total=Sum("amount"))
-                report["partners"] = list(partners_data)
-
-        # CSV Export
-        if export_csv:
-            response = HttpResponse(content_type='text/csv')
-            filename = f"expense_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-
-            writer = csv.writer(response)
-            # Header
-            headers = ["Category", "Total Budget", "Total Expense", "Percentage Used", "Over Budget", "Period Start", "Period End"]
-            if include_partner:
-                headers.append("Partner Allocations")
-            writer.writerow(headers)
-
-            for row in data:
-                row_list = [
-                    row["category_name"],
-                    row["total_budget"],
-                    row["total_expense"],
-                    row["percentage_used"],
-                    row["over_budget"],
-                    row["period_start"],
-                    row["period_end"]
-                ]
-                if include_partner:
-                    partners_str = "; ".join([f"{p['partner__username']}:{p['total']}" for p in row.get("partners", [])])
-                    row_list.append(partners_str)
-                writer.writerow(row_list)
-
-            return response
+                report["partners"] = partners.get(report["category"], [])
 
         return Response(data)
+
+    def _export(self, queryset, include_partner, partners, export_format):
+        headers = ["Category", "Total Budget", "Total Expense", "Percentage Used", "Over Budget", "Period Start", "Period End"]
+        columns = ["category__name", "total_budget", "total_expense", "percentage_used", "over_budget", "period_start", "period_end"]
+        if include_partner:
+            headers.append("Partner Allocations")
+            columns.append("category_id")
+
+        def rows():
+            for row in queryset.values_list(*columns).iterator():
+                if include_partner:
+                    row = row[:-1] + ("; ".join(f"{p['partner__username']}:{p['total']}" for p in partners.get(row[-1], [])),)
+                yield row
+
+        filename = f"expense_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        try:
+            return export_rows(headers, rows(), filename, fmt=export_format, request=self.request)
+        except ExportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _partner_allocations(reports):
+    """
+    {category_id: [{"partner__username", "total"}]} of approved expense
+    allocations for each report's category and period, one query per period.
+    """
+    periods = {}
+    for category_id, start, end in reports.values_list("category_id", "period_start", "period_end"):
+        periods.setdefault((start, end), []).append(category_id)
+
+    result = {}
+    for (start, end), category_ids in periods.items():
+        rows = (
+            PartnerExpenseAllocation.objects.filter(
+                expense__category_id__in=category_ids, expense__status="Approved",
+                expense__created_at__date__range=(start, end),
+            )
+            .values("expense__category_id", "partner__username")
+            .annotate(total=Sum("amount"))
+            .order_by("expense__category_id", "partner__username")
+        )
+        for r in rows:
+            result.setdefault(r.pop("expense__category_id"), []).append(r)
+    return result
@@ -4,3 +4,5 @@ from django.apps import AppConfig
 class FinancialAnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api.financial_analytics'
+    def ready(self):
+        from . import signals
@@ -0,0 +1,241 @@
+"""
+Currency conversion.
+
+Rates come from the effective-dated ExchangeRate table. Each process keeps
+the rate history of every currency pair it has used (sorted, bisected by
+date) and an LRU of resolved (currency, base, date) rates, so converting an
+amount is a dict lookup once warm. Pairs missing from the table are resolved
+through their inverse or a common quote currency. The tables are dropped after
+any ExchangeRate change, here and (through a version stamp in the shared
+cache) in every other process.
+
+Invoices store their total in the reporting currency (total_amount_base, in
+Invoice.base_currency); rebase_invoices() converts those columns to another
+reporting currency in set-based batches.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import ExchangeRate
+
+logger = logging.getLogger(__name__)
+
+RATES_VERSION_KEY = "financial_analytics:exchange_rates:version"
+VERSION_CHECK_INTERVAL = 1.0  # seconds between shared version checks
+RATE_PLACES = Decimal("0.0000000001")
+ONE = Decimal("1")
+
+
+class MissingExchangeRate(LookupError):
+    pass
+
+
+def base_currency():
+    """The reporting currency new invoices are converted to."""
+    return getattr(settings, "FINANCE_BASE_CURRENCY", "INR")
+
+
+_pairs = {}  # (currency, base) -> ([dates], [rates])
+_quotes = None  # {base: {currency, ...}} of pairs present in the table
+_rates = OrderedDict()  # LRU of (currency, base, date) -> rate
+_version = None
+_version_checked_at = 0.0
+
+
+def _sync_version():
+    global _version, _version_checked_at, _quotes
+    now = time.monotonic()
+    if now - _version_checked_at < VERSION_CHECK_INTERVAL:
+        return
+    _version_checked_at = now
+    version = cache.get(RATES_VERSION_KEY)
+    if version != _version:
+        _pairs.clear()
+        _rates.clear()
+        _quotes = None
+        _version = version
+
+
+def invalidate_exchange_rates():
+    global _version, _quotes
+    _pairs.clear()
+    _rates.clear()
+    _quotes = None
+    _version = uuid.uuid4().hex
+    cache.set(RATES_VERSION_KEY, _version, None)
+
+
+def _quote_map():
+    global _quotes
+    if _quotes is None:
+        _quotes = {}
+        for currency, base in ExchangeRate.objects.values_list("currency", "base_currency").distinct().order_by():
+            _quotes.setdefault(base, set()).add(currency)
+    return _quotes
+
+
+def _pair_rate(currency, base, on):
+    if currency not in _quote_map().get(base, ()):
+        return None
+    key = (currency, base)
+    if key not in _pairs:
+        rows = ExchangeRate.objects.filter(currency=currency, base_currency=base).order_by("effective_from")
+        history = list(rows.values_list("effective_from", "rate"))
+        _pairs[key] = ([d for d, _ in history], [r for _, r in history])
+    dates, rates = _pairs[key]
+    i = bisect_right(dates, on) - 1
+    return rates[i] if i >= 0 else None
+
+
+def _resolve(currency, base, on):
+    direct = _pair_rate(currency, base, on)
+    if direct is not None:
+        return direct
+    inverse = _pair_rate(base, currency, on)
+    if inverse:
+        return ONE / inverse
+    for quote, currencies in _quote_map().items():
+        if currency in currencies and base in currencies:
+            from_rate, to_rate = _pair_rate(currency, quote, on), _pair_rate(base, quote, on)
+            if from_rate is not None and to_rate:
+                return from_rate / to_rate
+    raise MissingExchangeRate(f"No {currency}/{base} rate effective on {on}")
+
+
+def rate(currency, on=None, base=None):
+    """Units of `base` (default: the reporting currency) per unit of `currency` on date `on` (default today)."""
+    currency = (currency or "").upper()
+    base = (base or base_currency()).upper()
+    if currency == base:
+        return ONE
+    on = on or timezone.localdate()
+    _sync_version()
+    key = (currency, base, on)
+    cached = _rates.get(key)
+    if cached is not None:
+        _rates.move_to_end(key)
+        return cached
+    value = _resolve(currency, base, on).quantize(RATE_PLACES)
+    _rates[key] = value
+    if len(_rates) > getattr(settings, "FX_RATE_CACHE_SIZE", 4096):
+        _rates.popitem(last=False)
+    return value
+
+
+def convert(amount, currency, on=None, base=None):
+    return Decimal(amount) * rate(currency, on, base)
+
+
+def read_rate_rows(stream, fmt="csv"):
+    """Yield rate dicts from csv (header row), json (array) or ndjson."""
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.BytesIO(stream)
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig")
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == "json":
+        yield from json.load(stream)
+    else:
+        raise ValueError(f"Unsupported exchange rate file format: {fmt}")
+
+
+def _parse_rate_row(row, default_base, source):
+    currency = str(row.get("currency") or "").strip().upper()
+    base = str(row.get("base_currency") or row.get("base") or default_base).strip().upper()
+    effective_from = parse_date(str(row.get("effective_from") or row.get("date") or "").strip())
+    try:
+        value = Decimal(str(row.get("rate", "")).strip())
+    except (InvalidOperation, ValueError):
+        value = None
+    if not currency or not effective_from or value is None or value <= 0:
+        raise ValueError(f"invalid exchange rate row {row!r}")
+    return ExchangeRate(currency=currency, base_currency=base, rate=value, effective_from=effective_from, source=source)
+
+
+def load_rates(rows, base=None, source=""):
+    """
+    Upsert rate dicts (currency, rate, effective_from/date and optionally
+    base_currency) into ExchangeRate. Returns the number of rows written.
+    """
+    objs = [_parse_rate_row(row, (base or base_currency()).upper(), source) for row in rows]
+    with transaction.atomic():
+        ExchangeRate.objects.bulk_create(
+            objs, batch_size=1000, update_conflicts=True,
+            unique_fields=["currency", "base_currency", "effective_from"], update_fields=["rate", "source"],
+        )
+        transaction.on_commit(invalidate_exchange_rates)
+    return len(objs)
+
+
+def load_rate_file(path, base=None):
+    fmt = os.path.splitext(path)[1].lstrip(".").lower() or "csv"
+    with open(path, "rb") as fh:
+        return load_rates(read_rate_rows(fh, fmt), base=base, source=os.path.basename(path))
+
+
+def rebase_invoices(target):
+    """
+    Convert every invoice's base amount and exchange rate into `target`,
+    at the rate effective on the invoice date, with one UPDATE per (old base,
+    day). Rows already in `target` are skipped, so an interrupted run can
+    simply be repeated. Rebuilds the income rollups afterwards; switch
+    FINANCE_BASE_CURRENCY to `target` once it completes.
+
+    Expenses are stored in the reporting currency without saying which, so
+    they (and the expense rollups) could neither be converted once nor
+    skipped on a re-run: raises ValueError while any exist.
+    """
+    from api.expense.models import Expense
+    from api.income.models import Invoice
+    from .rollups import rebuild_income_rollups
+
+    target = target.upper()
+    if target != base_currency() and Expense.objects.exists():
+        raise ValueError(
+            f"Expenses carry no currency and would stay in {base_currency()}; "
+            f"cannot rebase to {target} while expenses exist."
+        )
+    stats = {"groups": 0, "invoices": 0, "missing": []}
+    groups = (
+        Invoice.objects.exclude(base_currency=target)
+        .annotate(day=TruncDate("created_at")).values_list("base_currency", "day").distinct().order_by()
+    )
+    for old, day in list(groups):
+        try:
+            factor = rate(old, on=day, base=target)
+        except MissingExchangeRate:
+            stats["missing"].append((old, day))
+            continue
+        stats["invoices"] += Invoice.objects.filter(base_currency=old, created_at__date=day).update(
+            total_amount_base=F("total_amount_base") * factor,
+            exchange_rate=F("exchange_rate") * factor,
+            base_currency=target,
+            updated_at=timezone.now(),
+        )
+        stats["groups"] += 1
+
+    if stats["missing"]:
+        logger.warning("Rebase to %s skipped %d (currency, day) groups without a rate", target, len(stats["missing"]))
+    rebuild_income_rollups()
+    return stats
@@ -0,0 +1,200 @@
+"""
+Streaming exports (CSV, NDJSON, XLSX) for reports and model querysets.
+
+Fields are given as names or (header, lookup) pairs. Plain columns and
+"__" lookups are read with values_list(); relation fields (rendered with
+str()) switch to model instances with select_related() on every relation
+the fields touch. Either way the queryset is read with iterator(), so memory
+stays constant no matter how many rows are exported. CSV and NDJSON are
+streamed (optionally gzip-compressed when the client accepts it); XLSX is
+built with openpyxl's write-only workbook in a temporary file.
+"""
+import csv
+import datetime
+import json
+import re
+import tempfile
+import uuid
+import zlib
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+
+EXPORT_FORMATS = ("csv", "ndjson", "xlsx")
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+CHUNK_SIZE = 2000
+_accepts_gzip = re.compile(r"\bgzip\b")
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _field_specs(fields):
+    return [(f, f) if isinstance(f, str) else tuple(f) for f in fields]
+
+
+def _relation_paths(model, lookup):
+    """
+    ("a", "a__b") style relation prefixes of a lookup, and whether its last
+    part is itself a relation (so the value must be rendered with str()).
+    """
+    paths, opts, prefix = [], model._meta, []
+    parts = lookup.split("__")
+    for i, part in enumerate(parts):
+        try:
+            field = opts.get_field(part)
+        except FieldDoesNotExist:
+            return paths, False  # annotation or property; leave it to the caller
+        if not field.is_relation:
+            return paths, False
+        prefix.append(part)
+        paths.append("__".join(prefix))
+        if i == len(parts) - 1:
+            return paths, True
+        opts = field.related_model._meta
+    return paths, False
+
+
+def _queryset_rows(queryset, fields):
+    """Return (headers, row iterator) using the cheapest projection for `fields`."""
+    specs = _field_specs(fields)
+    headers = [header for header, _ in specs]
+    lookups = [lookup for _, lookup in specs]
+
+    related, needs_instances = set(), False
+    for lookup in lookups:
+        paths, is_relation = _relation_paths(queryset.model, lookup)
+        needs_instances |= is_relation
+        related.update(paths)
+
+    if not needs_instances:
+        return headers, queryset.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+    if related:
+        queryset = queryset.select_related(*sorted(related))
+
+    def resolve(obj, lookup):
+        for part in lookup.split("__"):
+            if obj is None:
+                return None
+            obj = getattr(obj, part)
+        return obj
+
+    def rows():
+        for obj in queryset.iterator(chunk_size=CHUNK_SIZE):
+            yield [resolve(obj, lookup) for lookup in lookups]
+
+    return headers, rows()
+
+
+def _cell(value):
+    """Plain JSON/CSV-friendly value."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (list, dict)):
+        return value
+    return str(value)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(headers, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(headers).encode("utf-8")
+    for row in rows:
+        yield writer.writerow(["" if v is None else _cell(v) for v in row]).encode("utf-8")
+
+
+def iter_ndjson(headers, rows):
+    for row in rows:
+        record = {h: _cell(v) for h, v in zip(headers, row)}
+        yield (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def write_xlsx(headers, rows, fileobj, title="Report"):
+    """Write rows to `fileobj` with openpyxl's write-only (constant memory) workbook."""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ExportError("XLSX export requires the openpyxl package.")
+
+    def xlsx_cell(value):
+        if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+            return timezone.make_naive(value)
+        if value is None or isinstance(value, (str, int, float, Decimal, datetime.date, datetime.datetime)):
+            return value
+        return str(_cell(value))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=title[:31])
+    ws.append(headers)
+    for row in rows:
+        ws.append([xlsx_cell(v) for v in row])
+    wb.save(fileobj)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _resolve_format(fmt, request):
+    if request is not None:
+        fmt = request.GET.get("export") or fmt
+    fmt = (fmt or "csv").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unsupported export format: {fmt}")
+    return fmt
+
+
+def export_rows(headers, rows, filename, fmt=None, request=None):
+    """
+    Stream `rows` (an iterable of sequences) as a download. The format comes
+    from `?export=` on the request, else `fmt`, else CSV; `filename` is given
+    without extension. CSV/NDJSON are gzip-encoded when the request accepts it.
+    """
+    fmt = _resolve_format(fmt, request)
+    attachment = f"{filename}.{fmt}"
+
+    if fmt == "xlsx":
+        tmp = tempfile.TemporaryFile()
+        write_xlsx(headers, rows, tmp, title=filename)
+        tmp.seek(0)
+        return FileResponse(tmp, as_attachment=True, filename=attachment, content_type=CONTENT_TYPES[fmt])
+
+    chunks = iter_csv(headers, rows) if fmt == "csv" else iter_ndjson(headers, rows)
+    compress = request is not None and _accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    if compress:
+        chunks = _gzip(chunks)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{attachment}"'
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def export_queryset(queryset, fields, filename, fmt=None, request=None):
+    """export_rows() for a queryset; see _queryset_rows for how fields are read."""
+    fmt = _resolve_format(fmt, request)
+    headers, rows = _queryset_rows(queryset, fields)
+    return export_rows(headers, rows, filename, fmt=fmt, request=request)
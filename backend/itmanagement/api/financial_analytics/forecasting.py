@@ -0,0 +1,217 @@
+"""
+Income/expense forecasting on monthly series built from the daily rollups.
+
+Every series (income per organization, total income, total expense) is a row
+of one (series x months) matrix, so fitting, backtesting and forecasting are
+array operations over all organizations at once:
+
+- simple exponential smoothing for a grid of alphas (one pass over months,
+  vectorized over alphas x series);
+- a least-squares linear trend (closed form, vectorized over series).
+
+Months before a series' first non-zero month are masked out. The model (and
+alpha) is chosen per series by the mean absolute one-month-ahead error over
+the last BACKTEST_MONTHS months; series too short to backtest use SES with
+DEFAULT_ALPHA.
+"""
+import datetime
+import logging
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+from .models import IncomeRollup, ExpenseRollup
+
+logger = logging.getLogger(__name__)
+
+ALPHAS = np.round(np.arange(0.1, 1.0, 0.1), 1)
+DEFAULT_ALPHA = 0.5
+BACKTEST_MONTHS = 3
+HISTORY_MONTHS = 24
+TWOPLACES = Decimal("0.01")
+
+
+def month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def month_start(index):
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_series(first_month, months):
+    """
+    Rollup totals per month for [first_month, first_month + months).
+    Returns (organization ids, income matrix [orgs x months], expense vector)
+    from two grouped queries.
+    """
+    start = month_start(first_month)
+    end = month_start(first_month + months)
+    income_rows = (
+        IncomeRollup.objects.filter(day__gte=start, day__lt=end)
+        .annotate(month=TruncMonth("day")).values("organization_id", "month")
+        .annotate(total=Sum("amount_base")).order_by()
+    )
+    expense_rows = (
+        ExpenseRollup.objects.filter(day__gte=start, day__lt=end)
+        .annotate(month=TruncMonth("day")).values("month")
+        .annotate(total=Sum("amount")).order_by()
+    )
+
+    income_rows = list(income_rows)
+    org_ids = sorted({r["organization_id"] for r in income_rows})
+    row_of = {org_id: i for i, org_id in enumerate(org_ids)}
+    income = np.zeros((len(org_ids), months))
+    for r in income_rows:
+        income[row_of[r["organization_id"]], month_index(r["month"]) - first_month] = float(r["total"] or 0)
+    expense = np.zeros(months)
+    for r in expense_rows:
+        expense[month_index(r["month"]) - first_month] = float(r["total"] or 0)
+    return org_ids, income, expense
+
+
+def mask_leading_zeros(y):
+    """Replace months before each row's first non-zero value with NaN."""
+    started = np.maximum.accumulate(y != 0, axis=1)
+    return np.where(started, y, np.nan)
+
+
+def ses(y, alphas=ALPHAS):
+    """
+    Simple exponential smoothing for every alpha and series.
+    Returns (fitted, level): fitted[a, i, t] is the forecast of y[i, t] from
+    y[i, :t] (NaN until the series starts), level[a, i] the final level.
+    """
+    a = np.asarray(alphas)[:, None]
+    level = np.full((len(a), y.shape[0]), np.nan)
+    fitted = np.full((len(a), *y.shape), np.nan)
+    for t in range(y.shape[1]):
+        fitted[:, :, t] = level
+        x = y[:, t][None, :]
+        level = np.where(np.isnan(level), x, level + a * (x - level))
+    return fitted, level
+
+
+def linear_trend(y, end):
+    """Masked least-squares fit of y[:, :end] on month number; returns (intercept, slope)."""
+    t = np.arange(end, dtype=float)
+    values = y[:, :end]
+    w = ~np.isnan(values)
+    v = np.where(w, values, 0.0)
+    n = w.sum(axis=1)
+    st = (w * t).sum(axis=1)
+    stt = (w * t * t).sum(axis=1)
+    sy = v.sum(axis=1)
+    sty = (v * t).sum(axis=1)
+    den = n * stt - st ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(den > 0, (n * sty - st * sy) / den, 0.0)
+        intercept = np.where(n > 0, (sy - slope * st) / n, np.nan)
+    return intercept, slope
+
+
+def _mean_abs(errors):
+    """Mean over the last axis ignoring NaN; inf where there is nothing to average."""
+    valid = ~np.isnan(errors)
+    count = valid.sum(axis=-1)
+    total = np.where(valid, errors, 0.0).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, total / count, np.inf)
+
+
+@dataclass
+class Forecast:
+    values: np.ndarray  # [series] total over the horizon
+    methods: list = field(default_factory=list)
+    errors: np.ndarray = None  # [series] backtest MAE, NaN when not backtested
+
+
+def forecast(y, horizon, backtest_months=BACKTEST_MONTHS):
+    """
+    Forecast each row of y ([series x months]) for the month offsets in
+    `horizon` (1 = the month after the last column) and return the per-series
+    sum over the horizon, choosing SES/alpha or trend per series by backtest.
+    """
+    y = mask_leading_zeros(np.asarray(y, dtype=float))
+    n, months = y.shape
+    horizon = np.asarray(horizon, dtype=float)
+    k = min(backtest_months, max(months - 2, 0))
+    observed = (~np.isnan(y)).sum(axis=1)
+
+    fitted, level = ses(y)
+    if k:
+        window = slice(months - k, months)
+        ses_err = _mean_abs(np.abs(fitted[:, :, window] - y[None, :, window]))  # [alphas, series]
+        trend_pred = np.empty((n, k))
+        for j, t in enumerate(range(months - k, months)):
+            intercept, slope = linear_trend(y, t)
+            trend_pred[:, j] = intercept + slope * t
+        trend_err = _mean_abs(np.abs(trend_pred - y[:, window]))
+    else:
+        ses_err = np.full((len(ALPHAS), n), np.inf)
+        trend_err = np.full(n, np.inf)
+
+    best_alpha = ses_err.argmin(axis=0)
+    best_ses_err = ses_err[best_alpha, np.arange(n)]
+    # trend needs enough points to fit before the backtest window
+    use_trend = (trend_err < best_ses_err) & (observed >= k + 3)
+    backtested = np.isfinite(np.minimum(best_ses_err, trend_err)) & (observed > k)
+    default = int(np.argmin(np.abs(ALPHAS - DEFAULT_ALPHA)))
+    best_alpha = np.where(backtested, best_alpha, default)
+
+    ses_forecast = np.nan_to_num(level[best_alpha, np.arange(n)]) * len(horizon)
+    intercept, slope = linear_trend(y, months)
+    points = intercept[:, None] + slope[:, None] * (months - 1 + horizon[None, :])
+    trend_forecast = np.clip(np.nan_to_num(points), 0, None).sum(axis=1)
+
+    values = np.where(use_trend, trend_forecast, ses_forecast)
+    methods = ["trend" if use_trend[i] else f"ses({ALPHAS[best_alpha[i]]:.1f})" for i in range(n)]
+    errors = np.where(backtested, np.where(use_trend, trend_err, best_ses_err), np.nan)
+    return Forecast(values=values, methods=methods, errors=errors)
+
+
+def period_months(period):
+    return np.arange(month_index(period.start_date), month_index(period.end_date) + 1)
+
+
+def forecast_period(period, history_months=HISTORY_MONTHS, backtest_months=BACKTEST_MONTHS):
+    """
+    Forecast income per organization, total income and total expense for
+    `period` from the `history_months` months before it starts.
+    Returns {"organizations": {org_id: (income, method, error)},
+    "total_income": (...), "total_expense": (...), "timings": {...}}.
+    """
+    timings = {}
+    started = time.perf_counter()
+    first_month = month_index(period.start_date) - history_months
+    org_ids, income, expense = monthly_series(first_month, history_months)
+    timings["load"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    y = np.vstack([income, income.sum(axis=0, keepdims=True), expense[None, :]])
+    horizon = period_months(period) - (first_month + history_months - 1)
+    result = forecast(y, horizon, backtest_months)
+    timings["fit"] = time.perf_counter() - started
+
+    def entry(i):
+        error = result.errors[i]
+        return (
+            Decimal(repr(float(result.values[i]))).quantize(TWOPLACES),
+            result.methods[i],
+            None if np.isnan(error) else Decimal(repr(float(error))).quantize(TWOPLACES),
+        )
+
+    logger.info(
+        "Forecast %s: %d organizations, load %.3fs, fit %.3fs",
+        period, len(org_ids), timings["load"], timings["fit"],
+    )
+    return {
+        "organizations": {org_id: entry(i) for i, org_id in enumerate(org_ids)},
+        "total_income": entry(len(org_ids)),
+        "total_expense": entry(len(org_ids) + 1),
+        "timings": timings,
+    }
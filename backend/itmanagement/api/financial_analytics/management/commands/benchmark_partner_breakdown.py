@@ -0,0 +1,118 @@
+import datetime
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.organizations.models import Organization
+from api.income.models import Invoice, PartnerIncomeShare
+from api.expense.models import Expense, ExpenseCategory, PartnerExpenseAllocation
+from api.financial_analytics.models import FinancialPeriod
+from api.financial_analytics.utils import generate_partner_breakdown
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic partners with paid invoice shares and expense allocations, then time "
+        "generate_partner_breakdown and check that its query count does not grow with the "
+        "number of partners."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partners", type=int, default=1000)
+        parser.add_argument("--invoices", type=int, default=5, help="Paid invoices shared by each partner.")
+        parser.add_argument("--keep", action="store_true", help="Commit the generated data.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def _dataset(self, partners, invoices_per_partner, rng):
+        tag = uuid.uuid4().hex[:8]
+        start = datetime.date(2099, 1, 1) + datetime.timedelta(days=rng.randint(0, 3000))
+        period = FinancialPeriod.objects.create(
+            name=f"bench-{tag}", start_date=start, end_date=start + datetime.timedelta(days=29),
+        )
+        org = Organization.objects.create(
+            name=f"bench-{tag}", legal_name=f"bench-{tag}", registration_number=f"bench-{tag}",
+            company_email="bench@example.com", company_phone="0", address="-", city="-",
+            state="-", postal_code="0", country="India", business_license="bench.pdf",
+        )
+        users = User.objects.bulk_create(
+            [User(username=f"bench-{tag}-{i}", email=f"bench-{tag}-{i}@example.com") for i in range(partners)],
+            batch_size=5000,
+        )
+        invoices = Invoice.objects.bulk_create(
+            [
+                Invoice(
+                    organization=org, invoice_number=f"BENCH-{tag}-{i}", client_name="bench",
+                    client_email="bench@example.com", status=Invoice.Status.PAID,
+                    due_date=start + datetime.timedelta(days=rng.randint(0, 29)),
+                    exchange_rate=Decimal(rng.choice(["1", "83.25"])),
+                )
+                for i in range(partners * invoices_per_partner)
+            ],
+            batch_size=5000,
+        )
+        PartnerIncomeShare.objects.bulk_create(
+            [
+                PartnerIncomeShare(partner=users[i % partners], invoice=inv,
+                                   amount=Decimal(rng.randint(100, 100_000)) / 100)
+                for i, inv in enumerate(invoices)
+            ],
+            batch_size=5000,
+        )
+        category = ExpenseCategory.objects.create(name=f"bench-{tag}")
+        expenses = Expense.objects.bulk_create(
+            [
+                Expense(title="bench", amount=Decimal("100.00"), category=category, submitted_by=user,
+                        status=Expense.Status.APPROVED)
+                for user in users
+            ],
+            batch_size=5000,
+        )
+        # created_at is auto_now_add, so move the expenses into the period
+        Expense.objects.filter(pk__in=[e.pk for e in expenses]).update(
+            created_at=datetime.datetime.combine(start, datetime.time(12), tzinfo=datetime.timezone.utc)
+        )
+        PartnerExpenseAllocation.objects.bulk_create(
+            [PartnerExpenseAllocation(expense=e, partner=e.submitted_by, amount=e.amount) for e in expenses],
+            batch_size=5000,
+        )
+        return period
+
+    def _measure(self, period, **kwargs):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            reports = generate_partner_breakdown(period, **kwargs)
+        return reports, len(queries), time.perf_counter() - started
+
+    def _run(self, options):
+        rng = random.Random(0)
+        partners = options["partners"]
+
+        started = time.perf_counter()
+        small = self._dataset(10, options["invoices"], rng)
+        large = self._dataset(partners, options["invoices"], rng)
+        self.stdout.write(f"Created {partners} partners in {time.perf_counter() - started:.1f}s")
+
+        _, baseline, _ = self._measure(small)
+        for label, kwargs in (("first run", {}), ("overwrite", {}), ("new version", {"force_new_version": True})):
+            reports, queries, elapsed = self._measure(large, **kwargs)
+            self.stdout.write(self.style.SUCCESS(
+                f"{label:<11}: {len(reports)} partners in {elapsed:.2f}s ({queries} queries, "
+                f"version {max(r.version for r in reports)})"
+            ))
+            if len(reports) != partners:
+                raise CommandError(f"expected {partners} reports, got {len(reports)}")
+            if queries != baseline:
+                raise CommandError(f"{queries} queries for {partners} partners vs {baseline} for 10 partners")
@@ -0,0 +1,30 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from api.financial_analytics.forecasting import HISTORY_MONTHS
+from api.financial_analytics.models import FinancialPeriod
+from api.financial_analytics.utils import generate_all_forecasts
+
+
+class Command(BaseCommand):
+    help = "Forecast a financial period for every organization (plus the company-wide forecast) from the rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument("period", help="FinancialPeriod id.")
+        parser.add_argument("--history-months", type=int, default=HISTORY_MONTHS)
+        parser.add_argument("--force-new-version", action="store_true")
+
+    def handle(self, *args, **options):
+        try:
+            period = FinancialPeriod.objects.get(pk=options["period"])
+        except (FinancialPeriod.DoesNotExist, ValidationError, ValueError):
+            raise CommandError(f"Financial period {options['period']} not found.")
+
+        stats = generate_all_forecasts(
+            period, history_months=options["history_months"], force_new_version=options["force_new_version"],
+        )
+        t = stats["timings"]
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['organizations']} organizations: {stats['created']} created, {stats['updated']} updated "
+            f"in {t['total']:.3f}s (load {t['load']:.3f}s, fit {t['fit']:.3f}s, write {t['write']:.3f}s)"
+        ))
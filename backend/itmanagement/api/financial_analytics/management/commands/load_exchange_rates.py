@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.financial_analytics.currency import load_rate_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Load effective-dated exchange rates from a csv (currency,rate,effective_from[,base_currency]), "
+        "json or ndjson file. Existing (currency, base, date) rows are overwritten."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--base", help="Base currency for rows without one (default: FINANCE_BASE_CURRENCY).")
+
+    def handle(self, *args, **options):
+        try:
+            count = load_rate_file(options["path"], base=options["base"])
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} exchange rates from {options['path']}"))
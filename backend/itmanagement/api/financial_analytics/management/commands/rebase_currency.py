@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.financial_analytics.currency import rebase_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert stored invoice base amounts to another reporting currency at the rate effective on "
+        "each invoice date, then rebuild the income rollups. Safe to re-run; set FINANCE_BASE_CURRENCY "
+        "to the new currency afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--to", required=True, help="Target reporting currency, e.g. USD.")
+
+    def handle(self, *args, **options):
+        try:
+            stats = rebase_invoices(options["to"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebased {stats['invoices']} invoices in {stats['groups']} (currency, day) batches to {options['to'].upper()}"
+        ))
+        for currency, day in stats["missing"]:
+            self.stderr.write(f"No {currency}/{options['to'].upper()} rate for {day}; those invoices were left unchanged")
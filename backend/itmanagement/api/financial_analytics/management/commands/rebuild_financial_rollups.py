@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.financial_analytics.rollups import rebuild_income_rollups, rebuild_expense_rollups, check_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily income/expense rollups from scratch and verify them against the raw tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check-only", action="store_true", help="Only compare rollups with the raw tables.")
+
+    def handle(self, *args, **options):
+        if not options["check_only"]:
+            income_rows = rebuild_income_rollups()
+            expense_rows = rebuild_expense_rollups()
+            self.stdout.write(f"Rebuilt {income_rows} income and {expense_rows} expense rollup rows.")
+
+        mismatches = check_rollups()
+        for line in mismatches:
+            self.stderr.write(line)
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollup bucket(s) differ from the raw tables.")
+        self.stdout.write(self.style.SUCCESS("Rollups match the raw tables."))
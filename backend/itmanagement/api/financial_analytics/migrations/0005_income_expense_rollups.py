@@ -0,0 +1,52 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:49
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expense', '0003_expense_period'),
+        ('financial_analytics', '0004_forecastreport_base_currency_and_more'),
+        ('income', '0003_invoice_period'),
+        ('organizations', '0002_rename_address_line1_organization_address_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expense.expensecategory')),
+                ('cost_center', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_rollups', to='financial_analytics.costcenter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'cost_center'], name='financial_a_day_1f1a88_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='IncomeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_name', models.CharField(max_length=255)),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=8)),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('amount_base', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=20)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('cost_center', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='income_rollups', to='financial_analytics.costcenter')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='income_rollups', to='organizations.organization')),
+                ('revenue_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='income.revenuecategory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organization', 'day'], name='financial_a_organiz_da4a9d_idx'), models.Index(fields=['day', 'cost_center'], name='financial_a_day_27fd68_idx')],
+            },
+        ),
+    ]
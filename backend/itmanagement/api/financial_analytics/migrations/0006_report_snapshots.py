@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_analytics', '0005_income_expense_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashflowreport',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the report figures, set on finalization', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cashflowreport',
+            name='input_watermark',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Digest of the input data this version was computed from', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='forecastreport',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the report figures, set on finalization', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='forecastreport',
+            name='input_watermark',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Digest of the input data this version was computed from', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='partnerfinancialbreakdown',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the report figures, set on finalization', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='partnerfinancialbreakdown',
+            name='input_watermark',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Digest of the input data this version was computed from', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='profitlossreport',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the report figures, set on finalization', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='profitlossreport',
+            name='input_watermark',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Digest of the input data this version was computed from', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='taxreport',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the report figures, set on finalization', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='taxreport',
+            name='input_watermark',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Digest of the input data this version was computed from', max_length=64),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_analytics', '0006_report_snapshots'),
+        ('organizations', '0002_rename_address_line1_organization_address_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastreport',
+            name='backtest_error',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Mean absolute one-month-ahead income error over the backtest window', max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='forecastreport',
+            name='method',
+            field=models.CharField(blank=True, default='', help_text='Model chosen by backtest, e.g. ses(0.3) or trend', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='forecastreport',
+            name='organization',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='forecast_reports', to='organizations.organization'),
+        ),
+        migrations.AddIndex(
+            model_name='forecastreport',
+            index=models.Index(fields=['period', 'organization', 'version'], name='financial_a_period__3697d2_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_analytics', '0007_forecastreport_organization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=8)),
+                ('base_currency', models.CharField(max_length=8)),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('effective_from', models.DateField()),
+                ('source', models.CharField(blank=True, default='', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['currency', 'base_currency', 'effective_from'],
+                'unique_together': {('currency', 'base_currency', 'effective_from')},
+            },
+        ),
+    ]
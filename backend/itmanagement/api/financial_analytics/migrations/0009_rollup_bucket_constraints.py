@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:06
+
+from django.db import migrations, models
+from django.db.models import Max
+
+INCOME_BUCKET = ("organization_id", "day", "client_name", "revenue_category_id", "cost_center_id", "currency")
+EXPENSE_BUCKET = ("day", "category_id", "cost_center_id")
+
+
+def drop_duplicate_buckets(apps, schema_editor):
+    """
+    Racing refreshes could insert a bucket twice, each copy holding the whole
+    bucket; keep the newest copy so the constraints can be added.
+    """
+    for model_name, bucket in (("IncomeRollup", INCOME_BUCKET), ("ExpenseRollup", EXPENSE_BUCKET)):
+        model = apps.get_model("financial_analytics", model_name)
+        keep = model.objects.values(*bucket).annotate(keep_id=Max("id")).order_by().values_list("keep_id", flat=True)
+        model.objects.exclude(pk__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expense', '0005_expensebudget_approved_spend'),
+        ('financial_analytics', '0008_exchangerate'),
+        ('income', '0010_invoice_total_amount_base'),
+        ('organizations', '0002_rename_address_line1_organization_address_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_buckets, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='incomerollup',
+            name='financial_a_organiz_da4a9d_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='expenserollup',
+            constraint=models.UniqueConstraint(fields=('day', 'category', 'cost_center'), name='fa_expenserollup_one_row_per_bucket', nulls_distinct=False),
+        ),
+        migrations.AddConstraint(
+            model_name='incomerollup',
+            constraint=models.UniqueConstraint(fields=('organization', 'day', 'client_name', 'revenue_category', 'cost_center', 'currency'), name='fa_incomerollup_one_row_per_bucket', nulls_distinct=False),
+        ),
+    ]
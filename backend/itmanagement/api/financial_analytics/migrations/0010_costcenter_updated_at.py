@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial_analytics', '0009_rollup_bucket_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='costcenter',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
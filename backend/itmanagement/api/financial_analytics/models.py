@@ -1,5 +1,8 @@
+import hashlib
+import json
 import uuid
 from decimal import Decimal
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth import get_user_model
 User = get_user_model()
@@ -10,6 +13,7 @@ class CostCenter(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=120)
     description = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -38,12 +42,44 @@ class BaseReport(models.Model):
     version = models.IntegerField(default=1)
     is_finalized = models.BooleanField(default=False)
     base_currency = models.CharField(max_length=10, default="INR")
+    input_watermark = models.CharField(max_length=64, blank=True, default="", editable=False, help_text="Digest of the input data this version was computed from")
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False, help_text="SHA-256 of the report figures, set on finalization")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # bookkeeping columns left out of the content hash
+    HASH_EXCLUDE = {"id", "is_finalized", "input_watermark", "content_hash", "created_at", "updated_at"}
+
     class Meta:
         abstract = True
         unique_together = ("period", "version")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._finalized_in_db = instance.__dict__.get("is_finalized", False)
+        return instance
+
+    def compute_content_hash(self):
+        figures = {
+            f.attname: str(getattr(self, f.attname))
+            for f in self._meta.concrete_fields if f.attname not in self.HASH_EXCLUDE
+        }
+        payload = json.dumps([self._meta.label_lower, figures], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def save(self, *args, **kwargs):
+        # a finalized version is an immutable snapshot; changes go into a new version
+        if getattr(self, "_finalized_in_db", False):
+            raise ValidationError("Finalized report versions cannot be modified.")
+        if self.is_finalized:
+            self.content_hash = self.compute_content_hash()
+        super().save(*args, **kwargs)
+        self._finalized_in_db = self.is_finalized
+
+    def finalize(self):
+        self.is_finalized = True
+        self.save()
+
 
 class ProfitLossReport(BaseReport):
     total_income = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
@@ -106,6 +142,13 @@ class ForecastReport(BaseReport):
     period = models.ForeignKey(
         FinancialPeriod, on_delete=models.CASCADE, related_name="forecast_reports"
     )
+    # None is the company-wide forecast; expenses carry no organization, so
+    # per-organization forecasts cover income only
+    organization = models.ForeignKey(
+        "organizations.Organization", on_delete=models.CASCADE, null=True, blank=True, related_name="forecast_reports"
+    )
+    method = models.CharField(max_length=32, blank=True, default="", help_text="Model chosen by backtest, e.g. ses(0.3) or trend")
+    backtest_error = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True, help_text="Mean absolute one-month-ahead income error over the backtest window")
 
     forecasted_income = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
     forecasted_expenses = models.DecimalField(max_digits=15, decimal_places=2, default=0.00)
@@ -118,6 +161,7 @@ class ForecastReport(BaseReport):
     class Meta:
         verbose_name = "Forecast Report"
         verbose_name_plural = "Forecast Reports"
+        indexes = [models.Index(fields=["period", "organization", "version"])]
 
     def __str__(self):
         return f"Forecast Report for {self.period}"
@@ -143,3 +187,92 @@ class ForecastReport(BaseReport):
 
         self.save()
         return self
+
+
+class IncomeRollup(models.Model):
+    """
+    Materialized daily revenue of paid invoices, keyed by
+    organization x client x revenue category x cost center x day x currency.
+    `day` is the invoice due date (the axis the period reports use). An invoice
+    total is split across its revenue categories in proportion to line
+    subtotals, with the rounding remainder kept on the largest line so that
+    per-invoice sums stay exact.
+    """
+    organization = models.ForeignKey("organizations.Organization", on_delete=models.CASCADE, related_name="income_rollups")
+    client_name = models.CharField(max_length=255)
+    revenue_category = models.ForeignKey("income.RevenueCategory", on_delete=models.CASCADE, null=True, blank=True, related_name="rollups")
+    cost_center = models.ForeignKey(CostCenter, on_delete=models.CASCADE, null=True, blank=True, related_name="income_rollups")
+    day = models.DateField()
+    currency = models.CharField(max_length=8)
+
+    invoice_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    amount_base = models.DecimalField(max_digits=20, decimal_places=6, default=Decimal("0.00"))
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["day", "cost_center"]),
+        ]
+        constraints = [
+            # one row per bucket (NULL category/cost center included); also the (organization, day) index.
+            # NULLS NOT DISTINCT needs PostgreSQL 15+, which the rollups require (see rollups.py)
+            models.UniqueConstraint(
+                fields=["organization", "day", "client_name", "revenue_category", "cost_center", "currency"],
+                nulls_distinct=False, name="fa_incomerollup_one_row_per_bucket",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.organization_id} | {self.client_name} | {self.day} | {self.amount} {self.currency}"
+
+
+class ExpenseRollup(models.Model):
+    """
+    Materialized daily approved expenses keyed by category x cost center x day.
+    Expenses carry neither an organization nor a currency (amounts are already
+    in base currency), so those dimensions are not part of the key.
+    """
+    category = models.ForeignKey("expense.ExpenseCategory", on_delete=models.CASCADE, null=True, blank=True, related_name="rollups")
+    cost_center = models.ForeignKey(CostCenter, on_delete=models.CASCADE, null=True, blank=True, related_name="expense_rollups")
+    day = models.DateField()
+
+    expense_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["day", "cost_center"]),
+        ]
+        constraints = [
+            # NULL category/cost center included; needs PostgreSQL 15+ like IncomeRollup's
+            models.UniqueConstraint(
+                fields=["day", "category", "cost_center"], nulls_distinct=False, name="fa_expenserollup_one_row_per_bucket",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} | {self.category_id} | {self.amount}"
+
+
+class ExchangeRate(models.Model):
+    """
+    Effective-dated FX rate: 1 unit of `currency` is worth `rate` units of
+    `base_currency` from `effective_from` until the next row for the pair.
+    Loaded from files/fixtures (see currency.load_rates); lookups go through
+    the in-process tables in currency.py.
+    """
+    currency = models.CharField(max_length=8)
+    base_currency = models.CharField(max_length=8)
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    effective_from = models.DateField()
+    source = models.CharField(max_length=100, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("currency", "base_currency", "effective_from")
+        ordering = ["currency", "base_currency", "effective_from"]
+
+    def __str__(self):
+        return f"{self.currency}/{self.base_currency} {self.rate} from {self.effective_from}"
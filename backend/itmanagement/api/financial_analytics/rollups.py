@@ -0,0 +1,272 @@
+"""
+Incremental daily rollups of recognised income (paid invoices) and expenses
+(approved expenses). Period reports sum these tables instead of rescanning
+Invoice/Expense, so a report costs O(days) rather than O(rows).
+
+Rollups are refreshed per bucket: (organization, day) for income and day for
+expenses. A refresh recomputes the bucket from the raw rows and replaces it,
+which keeps the tables exact without having to track deltas. Refreshes of the
+same bucket, and rebuilds of a whole table, are serialized with transaction
+scoped advisory locks; the unique bucket constraints reject anything that
+slips past them instead of double counting. Buckets have nullable dimensions
+(revenue category, cost center), so those constraints rely on NULLS NOT
+DISTINCT and PostgreSQL 15 or later is required. SQLite ignores it, but it
+serializes writers, so buckets stay whole there too.
+"""
+import hashlib
+import logging
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connection, transaction
+from django.db.models import Sum, Count, F, ExpressionWrapper, DecimalField, Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from api.income.models import Invoice, InvoiceItem
+from api.expense.models import Expense
+from .models import CostCenter, IncomeRollup, ExpenseRollup
+
+logger = logging.getLogger(__name__)
+
+TWOPLACES = Decimal("0.01")
+SIXPLACES = Decimal("0.000001")
+BATCH_SIZE = 1000
+
+INVOICE_FIELDS = (
+    "id", "organization_id", "client_name", "cost_center_id",
+    "due_date", "currency", "total_amount", "total_amount_base",
+)
+
+
+def data_version():
+    """
+    Stamp that changes whenever rollup data or cost centers change; part of
+    report cache keys. It is read from the tables, so every process agrees on
+    it: a refresh replaces its bucket's rows (new ids) or empties it (fewer rows).
+    """
+    stamp = (
+        IncomeRollup.objects.aggregate(last=Max("id"), rows=Count("id")),
+        ExpenseRollup.objects.aggregate(last=Max("id"), rows=Count("id")),
+        CostCenter.objects.aggregate(last=Max("updated_at"), rows=Count("id")),
+    )
+    return hashlib.sha256(repr(stamp).encode("utf-8")).hexdigest()
+
+
+def _lock(*key, shared=False):
+    """
+    Hold an advisory lock on `key` until the transaction ends. Bucket refreshes
+    take the table's lock shared and the bucket's exclusively; rebuilds take the
+    table's exclusively. Other backends serialize writers already.
+    """
+    if connection.vendor != "postgresql":
+        return
+    fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT {fn}(hashtext(%s))", [":".join(str(part) for part in key)])
+
+
+def _line_total_expr():
+    return ExpressionWrapper(F("quantity") * F("unit_price"), output_field=DecimalField(max_digits=20, decimal_places=2))
+
+
+def _category_weights(invoice_ids):
+    """{invoice_id: [(revenue_category_id, line subtotal), ...]} in one grouped query."""
+    weights = defaultdict(list)
+    rows = (
+        InvoiceItem.objects.filter(invoice_id__in=invoice_ids)
+        .values("invoice_id", "revenue_category_id")
+        .annotate(weight=Sum(_line_total_expr()))
+        .order_by()
+    )
+    for row in rows:
+        weights[row["invoice_id"]].append((row["revenue_category_id"], row["weight"] or Decimal("0.00")))
+    return weights
+
+
+def _split(amount, weights, places):
+    """Split `amount` proportionally to weights; the remainder goes to the largest weight."""
+    total_weight = sum(w for _, w in weights)
+    if total_weight <= 0:
+        return [(None, amount)]
+    parts = []
+    allocated = Decimal("0")
+    for key, weight in weights:
+        part = (amount * weight / total_weight).quantize(places, rounding=ROUND_HALF_UP)
+        parts.append([key, part])
+        allocated += part
+    largest = max(range(len(weights)), key=lambda i: weights[i][1])
+    parts[largest][1] += amount - allocated
+    return [tuple(p) for p in parts]
+
+
+def _income_rows(invoices, weights):
+    """Aggregate invoice dicts into unsaved IncomeRollup rows."""
+    buckets = {}
+    for inv in invoices:
+        total = inv["total_amount"] or Decimal("0.00")
+        base = (inv["total_amount_base"] or Decimal("0")).quantize(SIXPLACES)
+        inv_weights = weights.get(inv["id"], [])
+        amounts = dict(_split(total, inv_weights, TWOPLACES))
+        bases = _split(base, inv_weights, SIXPLACES)
+        for category_id, part_base in bases:
+            key = (
+                inv["organization_id"], inv["client_name"], category_id,
+                inv["cost_center_id"], inv["due_date"], inv["currency"],
+            )
+            bucket = buckets.setdefault(key, [0, Decimal("0.00"), Decimal("0")])
+            bucket[0] += 1
+            bucket[1] += amounts[category_id]
+            bucket[2] += part_base
+    return [
+        IncomeRollup(
+            organization_id=org_id, client_name=client, revenue_category_id=category_id,
+            cost_center_id=cost_center_id, day=day, currency=currency,
+            invoice_count=count, amount=amount, amount_base=amount_base,
+        )
+        for (org_id, client, category_id, cost_center_id, day, currency), (count, amount, amount_base) in buckets.items()
+    ]
+
+
+def _paid_invoices():
+    return Invoice.objects.filter(status=Invoice.Status.PAID, due_date__isnull=False)
+
+
+def _approved_expenses():
+    return Expense.objects.filter(status=Expense.Status.APPROVED)
+
+
+@transaction.atomic
+def refresh_income_rollup(organization_id, day):
+    """Recompute the income rollup bucket for one organization and day."""
+    _lock(IncomeRollup._meta.db_table, shared=True)
+    _lock(IncomeRollup._meta.db_table, organization_id, day)
+    # read after locking, so a refresh that waited sees what the previous one committed
+    invoices = list(_paid_invoices().filter(organization_id=organization_id, due_date=day).values(*INVOICE_FIELDS))
+    weights = _category_weights([inv["id"] for inv in invoices])
+    IncomeRollup.objects.filter(organization_id=organization_id, day=day).delete()
+    IncomeRollup.objects.bulk_create(_income_rows(invoices, weights), batch_size=BATCH_SIZE)
+
+
+@transaction.atomic
+def refresh_expense_rollup(day):
+    """Recompute the expense rollup bucket for one day."""
+    _lock(ExpenseRollup._meta.db_table, shared=True)
+    _lock(ExpenseRollup._meta.db_table, day)
+    rows = (
+        _approved_expenses().filter(created_at__date=day)
+        .values("category_id", "cost_center_id")
+        .annotate(amount=Sum("amount"), expense_count=Count("id"))
+        .order_by()
+    )
+    ExpenseRollup.objects.filter(day=day).delete()
+    ExpenseRollup.objects.bulk_create(
+        [ExpenseRollup(day=day, **row) for row in rows], batch_size=BATCH_SIZE
+    )
+
+
+def schedule_income_rollup_refresh(organization_id, day):
+    if organization_id is None or day is None:
+        return
+    transaction.on_commit(lambda: refresh_income_rollup(organization_id, day))
+
+
+def schedule_expense_rollup_refresh(expense):
+    day = timezone.localdate(expense.created_at)
+    transaction.on_commit(lambda: refresh_expense_rollup(day))
+
+
+@transaction.atomic
+def rebuild_income_rollups(chunk_size=BATCH_SIZE):
+    """Drop and rebuild every income rollup from the invoice tables."""
+    _lock(IncomeRollup._meta.db_table)
+    IncomeRollup.objects.all().delete()
+    created = 0
+    chunk = []
+    invoices = _paid_invoices().values(*INVOICE_FIELDS).order_by("organization_id", "due_date", "id")
+    for inv in invoices.iterator(chunk_size=chunk_size):
+        # flush on bucket boundaries so no key is split across two chunks
+        if len(chunk) >= chunk_size and (inv["organization_id"], inv["due_date"]) != (
+            chunk[-1]["organization_id"], chunk[-1]["due_date"]
+        ):
+            created += _flush_income_chunk(chunk)
+            chunk = []
+        chunk.append(inv)
+    if chunk:
+        created += _flush_income_chunk(chunk)
+    return created
+
+
+def _flush_income_chunk(invoices):
+    rows = _income_rows(invoices, _category_weights([inv["id"] for inv in invoices]))
+    IncomeRollup.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+@transaction.atomic
+def rebuild_expense_rollups():
+    """Drop and rebuild every expense rollup from the expense table."""
+    _lock(ExpenseRollup._meta.db_table)
+    ExpenseRollup.objects.all().delete()
+    rows = (
+        _approved_expenses()
+        .annotate(day=TruncDate("created_at"))
+        .values("day", "category_id", "cost_center_id")
+        .annotate(amount=Sum("amount"), expense_count=Count("id"))
+        .order_by()
+    )
+    objs = [ExpenseRollup(**row) for row in rows.iterator()]
+    ExpenseRollup.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    return len(objs)
+
+
+def check_rollups():
+    """
+    Compare rollups with the raw tables. Income is checked per
+    (organization, day, currency), expenses per (day, category, cost center).
+    Returns a list of mismatch descriptions; empty means consistent.
+    """
+    mismatches = []
+
+    raw_income = {
+        (r["organization_id"], r["due_date"], r["currency"]): (r["invoice_count"], r["amount"], r["amount_base"])
+        for r in _paid_invoices()
+        .values("organization_id", "due_date", "currency")
+        .annotate(invoice_count=Count("id"), amount=Sum("total_amount"), amount_base=Sum("total_amount_base"))
+        .order_by()
+    }
+    rolled_income = {
+        (r["organization_id"], r["day"], r["currency"]): (r["amount"], r["amount_base"])
+        for r in IncomeRollup.objects
+        .values("organization_id", "day", "currency")
+        .annotate(amount=Sum("amount"), amount_base=Sum("amount_base"))
+        .order_by()
+    }
+    for key in set(raw_income) | set(rolled_income):
+        _, raw_amount, raw_base = raw_income.get(key, (0, Decimal("0"), Decimal("0")))
+        amount, amount_base = rolled_income.get(key, (Decimal("0"), Decimal("0")))
+        if raw_amount != amount or raw_base.quantize(SIXPLACES) != amount_base.quantize(SIXPLACES):
+            mismatches.append(f"income {key}: raw={raw_amount}/{raw_base} rollup={amount}/{amount_base}")
+
+    raw_expense = {
+        (r["day"], r["category_id"], r["cost_center_id"]): r["amount"]
+        for r in _approved_expenses()
+        .annotate(day=TruncDate("created_at"))
+        .values("day", "category_id", "cost_center_id")
+        .annotate(amount=Sum("amount"))
+        .order_by()
+    }
+    rolled_expense = {
+        (r["day"], r["category_id"], r["cost_center_id"]): r["amount"]
+        for r in ExpenseRollup.objects
+        .values("day", "category_id", "cost_center_id")
+        .annotate(amount=Sum("amount"))
+        .order_by()
+    }
+    for key in set(raw_expense) | set(rolled_expense):
+        raw_amount = raw_expense.get(key, Decimal("0"))
+        amount = rolled_expense.get(key, Decimal("0"))
+        if raw_amount != amount:
+            mismatches.append(f"expense {key}: raw={raw_amount} rollup={amount}")
+
+    return mismatches
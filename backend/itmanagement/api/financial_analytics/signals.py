@@ -0,0 +1,11 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ExchangeRate
+from .currency import invalidate_exchange_rates
+
+
+@receiver([post_save, post_delete], sender=ExchangeRate)
+def _exchange_rates_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_exchange_rates)
@@ -0,0 +1,70 @@
+"""
+Report snapshots.
+
+Finalized report versions never change, so they are cached by content hash
+(report:<sha256> -> instance) behind a per-(report type, period, version)
+pointer and served after a single look-up of the latest version number. Non-finalized versions store the input
+watermark they were computed from (latest updated_at and row count of the
+period's invoices and expenses, plus report parameters); a generate call with
+an unchanged watermark returns the stored version instead of recomputing.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from api.income.models import Invoice
+from api.expense.models import Expense
+
+KEY_PREFIX = "financial_analytics:report"
+
+
+def _digest(*parts):
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def period_watermark(period, *params):
+    """Digest of the period's invoice/expense activity and `params`; moves whenever either changes."""
+    invoices = Invoice.objects.filter(due_date__range=(period.start_date, period.end_date)).aggregate(
+        latest=Max("updated_at"), rows=Count("id"),
+    )
+    expenses = Expense.objects.filter(created_at__date__range=(period.start_date, period.end_date)).aggregate(
+        latest=Max("updated_at"), rows=Count("id"),
+    )
+    return _digest(period.start_date, period.end_date, invoices, expenses, params)
+
+
+def data_watermark(*parts):
+    """Watermark for reports derived from something other than the period's invoices/expenses."""
+    return _digest(*parts)
+
+
+def _pointer_key(model, period_id, version, scope=None):
+    suffix = "".join(f":{k}={v}" for k, v in sorted((scope or {}).items()))
+    return f"{KEY_PREFIX}:{model._meta.label_lower}:{period_id}:v{version}{suffix}"
+
+
+def _snapshot_key(digest):
+    return f"{KEY_PREFIX}:{digest}"
+
+
+def cached_snapshot(model, period, scope=None):
+    """
+    The cached finalized latest version of `model` for `period` (and `scope`
+    filters), or None. The latest version number is read from the table, so
+    a newer version written by any process bypasses the cached one.
+    """
+    latest = (
+        model.objects.filter(period=period, **(scope or {}))
+        .order_by("-version").values_list("version", "is_finalized").first()
+    )
+    if not latest or not latest[1]:
+        return None
+    digest = cache.get(_pointer_key(model, period.pk, latest[0], scope))
+    return cache.get(_snapshot_key(digest)) if digest else None
+
+
+def store_snapshot(report, scope=None):
+    digest = report.content_hash or report.compute_content_hash()
+    cache.set(_snapshot_key(digest), report, None)
+    cache.set(_pointer_key(type(report), report.period_id, report.version, scope), digest, None)
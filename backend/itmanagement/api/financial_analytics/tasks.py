@@ -0,0 +1,20 @@
+import logging
+
+from background_task import background
+
+from .models import FinancialPeriod
+from .utils import generate_all_forecasts
+
+logger = logging.getLogger(__name__)
+
+
+@background(schedule=0)
+def generate_all_forecasts_task(period_id, history_months=None):
+    """Background task: forecast a period for every organization in one vectorized pass."""
+    try:
+        period = FinancialPeriod.objects.get(pk=period_id)
+    except FinancialPeriod.DoesNotExist:
+        logger.error("Financial period %s does not exist.", period_id)
+        return
+    kwargs = {"history_months": history_months} if history_months else {}
+    generate_all_forecasts(period, **kwargs)
@@ -1,3 +1,445 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import threading
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.expense.models import Expense, ExpenseCategory, PartnerExpenseAllocation
+from api.income.models import Invoice, InvoiceItem, PartnerIncomeShare, RevenueCategory
+from api.organizations.models import Organization
+from api.users.models import User
+from . import currency as fx
+from .exports import ExportError, export_queryset, export_rows
+from .forecasting import forecast
+from .models import (
+    CostCenter, ExpenseRollup, FinancialPeriod, ForecastReport, IncomeRollup, PartnerFinancialBreakdown, ProfitLossReport,
+)
+from .rollups import check_rollups, data_version, rebuild_income_rollups, refresh_expense_rollup, refresh_income_rollup
+from .utils import cost_center_analysis, generate_partner_breakdown, generate_profit_loss
+
+DAY = date(2025, 3, 14)
+
+
+def make_org(name="Acme"):
+    return Organization.objects.create(
+        name=name, legal_name=name, registration_number=uuid.uuid4().hex, company_email="finance@example.com",
+        company_phone="1", address="1 Main St", city="Pune", state="MH", postal_code="411001", country="India",
+        business_license="org/docs/license.pdf",
+    )
+
+
+def make_paid_invoice(org, total, due_date=DAY, lines=(), **fields):
+    """Paid invoice with a fixed total; `lines` are (amount, revenue category) weights."""
+    fields.setdefault("client_name", "Client")
+    invoice = Invoice.objects.create(
+        organization=org, client_email="client@example.com", status=Invoice.Status.PAID,
+        due_date=due_date, total_amount=Decimal(total), **fields,
+    )
+    for amount, category in lines:
+        InvoiceItem.objects.create(invoice=invoice, description="line", quantity=1, unit_price=Decimal(amount), revenue_category=category)
+    return invoice
+
+
+def make_user(username="submitter"):
+    return User.objects.create(username=username, user_type="employee")
+
+
+class RollupRefreshTests(TestCase):
+    def setUp(self):
+        self.org = make_org()
+
+    def test_refresh_replaces_the_bucket(self):
+        make_paid_invoice(self.org, "100.00")
+        make_paid_invoice(self.org, "50.00")
+
+        refresh_income_rollup(self.org.pk, DAY)
+        refresh_income_rollup(self.org.pk, DAY)
+
+        row = IncomeRollup.objects.get()
+        self.assertEqual((row.invoice_count, row.amount), (2, Decimal("150.00")))
+        self.assertEqual(check_rollups(), [])
+
+    def test_invoice_total_is_split_across_categories(self):
+        services = RevenueCategory.objects.create(organization=self.org, name="Services")
+        licenses = RevenueCategory.objects.create(organization=self.org, name="Licenses")
+        make_paid_invoice(self.org, "100.00", lines=[("2.00", services), ("1.00", licenses)])
+
+        refresh_income_rollup(self.org.pk, DAY)
+
+        amounts = dict(IncomeRollup.objects.values_list("revenue_category__name", "amount"))
+        self.assertEqual(amounts, {"Services": Decimal("66.67"), "Licenses": Decimal("33.33")})
+
+    def test_unpaid_invoices_leave_the_bucket(self):
+        invoice = make_paid_invoice(self.org, "100.00")
+        refresh_income_rollup(self.org.pk, DAY)
+
+        Invoice.objects.filter(pk=invoice.pk).update(status=Invoice.Status.SENT)
+        refresh_income_rollup(self.org.pk, DAY)
+
+        self.assertFalse(IncomeRollup.objects.exists())
+
+    @skipUnlessDBFeature("supports_nulls_distinct_unique_constraints")
+    def test_bucket_is_unique_with_null_dimensions(self):
+        bucket = dict(organization=self.org, client_name="Client", day=DAY, currency="INR")
+        IncomeRollup.objects.create(**bucket, amount=Decimal("1.00"))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            IncomeRollup.objects.create(**bucket, amount=Decimal("1.00"))
+
+        ExpenseRollup.objects.create(day=DAY, amount=Decimal("1.00"))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExpenseRollup.objects.create(day=DAY, amount=Decimal("1.00"))
+
+    def test_expense_rollup_counts_approved_expenses(self):
+        category = ExpenseCategory.objects.create(name="Travel")
+        user = make_user()
+        for status in (Expense.Status.APPROVED, Expense.Status.APPROVED, Expense.Status.PENDING):
+            expense = Expense.objects.create(title="Taxi", amount=Decimal("10.00"), category=category, submitted_by=user, status=status)
+        day = expense.created_at.date()
+
+        refresh_expense_rollup(day)
+        refresh_expense_rollup(day)
+
+        row = ExpenseRollup.objects.get()
+        self.assertEqual((row.category_id, row.expense_count, row.amount), (category.pk, 2, Decimal("20.00")))
+        self.assertEqual(check_rollups(), [])
+
+    def test_rebuild_matches_raw_tables(self):
+        other = make_org("Other")
+        make_paid_invoice(self.org, "100.00")
+        make_paid_invoice(other, "70.00", due_date=date(2025, 3, 15), client_name="Beta")
+        IncomeRollup.objects.create(organization=self.org, client_name="Stale", day=DAY, currency="INR", amount=Decimal("5.00"))
+
+        self.assertEqual(rebuild_income_rollups(), 2)
+        self.assertEqual(check_rollups(), [])
+
+
+class CostCenterAnalysisTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.org = make_org()
+        self.center = CostCenter.objects.create(name="Delivery")
+        self.period = FinancialPeriod.objects.create(name="Q1", start_date=date(2025, 1, 1), end_date=date(2025, 3, 31))
+        make_paid_invoice(self.org, "100.00", cost_center=self.center)
+        refresh_income_rollup(self.org.pk, DAY)
+
+    def _income(self):
+        count, rows = cost_center_analysis(self.period)
+        return {row["cost_center"]: row["income"] for row in rows}
+
+    def test_results_are_cached_until_the_data_changes(self):
+        version = data_version()
+        self.assertEqual(self._income(), {"Delivery": Decimal("100.000000")})
+        with self.assertNumQueries(4):  # the version stamp and the cache lookup
+            self._income()
+        self.assertEqual(data_version(), version)
+
+    def test_changes_made_elsewhere_invalidate_the_cache(self):
+        self._income()
+
+        # as another process would leave the tables: no signal or callback runs here
+        make_paid_invoice(self.org, "50.00", cost_center=self.center)
+        refresh_income_rollup(self.org.pk, DAY)
+        self.assertEqual(self._income(), {"Delivery": Decimal("150.000000")})
+
+        CostCenter.objects.filter(pk=self.center.pk).update(name="Operations", updated_at=timezone.now())
+        self.assertEqual(self._income(), {"Operations": Decimal("150.000000")})
+
+        IncomeRollup.objects.all().delete()
+        self.assertEqual(self._income(), {"Operations": Decimal("0")})
+
+
+class PartnerBreakdownTests(TestCase):
+    def setUp(self):
+        self.org = make_org()
+        self.period = FinancialPeriod.objects.create(name="Q1", start_date=date(2025, 1, 1), end_date=date(2025, 3, 31))
+        self.category = ExpenseCategory.objects.create(name="Travel")
+
+    def _partner(self, username, income=(), expenses=()):
+        """Partner with income shares of paid invoices ((amount, exchange rate) pairs) and approved expense allocations."""
+        partner = make_user(username)
+        for amount, rate in income:
+            invoice = make_paid_invoice(self.org, amount, exchange_rate=Decimal(rate))
+            PartnerIncomeShare.objects.create(partner=partner, invoice=invoice, amount=Decimal(amount))
+        for amount in expenses:
+            expense = Expense.objects.create(
+                title="Taxi", amount=Decimal(amount), category=self.category, submitted_by=partner, status=Expense.Status.APPROVED,
+            )
+            PartnerExpenseAllocation.objects.create(expense=expense, partner=partner, amount=Decimal(amount))
+        Expense.objects.filter(submitted_by=partner).update(created_at=timezone.make_aware(datetime(2025, 3, 14, 12)))
+        return partner
+
+    def test_income_in_base_currency_less_expenses(self):
+        alice = self._partner("alice", income=[("100.00", "1"), ("10.00", "80")], expenses=["150.00"])
+        bob = self._partner("bob", expenses=["20.00"])
+
+        reports = {r.partner_id: r for r in generate_partner_breakdown(self.period)}
+
+        self.assertEqual(set(reports), {alice.pk, bob.pk})
+        self.assertEqual(
+            (reports[alice.pk].income, reports[alice.pk].expense, reports[alice.pk].net_profit),
+            (Decimal("900.00"), Decimal("150.00"), Decimal("750.00")),
+        )
+        self.assertEqual((reports[bob.pk].income, reports[bob.pk].net_profit), (Decimal("0.00"), Decimal("-20.00")))
+
+    def test_versions_are_per_partner(self):
+        alice = self._partner("alice", income=[("100.00", "1")])
+        bob = self._partner("bob", income=[("50.00", "1")])
+        generate_partner_breakdown(self.period)
+        PartnerFinancialBreakdown.objects.filter(partner=alice).update(is_finalized=True)
+
+        reports = {r.partner_id: r.version for r in generate_partner_breakdown(self.period)}
+
+        self.assertEqual(reports, {alice.pk: 2, bob.pk: 1})
+        self.assertEqual(PartnerFinancialBreakdown.objects.filter(partner=bob).count(), 1)
+
+        reports = {r.partner_id: r.version for r in generate_partner_breakdown(self.period, force_new_version=True)}
+        self.assertEqual(reports, {alice.pk: 3, bob.pk: 2})
+
+    def test_restrict_to_one_partner(self):
+        alice = self._partner("alice", income=[("100.00", "1")])
+        self._partner("bob", income=[("50.00", "1")])
+
+        reports = generate_partner_breakdown(self.period, restrict_partner_id=alice.pk)
+
+        self.assertEqual([r.partner_id for r in reports], [alice.pk])
+        self.assertEqual(PartnerFinancialBreakdown.objects.count(), 1)
+
+    def test_query_count_does_not_grow_with_partners(self):
+        self._partner("alice", income=[("100.00", "1")], expenses=["10.00"])
+        with CaptureQueriesContext(connection) as one:
+            generate_partner_breakdown(self.period)
+        for i in range(5):
+            self._partner(f"partner{i}", income=[("10.00", "1")], expenses=["1.00"])
+
+        with self.assertNumQueries(len(one)):
+            reports = generate_partner_breakdown(self.period)
+        self.assertEqual(len(reports), 6)
+
+
+class ReportSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.org = make_org()
+        self.period = FinancialPeriod.objects.create(name="Q1", start_date=date(2025, 1, 1), end_date=date(2025, 3, 31))
+        make_paid_invoice(self.org, "100.00")
+        refresh_income_rollup(self.org.pk, DAY)
+
+    def test_unchanged_inputs_reuse_the_version(self):
+        first = generate_profit_loss(self.period)
+        second = generate_profit_loss(self.period)
+
+        self.assertEqual((first.pk, first.total_income), (second.pk, Decimal("100.00")))
+        self.assertEqual(ProfitLossReport.objects.count(), 1)
+
+    def test_finalized_version_is_served_from_cache(self):
+        report = generate_profit_loss(self.period)
+        report.finalize()
+        generate_profit_loss(self.period)
+
+        with self.assertNumQueries(3):  # the latest version number, then pointer and snapshot from the cache
+            cached = generate_profit_loss(self.period)
+        self.assertEqual((cached.pk, cached.is_finalized), (report.pk, True))
+
+    def test_newer_version_from_another_process_bypasses_the_snapshot(self):
+        generate_profit_loss(self.period).finalize()
+        generate_profit_loss(self.period)
+
+        # written without going through this process's snapshot layer
+        newer = ProfitLossReport.objects.create(period=self.period, version=2, total_income=Decimal("1.00"))
+
+        self.assertEqual(generate_profit_loss(self.period).pk, newer.pk)
+        newer.finalize()
+        self.assertEqual(generate_profit_loss(self.period).pk, newer.pk)
+
+
+class ForecastTests(TestCase):
+    def test_flat_series_forecasts_its_level(self):
+        result = forecast([[0, 0, 10, 10, 10, 10, 10, 10]], horizon=[1, 2, 3])
+
+        self.assertAlmostEqual(result.values[0], 30.0)
+        self.assertTrue(result.methods[0].startswith("ses"))
+        self.assertAlmostEqual(result.errors[0], 0.0)
+
+    def test_linear_series_uses_the_trend(self):
+        result = forecast([[1, 2, 3, 4, 5, 6, 7, 8]], horizon=[1, 2])
+
+        self.assertEqual(result.methods, ["trend"])
+        self.assertAlmostEqual(result.values[0], 9.0 + 10.0)
+
+    def test_short_series_falls_back_to_the_default_alpha(self):
+        result = forecast([[0, 0, 0, 0, 0, 0, 0, 5]], horizon=[1])
+
+        self.assertEqual(result.methods, ["ses(0.5)"])
+        self.assertTrue(np.isnan(result.errors[0]))
+
+
+class ForecastReportViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.org = make_org()
+        self.period = FinancialPeriod.objects.create(name="Apr", start_date=date(2025, 4, 1), end_date=date(2025, 4, 30))
+        for month in (1, 2, 3):
+            IncomeRollup.objects.create(
+                organization=self.org, client_name="Client", day=date(2025, month, 10), currency="INR",
+                amount=Decimal("100.00"), amount_base=Decimal("100.00"),
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(make_user())
+        self.url = reverse("forecast-report-generate")
+
+    def _post(self, **data):
+        return self.client.post(self.url, {"period": str(self.period.pk), **data}, format="json")
+
+    def test_organization_forecast(self):
+        response = self._post(organization=str(self.org.pk))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data["forecasted_income"]), Decimal("100.00"))
+        self.assertEqual(ForecastReport.objects.get().organization_id, self.org.pk)
+
+    def test_company_wide_forecast(self):
+        response = self._post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(ForecastReport.objects.get().organization_id)
+
+    def test_bad_or_unknown_organization(self):
+        self.assertEqual(self._post(organization="not-a-uuid").status_code, 400)
+        self.assertEqual(self._post(organization=str(uuid.uuid4())).status_code, 404)
+        self.assertFalse(ForecastReport.objects.exists())
+
+
+class CurrencyTests(TestCase):
+    def setUp(self):
+        fx.invalidate_exchange_rates()
+        self.addCleanup(fx.invalidate_exchange_rates)
+        self.org = make_org()
+        fx.load_rates([
+            {"currency": "USD", "base_currency": "INR", "rate": "80", "effective_from": "2020-01-01"},
+            {"currency": "INR", "base_currency": "USD", "rate": "0.0125", "effective_from": "2020-01-01"},
+        ])
+        fx.invalidate_exchange_rates()  # the on_commit invalidation does not run inside the test transaction
+
+    def test_missing_rate_comes_from_the_table(self):
+        invoice = make_paid_invoice(self.org, "10.00", currency="USD")
+
+        self.assertEqual(invoice.exchange_rate, Decimal("80"))
+        self.assertEqual((invoice.total_amount_base, invoice.base_currency), (Decimal("800.000000"), "INR"))
+        self.assertEqual(make_paid_invoice(self.org, "10.00").exchange_rate, Decimal("1"))
+
+    def test_explicit_rate_of_one_is_kept(self):
+        invoice = make_paid_invoice(self.org, "10.00", currency="USD", exchange_rate=Decimal("1"))
+        invoice.total_amount = Decimal("20.00")
+        invoice.save()
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.exchange_rate, invoice.total_amount_base), (Decimal("1"), Decimal("20.000000")))
+
+    def test_rebase_converts_invoices_and_rollups(self):
+        invoice = make_paid_invoice(self.org, "160.00")
+        Invoice.objects.filter(pk=invoice.pk).update(created_at=timezone.make_aware(datetime(2025, 3, 14, 12)))
+        refresh_income_rollup(self.org.pk, DAY)
+
+        stats = fx.rebase_invoices("usd")
+        self.assertEqual((stats["invoices"], stats["missing"]), (1, []))
+        self.assertEqual(fx.rebase_invoices("USD")["invoices"], 0)
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.total_amount_base, invoice.base_currency), (Decimal("2.000000"), "USD"))
+        self.assertEqual(IncomeRollup.objects.get().amount_base, Decimal("2.000000"))
+
+    def test_rebase_refuses_while_expenses_exist(self):
+        make_paid_invoice(self.org, "160.00")
+        Expense.objects.create(title="Taxi", amount=Decimal("10.00"), submitted_by=make_user(), status=Expense.Status.APPROVED)
+
+        with self.assertRaises(ValueError):
+            fx.rebase_invoices("USD")
+        self.assertFalse(Invoice.objects.filter(base_currency="USD").exists())
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentRollupRefreshTests(TransactionTestCase):
+    def test_concurrent_refreshes_do_not_double_count(self):
+        org = make_org()
+        for _ in range(3):
+            make_paid_invoice(org, "10.00")
+        errors = []
+        barrier = threading.Barrier(6)
+
+        def refresh():
+            try:
+                barrier.wait()
+                refresh_income_rollup(org.pk, DAY)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=refresh) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(IncomeRollup.objects.get().invoice_count, 3)
+        self.assertEqual(check_rollups(), [])
+
+
+def _content(response):
+    body = b"".join(response.streaming_content)
+    return gzip.decompress(body) if response.get("Content-Encoding") == "gzip" else body
+
+
+class ExportTests(TestCase):
+    FIELDS = ["invoice_number", ("Organization", "organization"), ("Org name", "organization__name"), "total_amount"]
+
+    def setUp(self):
+        self.org = make_org()
+        for total in ("10.00", "20.00", "30.00"):
+            make_paid_invoice(self.org, total)
+        self.queryset = Invoice.objects.order_by("pk")
+        self.factory = RequestFactory()
+
+    def test_csv_with_relation_columns_is_one_query(self):
+        response = export_queryset(self.queryset, self.FIELDS, "invoices")
+        with self.assertNumQueries(1):
+            lines = _content(response).decode().splitlines()
+
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="invoices.csv"')
+        self.assertEqual(lines[0], "invoice_number,Organization,Org name,total_amount")
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].endswith(",Acme,Acme,10.00"))
+
+    def test_ndjson_is_gzipped_when_accepted(self):
+        request = self.factory.get("/", {"export": "ndjson"}, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        response = export_queryset(self.queryset, ["total_amount", "due_date"], "invoices", request=request)
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        rows = [json.loads(line) for line in _content(response).decode().splitlines()]
+        self.assertEqual(rows[0], {"total_amount": "10.00", "due_date": "2025-03-14"})
+
+    def test_xlsx_round_trips(self):
+        from openpyxl import load_workbook
+
+        response = export_rows(["day", "amount"], [[DAY, Decimal("1.50")], [None, 2]], "report", fmt="xlsx")
+        sheet = load_workbook(io.BytesIO(b"".join(response.streaming_content))).active
+
+        self.assertEqual([c.value for c in sheet[1]], ["day", "amount"])
+        self.assertEqual(sheet["B2"].value, 1.5)
+        self.assertIsNone(sheet["A3"].value)
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ExportError):
+            export_queryset(self.queryset, ["total_amount"], "invoices", request=self.factory.get("/", {"export": "pdf"}))
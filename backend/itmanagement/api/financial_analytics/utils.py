@@ -1,15 +1,27 @@
+import logging
+import time
+from datetime import timedelta
 from decimal import Decimal
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
-from django.http import Http404, StreamingHttpResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, F, ExpressionWrapper, DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.http import Http404
 from django.conf import settings
-from api.income.models import Invoice, PartnerIncomeShare
-from api.expense.models import Expense, PartnerExpenseAllocation
+from django.utils import timezone
+from api.income.models import PartnerIncomeShare
+from api.expense.models import PartnerExpenseAllocation
 from .models import *
-import csv
-import io
+from .rollups import data_version
+from .currency import base_currency
+from . import snapshots
+from .forecasting import HISTORY_MONTHS, forecast_period
+
+logger = logging.getLogger(__name__)
 
 TWOPLACES = Decimal("0.01")
-BASE_CURRENCY = getattr(settings, "FINANCE_BASE_CURRENCY", "INR")
+COST_CENTER_CACHE_TIMEOUT = 60 * 60
+PARTNER_BREAKDOWN_BATCH_SIZE = 5000
 
 def get_period_or_404(period_id):
     try:
@@ -21,206 +33,368 @@ def _next_version(qs, period):
     last = qs.filter(period=period).order_by("-version").first()
     return (last.version + 1) if last else 1
 
-def _create_version_or_reuse(model, period, defaults, force_new_version=False):
+def _create_version_or_reuse(model, period, defaults, force_new_version=False, latest=None, scope=None):
     """
     - If there is a non-finalized latest record, overwrite it (same version).
     - If finalized or force_new_version, create a new version = last + 1.
+    `latest` may be passed when the caller already loaded it; `scope` holds
+    extra fields (e.g. organization_id) that version chains are kept per.
     """
-    latest = model.objects.filter(period=period).order_by("-version").first()
+    scope = scope or {}
+    if latest is None:
+        latest = model.objects.filter(period=period, **scope).order_by("-version").first()
     if latest and not latest.is_finalized and not force_new_version:
         # update in-place
         for k, v in defaults.items():
             setattr(latest, k, v)
-        latest.base_currency = BASE_CURRENCY
+        latest.base_currency = base_currency()
         latest.save()
         return latest
     # create new version
-    version = _next_version(model.objects, period)
-    return model.objects.create(period=period, version=version, base_currency=BASE_CURRENCY, **defaults)
+    version = (latest.version + 1) if latest else 1
+    return model.objects.create(period=period, version=version, base_currency=base_currency(), **scope, **defaults)
 
-def _sum_invoices_base(period, extra_filter=None):
-    qs = Invoice.objects.filter(
-        status="paid",
-        due_date__range=(period.start_date, period.end_date)
+def _snapshot_report(model, period, compute, force_new_version=False, watermark=None, scope=None):
+    """
+    Latest `model` version for `period` through the snapshot layer:
+    - a finalized latest version is returned as-is, from cache when possible;
+    - a non-finalized one is reused while its input watermark is unchanged;
+    - otherwise compute() supplies the figures and the version is overwritten
+      (or a new one created, see _create_version_or_reuse).
+    `watermark` is a callable returning the input watermark; it defaults to
+    the period's invoice/expense watermark and is only called on a cache miss.
+    `scope` is passed on to _create_version_or_reuse.
+    """
+    scope = scope or {}
+    if not force_new_version:
+        report = snapshots.cached_snapshot(model, period, scope)
+        if report is not None:
+            return report
+
+    latest = model.objects.filter(period=period, **scope).order_by("-version").first()
+    if latest and latest.is_finalized and not force_new_version:
+        snapshots.store_snapshot(latest, scope)
+        return latest
+
+    watermark = watermark() if watermark else snapshots.period_watermark(period)
+    if latest and not latest.is_finalized and not force_new_version and latest.input_watermark == watermark:
+        return latest
+
+    return _create_version_or_reuse(
+        model, period, dict(compute(), input_watermark=watermark), force_new_version=force_new_version,
+        latest=latest, scope=scope,
     )
+
+def _sum_invoices_base(period, extra_filter=None):
+    """Paid invoice revenue in base currency, read from the daily income rollup."""
+    qs = IncomeRollup.objects.filter(day__range=(period.start_date, period.end_date))
     if extra_filter:
         qs = qs.filter(**extra_filter)
-
-    # Normalize to base currency with exchange_rate snapshot on Invoice
-    # Expect invoice has fields: total_amount, exchange_rate (rate to BASE)
-    expr = ExpressionWrapper(F("total_amount") * F("exchange_rate"), output_field=DecimalField(max_digits=18, decimal_places=2))
-    return qs.aggregate(total=Sum(expr))["total"] or Decimal("0.00")
+    return qs.aggregate(total=Sum("amount_base"))["total"] or Decimal("0.00")
 
 def _sum_expenses_base(period, extra_filter=None):
-    qs = Expense.objects.filter(
-        status="Approved",
-        created_at__range=(period.start_date, period.end_date)
-    )
+    """Approved expenses (already base currency), read from the daily expense rollup."""
+    qs = ExpenseRollup.objects.filter(day__range=(period.start_date, period.end_date))
     if extra_filter:
         qs = qs.filter(**extra_filter)
-
-    expr = F("amount")  # already base currency
-    return qs.aggregate(total=Sum(expr))["total"] or Decimal("0.00")
+    return qs.aggregate(total=Sum("amount"))["total"] or Decimal("0.00")
 
 
 def generate_profit_loss(period: FinancialPeriod, force_new_version=False):
-    income = _sum_invoices_base(period)
-    expense = _sum_expenses_base(period)
-    net = (income - expense).quantize(TWOPLACES)
-    return _create_version_or_reuse(
-        ProfitLossReport,
-        period,
-        defaults={"total_income": income, "total_expense": expense, "net_profit": net},
-        force_new_version=force_new_version
-    )
+    def compute():
+        income = _sum_invoices_base(period)
+        expense = _sum_expenses_base(period)
+        net = (income - expense).quantize(TWOPLACES)
+        return {"total_income": income, "total_expense": expense, "net_profit": net}
+    return _snapshot_report(ProfitLossReport, period, compute, force_new_version=force_new_version)
 
 def generate_cash_flow(period: FinancialPeriod, force_new_version=False):
-    inflow = _sum_invoices_base(period)
-    outflow = _sum_expenses_base(period)
-    net = (inflow - outflow).quantize(TWOPLACES)
-    return _create_version_or_reuse(
-        CashFlowReport,
-        period,
-        defaults={"total_inflow": inflow, "total_outflow": outflow, "net_cash": net},
-        force_new_version=force_new_version
+    def compute():
+        inflow = _sum_invoices_base(period)
+        outflow = _sum_expenses_base(period)
+        net = (inflow - outflow).quantize(TWOPLACES)
+        return {"total_inflow": inflow, "total_outflow": outflow, "net_cash": net}
+    return _snapshot_report(CashFlowReport, period, compute, force_new_version=force_new_version)
+
+def _latest_partner_versions(period, partner_ids):
+    """Latest PartnerFinancialBreakdown per partner for `period`, in one query."""
+    latest = (
+        PartnerFinancialBreakdown.objects.filter(period=period, partner_id=OuterRef("partner_id"))
+        .order_by("-version").values("version")[:1]
+    )
+    return PartnerFinancialBreakdown.objects.filter(
+        period=period, partner_id__in=partner_ids, version=Subquery(latest)
     )
 
+
 def generate_partner_breakdown(period: FinancialPeriod, force_new_version=False, restrict_partner_id=None):
+    """
+    Per-partner income (paid invoice shares, base currency) and expense
+    (approved expense allocations) for `period`. Versioning is per partner:
+    a partner's latest non-finalized report is overwritten, otherwise (or
+    with force_new_version) a new version is added. Income, expense, the
+    latest versions and the write are one query each, whatever the number
+    of partners.
+    """
     # income shares normalized
     shares = PartnerIncomeShare.objects.filter(
         invoice__status="paid",
         invoice__due_date__range=(period.start_date, period.end_date)
     )
+    allocs = PartnerExpenseAllocation.objects.filter(
+        expense__status="Approved",
+        expense__created_at__date__range=(period.start_date, period.end_date)
+    )
     if restrict_partner_id:
         shares = shares.filter(partner_id=restrict_partner_id)
+        allocs = allocs.filter(partner_id=restrict_partner_id)
 
-    # assume PartnerIncomeShare has 'amount' already in invoice currency; multiply by invoice.exchange_rate
+    # PartnerIncomeShare.amount is in invoice currency; multiply by invoice.exchange_rate
     expr_income = ExpressionWrapper(F("amount") * F("invoice__exchange_rate"), output_field=DecimalField(max_digits=18, decimal_places=2))
-    partner_summaries = shares.values("partner_id").annotate(total_income=Sum(expr_income))
-
-    reports = []
-    for summary in partner_summaries:
-        partner_id = summary["partner_id"]
-        income = summary["total_income"] or Decimal("0.00")
-        allocs = PartnerExpenseAllocation.objects.filter(
-            partner_id=partner_id,
-            expense__status="Approved",
-            expense__created_at__range=(period.start_date, period.end_date)
-        )
-        expr_exp = ExpressionWrapper(F("amount") * F("expense__exchange_rate"), output_field=DecimalField(max_digits=18, decimal_places=2))
-        expense = allocs.aggregate(total=Sum(expr_exp))["total"] or Decimal("0.00")
-        net = (income - expense).quantize(TWOPLACES)
-        report = _create_version_or_reuse(
-            PartnerFinancialBreakdown,
-            period,
-            defaults={"partner_id": partner_id, "income": income, "expense": expense, "net_profit": net},
-            force_new_version=force_new_version
-        )
-        # ensure partner field kept if reusing existing
-        if report.partner_id != partner_id:
-            report.partner_id = partner_id
-            report.save(update_fields=["partner"])
-        reports.append(report)
-    return reports
+    income = dict(shares.values("partner_id").annotate(total=Sum(expr_income)).order_by().values_list("partner_id", "total"))
+    # expenses carry no currency; amounts are already in base currency
+    expense = dict(allocs.values("partner_id").annotate(total=Sum("amount")).order_by().values_list("partner_id", "total"))
+
+    partner_ids = sorted(set(income) | set(expense))
+    if not partner_ids:
+        return []
+    latest = {r.partner_id: r for r in _latest_partner_versions(period, partner_ids)}
+
+    currency = base_currency()
+    rows = []
+    for partner_id in partner_ids:
+        partner_income = (income.get(partner_id) or Decimal("0.00")).quantize(TWOPLACES)
+        partner_expense = (expense.get(partner_id) or Decimal("0.00")).quantize(TWOPLACES)
+        current = latest.get(partner_id)
+        if current and not current.is_finalized and not force_new_version:
+            version = current.version  # overwrite in place
+        else:
+            version = current.version + 1 if current else 1
+        rows.append(PartnerFinancialBreakdown(
+            partner_id=partner_id, period=period, version=version, base_currency=currency,
+            income=partner_income, expense=partner_expense,
+            net_profit=(partner_income - partner_expense).quantize(TWOPLACES),
+        ))
+
+    # one upsert: reused versions conflict on (partner, period, version) and are updated
+    PartnerFinancialBreakdown.objects.bulk_create(
+        rows, batch_size=PARTNER_BREAKDOWN_BATCH_SIZE, update_conflicts=True,
+        unique_fields=["partner", "period", "version"],
+        update_fields=["income", "expense", "net_profit", "base_currency"],
+    )
+    return list(_latest_partner_versions(period, partner_ids).order_by("partner_id"))
 
 def generate_tax_report(period: FinancialPeriod, tax_rate: Decimal = Decimal("10"), force_new_version=False):
-    total_income = _sum_invoices_base(period)
-    total_deductions = _sum_expenses_base(period)
-    taxable_income = (total_income - total_deductions).quantize(TWOPLACES)
-    tax_due = (taxable_income * tax_rate / Decimal("100")).quantize(TWOPLACES)
-    return _create_version_or_reuse(
-        TaxReport,
-        period,
-        defaults={
+    def compute():
+        total_income = _sum_invoices_base(period)
+        total_deductions = _sum_expenses_base(period)
+        taxable_income = (total_income - total_deductions).quantize(TWOPLACES)
+        tax_due = (taxable_income * tax_rate / Decimal("100")).quantize(TWOPLACES)
+        return {
             "total_taxable_income": taxable_income,
             "total_deductions": total_deductions,
             "tax_due": tax_due,
             "tax_rate": Decimal(tax_rate),
-        },
-        force_new_version=force_new_version
+        }
+    return _snapshot_report(
+        TaxReport, period, compute, force_new_version=force_new_version,
+        watermark=lambda: snapshots.period_watermark(period, str(Decimal(tax_rate))),
+    )
+
+def previous_period(period: FinancialPeriod):
+    """
+    (start_date, end_date) of the period before `period`: the latest
+    FinancialPeriod ending before it starts, else a window of the same length
+    immediately preceding it.
+    """
+    prev = FinancialPeriod.objects.filter(end_date__lt=period.start_date).order_by("-end_date").first()
+    if prev:
+        return prev.start_date, prev.end_date
+    length = period.end_date - period.start_date
+    end = period.start_date - timedelta(days=1)
+    return end - length, end
+
+
+def _rollup_total(model, field, date_range):
+    """Correlated per-CostCenter sum of a rollup column over date_range."""
+    total = (
+        model.objects.filter(cost_center=OuterRef("pk"), day__range=date_range)
+        .values("cost_center").annotate(total=Sum(field)).values("total")
     )
+    output = model._meta.get_field(field)
+    return Coalesce(Subquery(total, output_field=output), Value(Decimal("0")), output_field=output)
+
 
-def generate_cost_center_analysis(period: FinancialPeriod, limit_to_centers=None):
-    centers = CostCenter.objects.all()
+def _cost_center_queryset(period, compare_range=None, limit_to_centers=None):
+    current = (period.start_date, period.end_date)
+    centers = CostCenter.objects.annotate(
+        income_total=_rollup_total(IncomeRollup, "amount_base", current),
+        expense_total=_rollup_total(ExpenseRollup, "amount", current),
+    )
+    if compare_range:
+        centers = centers.annotate(
+            previous_income_total=_rollup_total(IncomeRollup, "amount_base", compare_range),
+            previous_expense_total=_rollup_total(ExpenseRollup, "amount", compare_range),
+        )
     if limit_to_centers:
         centers = centers.filter(name__in=limit_to_centers)
+    return centers.order_by("name", "pk")
 
-    analysis = []
-    for center in centers:
-        income = _sum_invoices_base(period, extra_filter={"cost_center": center})
-        expense = _sum_expenses_base(period, extra_filter={"cost_center": center})
-        net = (income - expense).quantize(TWOPLACES)
-        analysis.append({
-            "cost_center": center.name,
-            "income": income,
-            "expense": expense,
-            "net_profit": net,
-            "base_currency": BASE_CURRENCY
-        })
-    return analysis
-
-def export_to_csv(queryset, fields, filename="report.csv"):
-    """
-    Streaming CSV for large datasets; converts Decimals to strings.
-    """
-    def row_iter():
-        yield fields
-        for obj in queryset.iterator():
-            row = []
-            for f in fields:
-                val = getattr(obj, f)
-                if isinstance(val, Decimal):
-                    row.append(str(val))
-                else:
-                    row.append(str(val))
-            yield row
-
-    class Echo:
-        def write(self, value):
-            return value
-
-    pseudo_buffer = Echo()
-    writer = csv.writer(pseudo_buffer)
-    def stream():
-        for row in row_iter():
-            yield writer.writerow(row)
-
-    response = StreamingHttpResponse(stream(), content_type="text/csv")
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
-
-def generate_forecast(period: FinancialPeriod, periods_back=6, force_new_version=False):
-    last_reports = ProfitLossReport.objects.order_by("-period__end_date")[:periods_back]
-    if not last_reports.exists():
-        return _create_version_or_reuse(
-            ForecastReport,
-            period,
-            defaults={
-                "forecasted_income": Decimal("0.00"),
-                "forecasted_expense": Decimal("0.00"),
-                "forecasted_net_profit": Decimal("0.00"),
-            },
-            force_new_version=force_new_version
-        )
 
-    last_reports = list(last_reports[::-1])  # oldest first
-    weights = list(range(1, len(last_reports) + 1))
-    total_weight = sum(weights) or 1
+def _cost_center_row(center, compare):
+    net = (center.income_total - center.expense_total).quantize(TWOPLACES)
+    row = {
+        "cost_center": center.name,
+        "income": center.income_total,
+        "expense": center.expense_total,
+        "net_profit": net,
+        "base_currency": base_currency()
+    }
+    if compare:
+        previous_net = (center.previous_income_total - center.previous_expense_total).quantize(TWOPLACES)
+        row["previous"] = {
+            "income": center.previous_income_total,
+            "expense": center.previous_expense_total,
+            "net_profit": previous_net,
+        }
+        row["delta"] = {
+            "income": center.income_total - center.previous_income_total,
+            "expense": center.expense_total - center.previous_expense_total,
+            "net_profit": net - previous_net,
+        }
+    return row
 
-    weighted_income = sum([r.total_income * w for r, w in zip(last_reports, weights)]) / total_weight
-    weighted_expense = sum([r.total_expense * w for r, w in zip(last_reports, weights)]) / total_weight
 
-    forecasted_income = Decimal(weighted_income).quantize(TWOPLACES)
-    forecasted_expense = Decimal(weighted_expense).quantize(TWOPLACES)
-    forecasted_net = (forecasted_income - forecasted_expense).quantize(TWOPLACES)
+def generate_cost_center_analysis(period: FinancialPeriod, limit_to_centers=None, compare_range=None,
+                                  offset=0, limit=None):
+    """
+    Income/expense per cost center from the rollups. Every center's totals
+    (and, with compare_range, the totals for that (start, end) window) are
+    correlated subqueries of a single CostCenter query, so a call costs one
+    query however many centers there are. offset/limit select a page.
+    """
+    centers = _cost_center_queryset(period, compare_range, limit_to_centers)
+    if limit is not None:
+        centers = centers[offset:offset + limit]
+    elif offset:
+        centers = centers[offset:]
+    return [_cost_center_row(center, bool(compare_range)) for center in centers]
 
-    return _create_version_or_reuse(
-        ForecastReport,
-        period,
-        defaults={
-            "forecasted_income": forecasted_income,
-            "forecasted_expense": forecasted_expense,
-            "forecasted_net_profit": forecasted_net,
-        },
-        force_new_version=force_new_version
+
+def cost_center_analysis(period: FinancialPeriod, compare_range=None, offset=0, limit=None):
+    """
+    Cached generate_cost_center_analysis() page plus the total center count.
+    Entries are keyed by period dates, page and the rollup data version, so any
+    rollup refresh or CostCenter change makes them unreachable.
+    Returns (count, rows).
+    """
+    key = "financial_analytics:cost_center_analysis:{}:{}:{}:{}:{}:{}".format(
+        data_version(), period.start_date, period.end_date,
+        "{}:{}".format(*compare_range) if compare_range else "-", offset, limit,
+    )
+    cached = cache.get(key)
+    if cached is None:
+        rows = generate_cost_center_analysis(period, compare_range=compare_range, offset=offset, limit=limit)
+        count = CostCenter.objects.count() if limit is not None else offset + len(rows)
+        cached = (count, rows)
+        cache.set(key, cached, COST_CENTER_CACHE_TIMEOUT)
+    return cached
+
+def export_to_csv(queryset, fields, filename="report.csv", request=None):
+    """
+    Streaming CSV export; kept for existing callers, see exports.export_queryset.
+    """
+    from .exports import export_queryset
+    return export_queryset(queryset, fields, filename.rsplit(".", 1)[0], fmt="csv", request=request)
+
+FORECAST_TAX_RATE = Decimal("0.10")
+
+
+def _forecast_figures(income, expenses):
+    expected_tax = ((income - expenses) * FORECAST_TAX_RATE).quantize(TWOPLACES) if income > expenses else Decimal("0.00")
+    return {
+        "forecasted_income": income,
+        "forecasted_expenses": expenses,
+        "expected_tax": expected_tax,
+        "net_profit": (income - expenses - expected_tax).quantize(TWOPLACES),
+    }
+
+
+def _forecast_defaults(result, organization_id):
+    """ForecastReport fields for one organization (or the company-wide row) of a forecast_period() result."""
+    if organization_id is None:
+        income, method, error = result["total_income"]
+        expenses = result["total_expense"][0]
+    else:
+        income, method, error = result["organizations"].get(organization_id, (Decimal("0.00"), "", None))
+        expenses = Decimal("0.00")  # expenses carry no organization
+    return dict(_forecast_figures(income, expenses), method=method, backtest_error=error)
+
+
+def _forecast_watermark(history_months):
+    # forecasts only read the rollups, whose version stamp moves on every refresh
+    return snapshots.data_watermark("forecast", data_version(), history_months)
+
+
+def generate_forecast(period: FinancialPeriod, organization_id=None, history_months=HISTORY_MONTHS, force_new_version=False):
+    """
+    Forecast `period` for one organization's income, or company-wide income
+    and expenses when organization_id is None (see forecasting.py).
+    """
+    return _snapshot_report(
+        ForecastReport, period,
+        lambda: _forecast_defaults(forecast_period(period, history_months), organization_id),
+        force_new_version=force_new_version,
+        watermark=lambda: _forecast_watermark(history_months),
+        scope={"organization_id": organization_id},
+    )
+
+
+def generate_all_forecasts(period: FinancialPeriod, history_months=HISTORY_MONTHS, force_new_version=False):
+    """
+    Forecast `period` for every organization with rollup history plus the
+    company-wide row in one vectorized pass, then write all reports with one
+    bulk insert and one bulk update. Versioning per organization follows
+    _create_version_or_reuse. Returns counts and phase timings.
+    """
+    started = time.perf_counter()
+    result = forecast_period(period, history_months)
+    timings = dict(result["timings"])
+
+    write_started = time.perf_counter()
+    watermark = _forecast_watermark(history_months)
+    now = timezone.now()
+    currency = base_currency()
+    latest = {}
+    for report in ForecastReport.objects.filter(period=period).order_by("version"):
+        latest[report.organization_id] = report
+
+    created, updated = [], []
+    for organization_id in [None, *result["organizations"]]:
+        defaults = dict(_forecast_defaults(result, organization_id), input_watermark=watermark)
+        current = latest.get(organization_id)
+        if current and not current.is_finalized and not force_new_version:
+            for k, v in defaults.items():
+                setattr(current, k, v)
+            current.base_currency = currency
+            current.updated_at = now
+            updated.append(current)
+        else:
+            created.append(ForecastReport(
+                period=period, organization_id=organization_id, base_currency=currency,
+                version=current.version + 1 if current else 1, **defaults,
+            ))
+    with transaction.atomic():
+        ForecastReport.objects.bulk_create(created, batch_size=1000)
+        ForecastReport.objects.bulk_update(
+            updated, ["base_currency", "input_watermark", "method", "backtest_error", "updated_at", *_forecast_figures(0, 0)],
+            batch_size=1000,
+        )
+    timings["write"] = time.perf_counter() - write_started
+    timings["total"] = time.perf_counter() - started
+
+    logger.info(
+        "Forecasts for %s: %d created, %d updated in %.3fs (load %.3fs, fit %.3fs, write %.3fs)",
+        period, len(created), len(updated), timings["total"], timings["load"], timings["fit"], timings["write"],
     )
+    return {"organizations": len(result["organizations"]), "created": len(created), "updated": len(updated), "timings": timings}
@@ -1,10 +1,24 @@
+import uuid
+
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from django.http import HttpResponse
+from rest_framework.pagination import LimitOffsetPagination
 from decimal import Decimal
+from api.organizations.models import Organization
 from .models import *
 from .serializers import *
 from .utils import *
+from .exports import ExportError, export_queryset
+
+# reports are exported with the period name rather than the FinancialPeriod object
+PERIOD = ("period", "period__name")
+
+
+def export_report(request, queryset, fields, filename):
+    try:
+        return export_queryset(queryset.order_by("pk"), fields, filename, request=request)
+    except ExportError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class FinancialPeriodListCreateView(generics.ListCreateAPIView):
@@ -31,9 +45,9 @@ class ProfitLossReportGenerateView(generics.GenericAPIView):
         return Response(serializer.data)
 
     def get(self, request, *args, **kwargs):
-        """Export P&L as CSV"""
+        """Export P&L (?export=csv|ndjson|xlsx, CSV by default)"""
         queryset = ProfitLossReport.objects.all()
-        return export_to_csv(queryset, ["period", "total_income", "total_expense", "net_profit"], filename="profit_loss.csv")
+        return export_report(request, queryset, [PERIOD, "total_income", "total_expense", "net_profit"], "profit_loss")
 
 
 
@@ -49,7 +63,7 @@ class CashFlowReportGenerateView(generics.GenericAPIView):
 
     def get(self, request, *args, **kwargs):
         queryset = CashFlowReport.objects.all()
-        return export_to_csv(queryset, ["period", "total_inflow", "total_outflow", "net_cash"], filename="cash_flow.csv")
+        return export_report(request, queryset, [PERIOD, "total_inflow", "total_outflow", "net_cash"], "cash_flow")
 
 
 
@@ -65,7 +79,10 @@ class PartnerFinancialBreakdownGenerateView(generics.GenericAPIView):
 
     def get(self, request, *args, **kwargs):
         queryset = PartnerFinancialBreakdown.objects.all()
-        return export_to_csv(queryset, ["partner", "period", "income", "expense", "net_profit"], filename="partner_breakdown.csv")
+        return export_report(
+            request, queryset, [("partner", "partner__username"), PERIOD, "income", "expense", "net_profit"],
+            "partner_breakdown",
+        )
 
 
 class TaxReportGenerateView(generics.GenericAPIView):
@@ -81,7 +98,7 @@ class TaxReportGenerateView(generics.GenericAPIView):
 
     def get(self, request, *args, **kwargs):
         queryset = TaxReport.objects.all()
-        return export_to_csv(queryset, ["period", "total_taxable_income", "total_deductions", "tax_due"], filename="tax_report.csv")
+        return export_report(request, queryset, [PERIOD, "total_taxable_income", "total_deductions", "tax_due"], "tax_report")
 
 
 class ForecastReportView(generics.GenericAPIView):
@@ -90,13 +107,28 @@ class ForecastReportView(generics.GenericAPIView):
 
     def post(self, request, *args, **kwargs):
         period = get_period_or_404(request.data.get("period"))
-        report = generate_forecast(period)
+        # without an organization the forecast is company-wide
+        organization_id = request.data.get("organization") or None
+        if organization_id is not None:
+            # forecasts are keyed by the UUID itself, not its string form
+            try:
+                organization_id = uuid.UUID(str(organization_id))
+            except ValueError:
+                return Response({"error": "organization must be a UUID."}, status=status.HTTP_400_BAD_REQUEST)
+            if not Organization.objects.filter(pk=organization_id).exists():
+                return Response({"error": "Organization not found."}, status=status.HTTP_404_NOT_FOUND)
+        report = generate_forecast(period, organization_id=organization_id)
         serializer = self.get_serializer(report)
         return Response(serializer.data)
 
     def get(self, request, *args, **kwargs):
         queryset = ForecastReport.objects.all()
-        return export_to_csv(queryset, ["period", "forecasted_net_profit"], filename="forecast_report.csv")
+        return export_report(
+            request, queryset,
+            [PERIOD, ("organization", "organization__name"), "version", "method",
+             "forecasted_income", "forecasted_expenses", "expected_tax", "net_profit"],
+            "forecast_report",
+        )
 
 class CostCenterAnalysisCreateView(generics.CreateAPIView):
     """
@@ -125,12 +157,27 @@ class CostCenterAnalysisView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        # CSV Export if requested
-        if request.query_params.get("format") == "csv":
+        # File export if requested (?export=csv|ndjson|xlsx; ?format= is taken by DRF)
+        if request.query_params.get("export"):
             queryset = CostCenter.objects.all()
-            return export_to_csv(queryset, ["name", "description"], filename="cost_center.csv")
+            return export_report(request, queryset, ["name", "description"], "cost_center")
 
-        # Otherwise return analysis JSON
+        # Otherwise return analysis JSON.
+        # ?compare=true adds previous-period totals and deltas (?compare_to=<period id>
+        # picks the comparison period); ?limit=&offset= paginate the centers.
         period = get_period_or_404(request.query_params.get("period"))
-        data = generate_cost_center_analysis(period)
-        return Response(data)
+        compare_range = None
+        if request.query_params.get("compare_to"):
+            other = get_period_or_404(request.query_params["compare_to"])
+            compare_range = (other.start_date, other.end_date)
+        elif request.query_params.get("compare", "false").lower() == "true":
+            compare_range = previous_period(period)
+
+        paginator = LimitOffsetPagination()
+        limit = paginator.get_limit(request)
+        offset = paginator.get_offset(request) if limit is not None else 0
+        count, data = cost_center_analysis(period, compare_range=compare_range, offset=offset, limit=limit)
+        if limit is None:
+            return Response(data)
+        paginator.request, paginator.limit, paginator.offset, paginator.count = request, limit, offset, count
+        return paginator.get_paginated_response(data)
@@ -0,0 +1,149 @@
+"""
+Compiled partner allocation plans.
+
+An AllocationPlan is the immutable, ordered set of share rules that applies to
+an invoice (its own InvoicePartnerShares, else its organization's
+OrgPartnerShares) plus the fallback partner that receives rounding remainders.
+Plans are cached per process and dropped whenever a share row changes, so
+allocating a payment is a pure in-memory computation once the plan is warm.
+"""
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+
+from django.core.cache import cache
+
+from .models import InvoicePartnerShare, OrgPartnerShare
+
+PLAN_VERSION_KEY = "income:allocation_plans:version"
+MAX_CACHED_PLANS = 50000
+VERSION_CHECK_INTERVAL = 1.0  # seconds between shared version checks
+
+
+def split_payment(amount, rules, fallback_partner_id=None):
+    """
+    Pure form of the allocate_payment arithmetic. `rules` are share objects
+    (partner_id, share_type, share_value) in priority order. Returns a list of
+    (partner_id, amount); any remainder goes to the fallback partner.
+    """
+    amount = Decimal(amount)
+    remaining = amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    splits = []
+    for rule in rules:
+        if remaining <= Decimal("0.00"):
+            break
+        if rule.share_type == "fixed":
+            share_amount = Decimal(rule.share_value).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        else:  # percentage
+            share_amount = (amount * (Decimal(rule.share_value) / Decimal("100.00"))).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        share_amount = min(share_amount, remaining)
+        if share_amount <= Decimal("0.00"):
+            continue
+        splits.append((rule.partner_id, share_amount))
+        remaining -= share_amount
+
+    if remaining > Decimal("0.00") and fallback_partner_id:
+        splits.append((fallback_partner_id, remaining))
+    return splits
+
+
+class AllocationRule(NamedTuple):
+    partner_id: object
+    share_type: str
+    share_value: Decimal
+
+
+class AllocationPlan(NamedTuple):
+    rules: tuple
+    fallback_partner_id: object
+
+    def split(self, amount):
+        """[(partner_id, amount), ...] for a payment of `amount`."""
+        return split_payment(amount, self.rules, self.fallback_partner_id)
+
+
+# (kind, pk) -> compiled rules; kind is "invoice" or "org". An invoice entry of
+# None means "no invoice-level shares, use the organization plan".
+_plans = OrderedDict()
+_plans_version = None
+_version_checked_at = 0.0
+
+
+def _compile(shares):
+    return tuple(AllocationRule(s.partner_id, s.share_type, s.share_value) for s in shares)
+
+
+def _sync_version():
+    """Drop the local cache when another process bumped the shared version."""
+    global _plans_version, _version_checked_at
+    now = time.monotonic()
+    if now - _version_checked_at < VERSION_CHECK_INTERVAL:
+        return
+    _version_checked_at = now
+    version = cache.get(PLAN_VERSION_KEY)
+    if version != _plans_version:
+        _plans.clear()
+        _plans_version = version
+
+
+def _remember(key, value):
+    _plans[key] = value
+    _plans.move_to_end(key)
+    if len(_plans) > MAX_CACHED_PLANS:
+        _plans.popitem(last=False)
+
+
+def invalidate_allocation_plans():
+    """Called on any share change; share edits are rare, so everything is dropped."""
+    global _plans_version
+    _plans.clear()
+    _plans_version = uuid.uuid4().hex
+    cache.set(PLAN_VERSION_KEY, _plans_version, None)
+
+
+def prime_allocation_plans(invoices):
+    """Load and cache the plans for many invoices in two queries."""
+    _sync_version()
+    invoices = [inv for inv in invoices if ("invoice", inv.pk) not in _plans]
+    if not invoices:
+        return
+    invoice_shares = defaultdict(list)
+    for share in InvoicePartnerShare.objects.filter(invoice__in=invoices).order_by("priority"):
+        invoice_shares[share.invoice_id].append(share)
+    org_ids = {inv.organization_id for inv in invoices if ("org", inv.organization_id) not in _plans}
+    org_shares = defaultdict(list)
+    for share in OrgPartnerShare.objects.filter(organization_id__in=org_ids).order_by("priority"):
+        org_shares[share.organization_id].append(share)
+
+    for org_id in org_ids:
+        _remember(("org", org_id), _compile(org_shares.get(org_id, ())))
+    for inv in invoices:
+        _remember(("invoice", inv.pk), _compile(invoice_shares[inv.pk]) if inv.pk in invoice_shares else None)
+
+
+def _org_rules(organization_id):
+    key = ("org", organization_id)
+    if key not in _plans:
+        shares = OrgPartnerShare.objects.filter(organization_id=organization_id).order_by("priority")
+        _remember(key, _compile(shares))
+    return _plans[key]
+
+
+def resolve_allocation_plan(invoice):
+    """The effective AllocationPlan for an invoice (cached)."""
+    _sync_version()
+    key = ("invoice", invoice.pk)
+    if key not in _plans:
+        shares = list(InvoicePartnerShare.objects.filter(invoice_id=invoice.pk).order_by("priority"))
+        _remember(key, _compile(shares) if shares else None)
+
+    invoice_rules = _plans[key]
+    org_rules = _org_rules(invoice.organization_id)
+    # remainder goes to the organization's first partner, else the invoice's
+    fallback_rules = org_rules or invoice_rules or ()
+    return AllocationPlan(
+        invoice_rules or org_rules,
+        fallback_rules[0].partner_id if fallback_rules else None,
+    )
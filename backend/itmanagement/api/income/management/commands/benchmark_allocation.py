@@ -0,0 +1,49 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.income.models import Invoice
+from api.income.allocation import prime_allocation_plans, resolve_allocation_plan
+
+
+class Command(BaseCommand):
+    help = (
+        "Allocate synthetic payments against existing invoices through the cached "
+        "allocation plans and report throughput and query counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=100000)
+        parser.add_argument("--invoices", type=int, default=1000, help="Number of invoices to spread payments over.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        invoices = list(Invoice.objects.only("id", "organization_id").order_by("-id")[: options["invoices"]])
+        if not invoices:
+            raise CommandError("No invoices to allocate against.")
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as prime_queries:
+            prime_allocation_plans(invoices)
+        prime_elapsed = time.perf_counter() - started
+
+        amounts = [Decimal(rng.randint(100, 10_000_000)) / 100 for _ in range(options["payments"])]
+        targets = [rng.choice(invoices) for _ in amounts]
+
+        splits = 0
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as alloc_queries:
+            for invoice, amount in zip(targets, amounts):
+                splits += len(resolve_allocation_plan(invoice).split(amount))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"Primed {len(invoices)} invoice plans in {prime_elapsed:.3f}s ({len(prime_queries)} queries).")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(amounts)} payments -> {splits} allocations in {elapsed:.2f}s "
+            f"({len(amounts) / elapsed:.0f} payments/s, {len(alloc_queries)} queries)."
+        ))
@@ -0,0 +1,58 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.organizations.models import Organization
+from api.income.models import Invoice
+
+
+class Command(BaseCommand):
+    help = (
+        "Stress the invoice number allocator: create invoices from parallel workers in a "
+        "throwaway organization and verify the numbers are unique and gap-free."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--keep", action="store_true", help="Keep the benchmark organization and its invoices.")
+
+    def handle(self, *args, **options):
+        total, workers = options["invoices"], options["workers"]
+        tag = uuid.uuid4().hex[:8]
+        org = Organization.objects.create(
+            name=f"bench-{tag}", legal_name=f"bench-{tag}", registration_number=f"bench-{tag}",
+            company_email="bench@example.com", company_phone="0", address="-", city="-",
+            state="-", postal_code="0", country="India", business_license="bench.pdf",
+        )
+
+        def create(n):
+            try:
+                for _ in range(n):
+                    Invoice.objects.create(organization=org, client_name="bench", client_email="bench@example.com")
+            finally:
+                connection.close()
+
+        per_worker = [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(create, per_worker))
+            elapsed = time.perf_counter() - started
+
+            numbers = list(Invoice.objects.filter(organization=org).values_list("invoice_number", flat=True))
+            sequence = sorted(int(n.rsplit("-", 1)[1]) for n in numbers)
+            # the series is shared, so the run must occupy one contiguous block of it
+            if len(set(numbers)) != total or sequence != list(range(sequence[0], sequence[0] + total)):
+                raise CommandError(f"Allocator produced duplicate or missing numbers ({len(set(numbers))}/{total} unique).")
+        finally:
+            if not options["keep"]:
+                org.delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} invoices from {workers} workers in {elapsed:.2f}s "
+            f"({total / elapsed:.0f} invoices/s), numbers unique and gap-free."
+        ))
@@ -0,0 +1,75 @@
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api.organizations.models import Organization
+from api.income.models import Invoice, InvoiceItem
+from api.income.retax import retax_invoices
+
+
+class Command(BaseCommand):
+    help = (
+        "Create synthetic invoices in a throwaway organization and time a dry-run and a "
+        "real batch re-tax over them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=100000)
+        parser.add_argument("--items", type=int, default=3, help="Items per invoice.")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--keep", action="store_true", help="Commit the benchmark organization and its invoices.")
+
+    def handle(self, *args, **options):
+        # everything runs in one transaction that is rolled back unless --keep,
+        # which is much cheaper than deleting 100k invoices through the ORM
+        with transaction.atomic():
+            self._run(options)
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def _run(self, options):
+        rng = random.Random(0)
+        tag = uuid.uuid4().hex[:8]
+        org = Organization.objects.create(
+            name=f"bench-{tag}", legal_name=f"bench-{tag}", registration_number=f"bench-{tag}",
+            company_email="bench@example.com", company_phone="0", address="-", city="-",
+            state="-", postal_code="0", country="India", business_license="bench.pdf",
+        )
+        started = time.perf_counter()
+        # bulk_create skips the per-invoice number allocation and recompute signals
+        invoices = Invoice.objects.bulk_create(
+            [
+                Invoice(
+                    organization=org, invoice_number=f"BENCH-{tag}-{i}", client_name="bench",
+                    client_email="bench@example.com", client_country=rng.choice(["India", "USA", "Germany"]),
+                    client_state=rng.choice(["", "Gujarat"]),
+                )
+                for i in range(options["invoices"])
+            ],
+            batch_size=5000,
+        )
+        InvoiceItem.objects.bulk_create(
+            [
+                InvoiceItem(invoice=inv, description="bench", quantity=rng.randint(1, 20),
+                            unit_price=Decimal(rng.randint(100, 1_000_000)) / 100)
+                for inv in invoices for _ in range(options["items"])
+            ],
+            batch_size=5000,
+        )
+        self.stdout.write(f"Created {len(invoices)} invoices in {time.perf_counter() - started:.1f}s")
+
+        for dry_run in (True, False):
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                result = retax_invoices(organization_id=org.pk, dry_run=dry_run,
+                                        batch_size=options["batch_size"], diff_limit=0)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"{'dry run' if dry_run else 'write  '}: {result['scanned']} invoices, {result['changed']} changed "
+                f"in {elapsed:.2f}s ({result['scanned'] / elapsed:.0f} invoices/s, {len(queries)} queries)"
+            ))
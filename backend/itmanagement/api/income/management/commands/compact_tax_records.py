@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.income.utils import compact_tax_records
+
+
+class Command(BaseCommand):
+    help = "Fold superseded TaxRecord versions into per-invoice TaxRecordHistory blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-versions", type=int, default=None, help="Superseded versions kept as rows per invoice.")
+        parser.add_argument("--min-age-days", type=int, default=None, help="Never compact records younger than this.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        stats = compact_tax_records(
+            keep_versions=options["keep_versions"], min_age_days=options["min_age_days"], batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {stats['archived']} tax records across {stats['invoices']} invoices."))
@@ -0,0 +1,31 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.income.payment_import import import_payments, read_payment_rows, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Import payments from a CSV, JSON or NDJSON file (columns: invoice, amount, method, reference, received_at)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "json", "ndjson"], help="Defaults to the file extension.")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in ("csv", "json", "ndjson"):
+            raise CommandError("Cannot infer the format; pass --format.")
+
+        with open(path, "rb") as fh:
+            result = import_payments(read_payment_rows(fh, fmt), batch_size=options["batch_size"])
+
+        for failure in result["failed"]:
+            self.stderr.write(json.dumps(failure))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['created']} payments with {result['allocations']} allocations; "
+            f"{len(result['failed'])} row(s) failed."
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.income.models import ReconciliationRun
+from api.income.tasks import reconcile_allocations_for_unallocated_payments
+
+
+class Command(BaseCommand):
+    help = "Allocate payments that have no partner allocations, resuming an interrupted run if there is one."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--max-chunks", type=int, default=None, help="Stop after this many chunks (the run stays resumable).")
+        parser.add_argument("--restart", action="store_true", help="Abandon any unfinished run and start from the first payment.")
+
+    def handle(self, *args, **options):
+        run = reconcile_allocations_for_unallocated_payments(
+            chunk_size=options["chunk_size"], max_chunks=options["max_chunks"], restart=options["restart"],
+        )
+        style = self.style.SUCCESS if run.status == ReconciliationRun.Status.COMPLETED else self.style.WARNING
+        self.stdout.write(style(
+            f"Run {run.pk} {run.status}: cursor {run.cursor}/{run.upper_bound}, "
+            f"{run.payments_scanned} scanned, {run.payments_allocated} allocated, "
+            f"{run.allocations_created} allocations in {run.elapsed_seconds:.2f}s "
+            f"({run.payments_per_second:.0f} payments/s)"
+        ))
+        if run.last_error:
+            self.stderr.write(run.last_error)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.income.pdf import render_invoices_for_period
+
+
+class Command(BaseCommand):
+    help = "Render (or refresh) the stored PDFs of all invoices created in a period."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--end", help="YYYY-MM-DD, inclusive")
+        parser.add_argument("--organization", help="Organization id")
+        parser.add_argument("--force", action="store_true", help="Re-render even if the stored PDF is current.")
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"]) if options["start"] else None
+        end = parse_date(options["end"]) if options["end"] else None
+        if (options["start"] and start is None) or (options["end"] and end is None):
+            raise CommandError("Dates must be YYYY-MM-DD.")
+        stats = render_invoices_for_period(start, end, organization_id=options["organization"], force=options["force"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['rendered']} rendered, {stats['cached']} already current, {stats['failed']} failed."
+        ))
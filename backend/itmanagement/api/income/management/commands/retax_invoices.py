@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api.income.retax import retax_invoices
+
+
+class Command(BaseCommand):
+    help = "Recompute invoice tax from the current TaxRules in bulk, optionally as a dry-run diff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--country")
+        parser.add_argument("--organization", help="Organization id")
+        parser.add_argument("--start", help="Invoices created on/after YYYY-MM-DD")
+        parser.add_argument("--end", help="Invoices created on/before YYYY-MM-DD")
+        parser.add_argument("--status", action="append", dest="statuses", help="Restrict to a status (repeatable).")
+        parser.add_argument("--include-paid", action="store_true", help="Also re-tax paid invoices (skipped by default).")
+        parser.add_argument("--dry-run", action="store_true", help="Report the diff without writing anything.")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--diff-limit", type=int, default=50, help="Changed invoices to print.")
+
+    def handle(self, *args, **options):
+        start = parse_date(options["start"]) if options["start"] else None
+        end = parse_date(options["end"]) if options["end"] else None
+        if (options["start"] and start is None) or (options["end"] and end is None):
+            raise CommandError("Dates must be YYYY-MM-DD.")
+
+        try:
+            result = retax_invoices(
+                country=options["country"], organization_id=options["organization"], start=start, end=end,
+                statuses=options["statuses"], include_paid=options["include_paid"], dry_run=options["dry_run"],
+                batch_size=options["batch_size"], diff_limit=options["diff_limit"],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        for row in result["diff"]:
+            self.stdout.write(json.dumps(row))
+        verb = "would change" if options["dry_run"] else "changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['scanned']} invoices scanned, {result['changed']} {verb}, tax delta {result['tax_delta']}."
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.income.reminders import dispatch_invoice_notifications
+
+
+class Command(BaseCommand):
+    help = "Mark overdue invoices and send pending reminder and overdue notices."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Parallel mail connections.")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        stats = dispatch_invoice_notifications(workers=options["workers"], batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['overdue_marked']} invoices marked overdue, {stats['sent']} notices sent, {stats['failed']} failed."
+        ))
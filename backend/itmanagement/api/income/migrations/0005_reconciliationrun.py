@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0004_invoicenumbersequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('upper_bound', models.BigIntegerField(default=0, help_text='Highest Payment id when the run started')),
+                ('chunk_size', models.PositiveIntegerField(default=1000)),
+                ('payments_scanned', models.PositiveIntegerField(default=0)),
+                ('payments_allocated', models.PositiveIntegerField(default=0)),
+                ('allocations_created', models.PositiveIntegerField(default=0)),
+                ('elapsed_seconds', models.FloatField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0005_reconciliationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='income.invoice')),
+            ],
+            options={
+                'unique_together': {('invoice', 'key')},
+            },
+        ),
+    ]
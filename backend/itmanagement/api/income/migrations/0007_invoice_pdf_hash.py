@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0006_invoicenotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the HTML pdf_file was rendered from', max_length=64),
+        ),
+    ]
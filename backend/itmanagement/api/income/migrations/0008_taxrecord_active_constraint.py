@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def keep_latest_active_record(apps, schema_editor):
+    """Leave only the newest active TaxRecord per invoice and point the invoice at it."""
+    TaxRecord = apps.get_model("income", "TaxRecord")
+    Invoice = apps.get_model("income", "Invoice")
+    latest_active = (
+        TaxRecord.objects.filter(invoice=OuterRef("invoice"), is_active=True)
+        .order_by("-version").values("pk")[:1]
+    )
+    TaxRecord.objects.filter(is_active=True).exclude(pk=Subquery(latest_active)).update(is_active=False)
+    Invoice.objects.update(current_tax_record=Subquery(
+        TaxRecord.objects.filter(invoice=OuterRef("pk"), is_active=True).values("pk")[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0007_invoice_pdf_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaxRecordHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versions', models.JSONField(default=list)),
+                ('archived_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='taxrecord',
+            name='income_taxr_invoice_59fa40_idx',
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='current_tax_record',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Denormalized pointer to the active TaxRecord', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='income.taxrecord'),
+        ),
+        migrations.RunPython(keep_latest_active_record, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='taxrecord',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('invoice',), name='income_taxrecord_one_active_per_invoice'),
+        ),
+        migrations.AddField(
+            model_name='taxrecordhistory',
+            name='invoice',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='tax_history', to='income.invoice'),
+        ),
+    ]
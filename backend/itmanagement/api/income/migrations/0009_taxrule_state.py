@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:02
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# rates formerly hard-coded in Invoice._tax_rate
+LEGACY_RATES = {
+    "India": [("", "GST", Decimal("18.00")), ("Gujarat", "GST", Decimal("12.00"))],
+    "USA": [("", "Sales Tax", Decimal("8.50"))],
+}
+
+
+def seed_legacy_rates(apps, schema_editor):
+    """Turn the old hard-coded rates into TaxRules for countries that have none configured."""
+    TaxRule = apps.get_model("income", "TaxRule")
+    for country, rules in LEGACY_RATES.items():
+        if TaxRule.objects.filter(country__iexact=country, active=True).exists():
+            continue
+        for state, name, rate in rules:
+            TaxRule.objects.create(
+                country=country, state=state, name=name, rate_percentage=rate,
+                note="Seeded from the former hard-coded Invoice tax rates",
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0008_taxrecord_active_constraint'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='taxrule',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='taxrule',
+            name='state',
+            field=models.CharField(blank=True, default='', help_text='Blank = applies to the whole country', max_length=100),
+        ),
+        migrations.AlterUniqueTogether(
+            name='taxrule',
+            unique_together={('country', 'state', 'name')},
+        ),
+        migrations.RunPython(seed_legacy_rates, migrations.RunPython.noop),
+    ]
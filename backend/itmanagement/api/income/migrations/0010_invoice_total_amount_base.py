@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-17 19:37
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_base_amounts(apps, schema_editor):
+    """Existing rows: the stored exchange rate already converts to the reporting currency."""
+    Invoice = apps.get_model("income", "Invoice")
+    Invoice.objects.update(
+        total_amount_base=F("total_amount") * F("exchange_rate"),
+        base_currency=getattr(settings, "FINANCE_BASE_CURRENCY", "INR"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0009_taxrule_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='base_currency',
+            field=models.CharField(blank=True, default='', editable=False, max_length=8),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount_base',
+            field=models.DecimalField(decimal_places=6, default=Decimal('0.00'), editable=False, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='exchange_rate',
+            field=models.DecimalField(decimal_places=8, default=Decimal('1.0000'), max_digits=18),
+        ),
+        migrations.RunPython(backfill_base_amounts, migrations.RunPython.noop),
+    ]
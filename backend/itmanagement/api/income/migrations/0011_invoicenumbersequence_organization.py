@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0010_invoice_total_amount_base'),
+        ('organizations', '0002_rename_address_line1_organization_address_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='invoicenumbersequence',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='invoicenumbersequence',
+            name='organization',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='invoice_number_sequences', to='organizations.organization'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='invoicenumbersequence',
+            unique_together={('organization', 'year')},
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:13
+
+from django.db import migrations, models
+
+
+def mark_abandoned_runs(apps, schema_editor):
+    """
+    Restarts used to mark the old run failed with a finish time, which left it
+    resumable; make those abandoned, and keep only the newest running run.
+    """
+    ReconciliationRun = apps.get_model("income", "ReconciliationRun")
+    ReconciliationRun.objects.filter(status="failed", finished_at__isnull=False).update(status="abandoned")
+    newest = ReconciliationRun.objects.filter(status="running").order_by("-started_at", "-pk").first()
+    if newest is not None:
+        ReconciliationRun.objects.filter(status="running").exclude(pk=newest.pk).update(status="abandoned")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0012_create_cache_table'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reconciliationrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('abandoned', 'Abandoned')], default='running', max_length=20),
+        ),
+        migrations.RunPython(mark_abandoned_runs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reconciliationrun',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'running')), fields=('status',), name='income_reconciliationrun_one_running'),
+        ),
+    ]
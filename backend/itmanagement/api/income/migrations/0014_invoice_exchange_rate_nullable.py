@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0013_reconciliationrun_abandoned'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='exchange_rate',
+            field=models.DecimalField(blank=True, decimal_places=8, default=None, max_digits=18, null=True),
+        ),
+    ]
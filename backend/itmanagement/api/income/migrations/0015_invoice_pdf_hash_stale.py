@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 22:10
+
+import uuid
+
+from django.db import migrations, models
+
+
+def mark_stored_pdfs_stale(apps, schema_editor):
+    """
+    Stored hashes predate write-side invalidation and may describe an invoice
+    that has changed since; make every stored PDF re-render on its next download.
+    """
+    Invoice = apps.get_model("income", "Invoice")
+    Invoice.objects.exclude(pdf_hash="").update(pdf_hash=f"stale:{uuid.uuid4().hex}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income', '0014_invoice_exchange_rate_nullable'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='pdf_hash',
+            field=models.CharField(blank=True, default='', editable=False, help_text='SHA-256 of the HTML pdf_file was rendered from, or a stale: token once the invoice changed', max_length=64),
+        ),
+        migrations.RunPython(mark_stored_pdfs_stale, migrations.RunPython.noop),
+    ]
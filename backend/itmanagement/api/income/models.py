@@ -34,12 +34,16 @@ class Invoice(models.Model):
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.DRAFT)
 
     currency = models.CharField(max_length=8, default="INR")
-    exchange_rate = models.DecimalField(max_digits=12, decimal_places=4, default=Decimal("1.0000"))
+    # left empty, save() fills it in: 1 in the base currency, else the FX table's rate
+    exchange_rate = models.DecimalField(max_digits=18, decimal_places=8, null=True, blank=True, default=None)
 
     subtotal_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
     tax_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
     total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
     paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    # total_amount converted at exchange_rate, maintained on save
+    total_amount_base = models.DecimalField(max_digits=20, decimal_places=6, default=Decimal("0.00"), editable=False)
+    base_currency = models.CharField(max_length=8, blank=True, default="", editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -47,6 +51,11 @@ class Invoice(models.Model):
     paid_at = models.DateTimeField(null=True, blank=True)
 
     pdf_file = models.FileField(upload_to="invoices/", blank=True, null=True)
+    pdf_hash = models.CharField(max_length=64, blank=True, default="", editable=False, help_text="SHA-256 of the HTML pdf_file was rendered from, or a stale: token once the invoice changed")
+    current_tax_record = models.ForeignKey(
+        "TaxRecord", on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name="+",
+        help_text="Denormalized pointer to the active TaxRecord",
+    )
     cost_center = models.ForeignKey(CostCenter, on_delete=models.SET_NULL, null=True, blank=True)
     period = models.ForeignKey(FinancialPeriod, on_delete=models.CASCADE, related_name="invoices", null=True, blank=True)
 
@@ -56,16 +65,10 @@ class Invoice(models.Model):
     def __str__(self):
         return f"{self.invoice_number} - {self.client_name}"
 
-    def _tax_rate(self):
-        TAX_RATES = {
-            "india": {"default": Decimal("18.00"), "gujarat": Decimal("12.00")},
-            "usa": {"default": Decimal("8.50")},
-        }
-        country = (self.client_country or "").strip().lower()
-        state = (self.client_state or "").strip().lower()
-        if country in TAX_RATES:
-            return TAX_RATES[country].get(state, TAX_RATES[country]["default"])
-        return Decimal("0.00")
+    def _tax_rule(self):
+        """Compiled TaxRule for the client's country/state (see tax_rules)."""
+        from .tax_rules import rule_for
+        return rule_for(self.client_country, self.client_state)
 
     def recalc_totals(self, save: bool = True):
         subtotal = Decimal("0.00")
@@ -73,8 +76,8 @@ class Invoice(models.Model):
             subtotal += it.total_price()
 
         subtotal = subtotal.quantize(Decimal("0.01"))
-        tax_rate = self._tax_rate()
-        tax_amount = (subtotal * (tax_rate / Decimal("100.00"))).quantize(Decimal("0.01"))
+        rule = self._tax_rule()
+        tax_amount = rule.apply(subtotal)[0] if rule else Decimal("0.00")
         total = (subtotal + tax_amount).quantize(Decimal("0.01"))
 
         self.subtotal_amount = subtotal
@@ -152,20 +155,98 @@ class Invoice(models.Model):
     #     super().save(*args, **kwargs)
     def _generate_invoice_number(self):
         year = timezone.now().year
-        org_code = getattr(self.organization, "code", "ORG")[:10].upper()
+        series, number = InvoiceNumberSequence.next_value(self.organization, year)
+        return f"{series}-{year}-{number:04d}"
 
-        # Use count in a transaction-safe way (brief race still possible; fallback to uuid)
-        for attempt in range(5):
-            count = Invoice.objects.filter(organization=self.organization, created_at__year=year).count() + 1
-            candidate = f"{org_code}-{year}-{count:04d}"
-            if not Invoice.objects.filter(invoice_number=candidate).exists():
-                return candidate
-        return f"{org_code}-{year}-{uuid.uuid4().hex[:6].upper()}"
+    def _sync_base_amount(self, update_fields=None):
+        """
+        Keep total_amount_base in step with total_amount/exchange_rate. An
+        invoice saved without a rate takes the one from the FX table for its
+        creation date (1 when there is none, or in the base currency); a rate
+        that was set, 1 included, is kept.
+        """
+        from api.financial_analytics import currency as fx
+
+        if update_fields is not None and not {"total_amount", "exchange_rate", "currency"} & set(update_fields):
+            return update_fields
+        base = self.base_currency or fx.base_currency()
+        if self.exchange_rate is None:
+            try:
+                self.exchange_rate = fx.rate(self.currency, timezone.localdate(self.created_at or timezone.now()), base)
+            except fx.MissingExchangeRate:
+                self.exchange_rate = Decimal("1")
+        self.base_currency = base
+        self.total_amount_base = (self.total_amount * self.exchange_rate).quantize(Decimal("0.000001"))
+        if update_fields is not None:
+            update_fields = {*update_fields, "exchange_rate", "total_amount_base", "base_currency"}
+        return update_fields
 
     def save(self, *args, **kwargs):
-        if not self.invoice_number:
-            self.invoice_number = self._generate_invoice_number()
-        super().save(*args, **kwargs)
+        update_fields = self._sync_base_amount(kwargs.get("update_fields"))
+        if update_fields is not None:
+            kwargs["update_fields"] = update_fields
+        if self.invoice_number:
+            return super().save(*args, **kwargs)
+        # allocate the number in the same transaction as the insert so a failed
+        # insert rolls the counter back and the sequence stays gap-free; the
+        # counter stays locked until the outer commit, but only for this organization
+        try:
+            with transaction.atomic():
+                self.invoice_number = self._generate_invoice_number()
+                super().save(*args, **kwargs)
+        except Exception:
+            self.invoice_number = ""
+            raise
+
+
+class InvoiceNumberSequence(models.Model):
+    """
+    Counter behind invoice numbers, one row per (organization, year).
+    Allocation locks only this row, so issuing a number is O(1) and parallel
+    workers serialize on their own organization's counter instead of racing
+    on COUNT(*). `series` is the organization's prefix, fixed when the row is
+    created: its `code` when it has one, else the start of its id, which
+    keeps invoice numbers globally unique. Rows without an organization are
+    the old shared "ORG" counters.
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, null=True, blank=True, related_name="invoice_number_sequences")
+    series = models.CharField(max_length=10)
+    year = models.PositiveIntegerField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("organization", "year")
+
+    def __str__(self):
+        return f"{self.series}-{self.year}: {self.last_value}"
+
+    @staticmethod
+    def series_for(organization):
+        return (getattr(organization, "code", "") or organization.pk.hex[:8]).upper()[:10]
+
+    @classmethod
+    def next_value(cls, organization, year):
+        """Allocate the next number of the organization's series; returns (series, number)."""
+        with transaction.atomic():
+            seq = cls.objects.select_for_update().filter(organization=organization, year=year).first()
+            if seq is None:
+                series = cls.series_for(organization)
+                cls.objects.get_or_create(
+                    organization=organization, year=year,
+                    defaults={"series": series, "last_value": cls._seed_value(series, year)},
+                )
+                seq = cls.objects.select_for_update().get(organization=organization, year=year)
+            seq.last_value += 1
+            seq.save(update_fields=["last_value"])
+            return seq.series, seq.last_value
+
+    @staticmethod
+    def _seed_value(series, year):
+        """Highest number already issued in the series, for years numbered before the counter existed."""
+        prefix = f"{series}-{year}-"
+        numbers = Invoice.objects.filter(invoice_number__startswith=prefix).values_list("invoice_number", flat=True)
+        suffixes = [n[len(prefix):] for n in numbers]
+        return max((int(s) for s in suffixes if s.isdigit()), default=0)
 
 
 class RevenueCategory(models.Model):
@@ -299,12 +380,72 @@ class PartnerAllocation(models.Model):
         return f"{self.partner.user.username} <- {self.amount} (payment={self.payment.id})"
 
 
+class InvoiceNotification(models.Model):
+    """
+    One reminder/overdue email that was sent for an invoice. `key` identifies
+    the notice (e.g. "reminder:7:2025-01-31"), so re-running the dispatcher
+    never sends the same notice twice.
+    """
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="notifications")
+    key = models.CharField(max_length=64)
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("invoice", "key")
+
+    def __str__(self):
+        return f"{self.key} for invoice {self.invoice_id}"
+
+
+class ReconciliationRun(models.Model):
+    """
+    Progress of a chunked allocation reconciliation. `cursor` is the last
+    Payment id handled; an unfinished (running or failed) run is resumed from
+    there. A restart marks it abandoned, which is final. At most one run is
+    running at a time, so concurrent callers share it.
+    """
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+        ABANDONED = "abandoned", "Abandoned"
+
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+    cursor = models.BigIntegerField(default=0)
+    upper_bound = models.BigIntegerField(default=0, help_text="Highest Payment id when the run started")
+    chunk_size = models.PositiveIntegerField(default=1000)
+    payments_scanned = models.PositiveIntegerField(default=0)
+    payments_allocated = models.PositiveIntegerField(default=0)
+    allocations_created = models.PositiveIntegerField(default=0)
+    elapsed_seconds = models.FloatField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["status"], condition=models.Q(status="running"), name="income_reconciliationrun_one_running"
+            ),
+        ]
+
+    @property
+    def payments_per_second(self):
+        return self.payments_scanned / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def __str__(self):
+        return f"Reconciliation {self.pk} ({self.status}, cursor={self.cursor}/{self.upper_bound})"
+
+
 TWOPLACES = Decimal("0.01")
 
 class TaxRule(models.Model):
     """
     Normalized tax configuration:
     - country: case-insensitive match (e.g., 'India')
+    - state: optional case-insensitive match; a state rule beats the country-wide one
     - rate_percentage: overall tax rate, e.g. 18.00 for 18%
     - components: optional breakdown, e.g. {"cgst": 9.0, "sgst": 9.0} (sums may or may not equal rate)
     - precedence: larger value wins if multiple active rules exist for same country
@@ -313,6 +454,7 @@ class TaxRule(models.Model):
     """
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     country = models.CharField(max_length=100, db_index=True)
+    state = models.CharField(max_length=100, blank=True, default="", help_text="Blank = applies to the whole country")
     name = models.CharField(max_length=120, default="GST")
     rate_percentage = models.DecimalField(max_digits=6, decimal_places=2)
     components = models.JSONField(null=True, blank=True)  # {"cgst":9.0,"sgst":9.0}
@@ -324,7 +466,7 @@ class TaxRule(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = (("country", "name"),)
+        unique_together = (("country", "state", "name"),)
         indexes = [
             models.Index(fields=["country", "active", "precedence"]),
         ]
@@ -341,7 +483,8 @@ class TaxRule(models.Model):
         label = f"{self.name} {self.rate_percentage}%"
         if self.components:
             label += f" {self.components}"
-        return f"{label} [{self.country}] (active={self.active}, prio={self.precedence})"
+        region = f"{self.country}/{self.state}" if self.state else self.country
+        return f"{label} [{region}] (active={self.active}, prio={self.precedence})"
 
 
 class TaxRecord(models.Model):
@@ -379,11 +522,31 @@ class TaxRecord(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=["invoice", "is_active"]),
             models.Index(fields=["created_at"]),
         ]
+        constraints = [
+            # also serves as the index for "active record of invoice X" lookups
+            models.UniqueConstraint(
+                fields=["invoice"], condition=models.Q(is_active=True), name="income_taxrecord_one_active_per_invoice"
+            ),
+        ]
         unique_together = ("invoice", "version")  # ensures versioning per invoice
 
     def __str__(self):
         return f"TaxRecord(inv={self.invoice_id}, v{self.version}, tax={self.tax_amount}, active={self.is_active})"
 
+
+class TaxRecordHistory(models.Model):
+    """
+    Compacted history of superseded TaxRecords for one invoice. Each entry of
+    `versions` is [version, created_at, tax_rule_id, subtotal, tax_amount,
+    total, breakdown], oldest first.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, related_name="tax_history")
+    versions = models.JSONField(default=list)
+    archived_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Tax history for invoice {self.invoice_id} ({self.archived_count} versions)"
+
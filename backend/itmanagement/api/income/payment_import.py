@@ -0,0 +1,215 @@
+"""
+Bulk payment ingestion for bank statement reconciliation.
+
+Rows are processed in batches. Each batch locks its invoices once, applies the
+payments and partner allocations in memory, and writes Payments,
+PartnerAllocations and InvoiceAuditLogs with bulk_create. Invalid rows are
+reported individually and do not stop the import.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from .models import Invoice, Payment, PartnerAllocation, InvoiceAuditLog
+from .allocation import prime_allocation_plans, resolve_allocation_plan
+from .pdf import invalidate_invoice_pdfs
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class PaymentRowError(ValueError):
+    pass
+
+
+def read_payment_rows(stream, fmt="csv"):
+    """
+    Yield payment dicts from a text or binary stream. Supported formats:
+    csv (header row), json (array of objects) and ndjson (one object per line).
+    Undecodable JSON is yielded as a PaymentRowError in place of the row, so
+    import_payments reports it like any other invalid row.
+    """
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.BytesIO(stream)
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig")
+
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as exc:
+                    yield PaymentRowError(f"invalid JSON: {exc}")
+    elif fmt == "json":
+        try:
+            rows = json.load(stream)
+        except json.JSONDecodeError as exc:
+            yield PaymentRowError(f"invalid JSON: {exc}")
+            return
+        if not isinstance(rows, list):
+            yield PaymentRowError("expected a JSON array of payments")
+            return
+        yield from rows
+    else:
+        raise ValueError(f"Unsupported payment import format: {fmt}")
+
+
+def _parse_row(row):
+    if isinstance(row, PaymentRowError):
+        raise row
+    if not isinstance(row, dict):
+        raise PaymentRowError(f"expected an object, got {type(row).__name__}")
+    invoice_ref = str(row.get("invoice") or row.get("invoice_id") or row.get("invoice_number") or "").strip()
+    if not invoice_ref:
+        raise PaymentRowError("invoice is required")
+    try:
+        amount = Decimal(str(row.get("amount", "")).strip()).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        raise PaymentRowError(f"invalid amount {row.get('amount')!r}")
+    if amount <= 0:
+        raise PaymentRowError("Payment amount must be positive.")
+
+    received_at = timezone.now()
+    raw_date = str(row.get("received_at") or "").strip()
+    if raw_date:
+        try:
+            # well-formed but impossible dates (2025-02-30) raise instead of returning None
+            parsed = parse_datetime(raw_date)
+            if parsed is None:
+                day = parse_date(raw_date)
+                parsed = datetime(day.year, day.month, day.day) if day else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise PaymentRowError(f"invalid received_at {raw_date!r}")
+        received_at = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    return {
+        "invoice_ref": invoice_ref,
+        "amount": amount,
+        "method": str(row.get("method") or "")[:64],
+        "reference": str(row.get("reference") or "")[:128],
+        "received_at": received_at,
+    }
+
+
+def _lock_invoices(refs):
+    ids = {int(r) for r in refs if r.isdigit()}
+    numbers = set(refs) - {str(i) for i in ids}
+    qs = Invoice.objects.select_for_update().filter(Q(pk__in=ids) | Q(invoice_number__in=numbers))
+    by_ref = {}
+    for inv in qs.order_by("pk"):
+        by_ref[str(inv.pk)] = inv
+        by_ref[inv.invoice_number] = inv
+    return by_ref
+
+
+@transaction.atomic
+def _apply_batch(batch):
+    """Apply a batch of (row_number, parsed_row). Returns (created, allocations, failures)."""
+    invoices = _lock_invoices({row["invoice_ref"] for _, row in batch})
+    prime_allocation_plans({inv.pk: inv for inv in invoices.values()}.values())
+
+    failures = []
+    payments, pending_splits, audit_logs = [], [], []
+    touched = {}
+    now = timezone.now()
+    for row_number, row in batch:
+        invoice = invoices.get(row["invoice_ref"])
+        if invoice is None:
+            failures.append({"row": row_number, "error": f"invoice {row['invoice_ref']} not found"})
+            continue
+        touched.setdefault(invoice.pk, (invoice, invoice.status))
+
+        amount = row["amount"]
+        payments.append(Payment(
+            invoice=invoice, amount=amount, method=row["method"],
+            reference=row["reference"], received_at=row["received_at"],
+        ))
+        invoice.paid_amount = (invoice.paid_amount + amount).quantize(Decimal("0.01"))
+        if invoice.paid_amount >= invoice.total_amount:
+            invoice.status = Invoice.Status.PAID
+            invoice.paid_at = now
+        elif invoice.paid_amount > Decimal("0.00"):
+            invoice.status = Invoice.Status.PARTIALLY_PAID
+        invoice.updated_at = now
+
+        pending_splits.append(resolve_allocation_plan(invoice).split(amount))
+        audit_logs.append(InvoiceAuditLog(
+            invoice=invoice, action="payment",
+            details=f"Recorded payment {amount} {invoice.currency} (method={row['method']}, ref={row['reference']})",
+        ))
+
+    Payment.objects.bulk_create(payments, batch_size=DEFAULT_BATCH_SIZE)
+    allocations = [
+        PartnerAllocation(payment=payment, partner_id=partner_id, amount=share)
+        for payment, splits in zip(payments, pending_splits)
+        for partner_id, share in splits
+    ]
+    PartnerAllocation.objects.bulk_create(allocations, batch_size=DEFAULT_BATCH_SIZE)
+    InvoiceAuditLog.objects.bulk_create(audit_logs, batch_size=DEFAULT_BATCH_SIZE)
+    Invoice.objects.bulk_update(
+        [inv for inv, _ in touched.values()],
+        ["paid_amount", "status", "paid_at", "updated_at"],
+        batch_size=DEFAULT_BATCH_SIZE,
+    )
+    invalidate_invoice_pdfs(touched.keys())
+
+    # bulk writes skip post_save, so refresh the paid-income rollups explicitly
+    from api.financial_analytics.rollups import schedule_income_rollup_refresh
+    for inv, old_status in touched.values():
+        if Invoice.Status.PAID in (inv.status, old_status):
+            schedule_income_rollup_refresh(inv.organization_id, inv.due_date)
+
+    return len(payments), len(allocations), failures
+
+
+def import_payments(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Ingest an iterable of payment dicts (invoice, amount, method, reference,
+    received_at). `invoice` may be the invoice id or invoice number.
+    Returns {"created", "allocations", "failed": [{"row", "error"}]}.
+    """
+    result = {"created": 0, "allocations": 0, "failed": []}
+
+    def flush(batch):
+        try:
+            created, allocations, failures = _apply_batch(batch)
+        except Exception as exc:
+            logger.exception("Payment import batch failed (rows %s-%s)", batch[0][0], batch[-1][0])
+            result["failed"].extend({"row": n, "error": str(exc)} for n, _ in batch)
+            return
+        result["created"] += created
+        result["allocations"] += allocations
+        result["failed"].extend(failures)
+
+    batch = []
+    for row_number, raw in enumerate(rows, start=1):
+        try:
+            batch.append((row_number, _parse_row(raw)))
+        except PaymentRowError as exc:
+            result["failed"].append({"row": row_number, "error": str(exc)})
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    result["failed"].sort(key=lambda f: f["row"])
+
+    logger.info("Imported %d payments (%d allocations, %d failed rows)",
+                result["created"], result["allocations"], len(result["failed"]))
+    return result
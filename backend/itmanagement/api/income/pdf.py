@@ -0,0 +1,238 @@
+"""
+Invoice PDF rendering.
+
+Invoice.pdf_hash is the SHA-256 of the HTML the stored pdf_file was rendered
+from. Every write that changes what the PDF shows (the invoice, its items,
+payments, partner shares or allocations) replaces it with a fresh stale token
+(see invalidate_invoice_pdfs()), so a download whose hash is not stale streams
+the stored file without rendering anything. A render only records its hash if
+the token it started from is still there; otherwise the file is served once
+and stays stale. WeasyPrint runs in a process pool so renders do not hold the
+request thread's GIL and batch renders use every core.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Prefetch, Sum
+from django.template.loader import render_to_string
+
+from .models import Invoice, InvoiceItem, InvoicePartnerShare, PartnerAllocation
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAME = "invoice.html"
+CHUNK_SIZE = 200
+STALE_PREFIX = "stale:"
+
+_pool = None
+
+
+def _render_pdf_bytes(html):
+    """Runs in a worker process."""
+    import weasyprint
+    return weasyprint.HTML(string=html).write_pdf()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=getattr(settings, "INVOICE_PDF_WORKERS", None) or os.cpu_count())
+    return _pool
+
+
+def invoice_pdf_queryset():
+    return Invoice.objects.select_related("organization").prefetch_related(
+        Prefetch("items", queryset=InvoiceItem.objects.select_related("revenue_category")),
+        "payments",
+        Prefetch("partner_shares", queryset=InvoicePartnerShare.objects.select_related("partner__user")),
+    )
+
+
+def _allocated_by_partner(invoice_ids):
+    """{(invoice_id, partner_id): allocated amount} in one grouped query."""
+    rows = (
+        PartnerAllocation.objects.filter(payment__invoice_id__in=invoice_ids)
+        .values("payment__invoice_id", "partner_id")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    return {(r["payment__invoice_id"], r["partner_id"]): r["total"] for r in rows}
+
+
+def build_invoice_context(invoice, allocated=None):
+    """
+    Template context for an invoice loaded through invoice_pdf_queryset().
+    `allocated` is the _allocated_by_partner() map; it is queried when omitted.
+    """
+    if allocated is None:
+        allocated = _allocated_by_partner([invoice.pk])
+
+    items = [
+        {
+            "description": item.description,
+            "quantity": item.quantity,
+            "unit_price": item.unit_price,
+            "total": item.total_price(),
+            "revenue_category": item.revenue_category.name if item.revenue_category else "",
+        }
+        for item in invoice.items.all()
+    ]
+
+    payments = [
+        {
+            "amount": p.amount,
+            "method": p.method,
+            "reference": p.reference,
+            "date": p.received_at.strftime("%d-%b-%Y"),
+        }
+        for p in invoice.payments.all()
+    ]
+
+    partners = [
+        {
+            "name": ps.partner.user.username,
+            "share_type": ps.share_type,
+            "share_value": ps.share_value,
+            "allocated_amount": allocated.get((invoice.pk, ps.partner_id), 0),
+        }
+        for ps in invoice.partner_shares.all()
+    ]
+
+    return {
+        "invoice_number": invoice.invoice_number,
+        "date": invoice.created_at.strftime("%d-%b-%Y"),
+        "due_date": invoice.due_date.strftime("%d-%b-%Y") if invoice.due_date else "",
+        "status": invoice.status,
+        "currency": invoice.currency,
+        "client": {
+            "name": invoice.client_name,
+            "email": invoice.client_email,
+            "country": invoice.client_country,
+            "state": invoice.client_state,
+        },
+        "items": items,
+        "subtotal": invoice.subtotal_amount,
+        "tax": invoice.tax_amount,
+        "total": invoice.total_amount,
+        "payments": payments,
+        "partners": partners,
+        "organization": {
+            "name": invoice.organization.name
+        }
+    }
+
+
+def render_invoice_html(invoice, allocated=None):
+    """Return (html, sha256 hex digest of html)."""
+    html = render_to_string(TEMPLATE_NAME, build_invoice_context(invoice, allocated))
+    return html, hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def invalidate_invoice_pdfs(invoice_ids):
+    """
+    Mark the invoices' stored PDFs stale. Each call writes a new token (and
+    returns it), so a render that started before it cannot record its hash
+    afterwards.
+    """
+    token = f"{STALE_PREFIX}{uuid.uuid4().hex}"
+    ids = [pk for pk in invoice_ids if pk is not None]
+    if ids:
+        Invoice.objects.filter(pk__in=ids).update(pdf_hash=token)
+    return token
+
+
+def is_pdf_current(invoice):
+    return (
+        bool(invoice.pdf_file) and bool(invoice.pdf_hash) and not invoice.pdf_hash.startswith(STALE_PREFIX)
+        and invoice.pdf_file.storage.exists(invoice.pdf_file.name)
+    )
+
+
+def _store_pdf(invoice, digest, pdf_bytes):
+    """
+    Save the rendered file. Its hash is recorded only if the invoice's pdf_hash
+    is still the one read before rendering; when the invoice changed meanwhile
+    the file is kept for this download but stays stale.
+    """
+    old_name = invoice.pdf_file.name if invoice.pdf_file else None
+    invoice.pdf_file.save(f"{invoice.invoice_number}-{digest[:12]}.pdf", ContentFile(pdf_bytes), save=False)
+    # update() rather than save(): a cached file is not an invoice change
+    if Invoice.objects.filter(pk=invoice.pk, pdf_hash=invoice.pdf_hash).update(pdf_file=invoice.pdf_file.name, pdf_hash=digest):
+        invoice.pdf_hash = digest
+    else:
+        Invoice.objects.filter(pk=invoice.pk).update(pdf_file=invoice.pdf_file.name)
+        logger.info("Invoice %s changed while its PDF rendered; it stays stale", invoice.invoice_number)
+    if old_name and old_name != invoice.pdf_file.name:
+        try:
+            invoice.pdf_file.storage.delete(old_name)
+        except Exception:
+            logger.exception("Failed to delete stale PDF %s", old_name)
+
+
+def get_invoice_pdf(invoice_id):
+    """
+    Return an Invoice whose pdf_file is current. A current file costs one
+    query; the PDF is only rendered (in the process pool) when the stored
+    file is missing or stale.
+    """
+    invoice = Invoice.objects.only("pk", "invoice_number", "pdf_file", "pdf_hash").get(pk=invoice_id)
+    if is_pdf_current(invoice):
+        return invoice
+    # the token is read together with the invoice, before the rest of the context
+    invoice = invoice_pdf_queryset().get(pk=invoice_id)
+    html, digest = render_invoice_html(invoice)
+    _store_pdf(invoice, digest, _get_pool().submit(_render_pdf_bytes, html).result())
+    logger.info("Rendered PDF for invoice %s", invoice.invoice_number)
+    return invoice
+
+
+def render_invoices_for_period(start=None, end=None, organization_id=None, force=False):
+    """
+    Render PDFs for every invoice created in [start, end] (dates, inclusive)
+    whose stored PDF is stale. Returns {"rendered", "cached", "failed"}.
+    """
+    qs = Invoice.objects.all()
+    if start:
+        qs = qs.filter(created_at__date__gte=start)
+    if end:
+        qs = qs.filter(created_at__date__lte=end)
+    if organization_id:
+        qs = qs.filter(organization_id=organization_id)
+    ids = list(qs.order_by("pk").values_list("pk", flat=True))
+
+    stats = {"rendered": 0, "cached": 0, "failed": 0}
+    pool = _get_pool()
+    for offset in range(0, len(ids), CHUNK_SIZE):
+        chunk_ids = ids[offset:offset + CHUNK_SIZE]
+        if not force:
+            current = {
+                invoice.pk for invoice in Invoice.objects.filter(pk__in=chunk_ids).only("pk", "pdf_file", "pdf_hash")
+                if is_pdf_current(invoice)
+            }
+            stats["cached"] += len(current)
+            chunk_ids = [pk for pk in chunk_ids if pk not in current]
+            if not chunk_ids:
+                continue
+        invoices = list(invoice_pdf_queryset().filter(pk__in=chunk_ids))
+        allocated = _allocated_by_partner(chunk_ids)
+
+        pending = []
+        for invoice in invoices:
+            html, digest = render_invoice_html(invoice, allocated)
+            pending.append((invoice, digest, pool.submit(_render_pdf_bytes, html)))
+
+        for invoice, digest, future in pending:
+            try:
+                _store_pdf(invoice, digest, future.result())
+                stats["rendered"] += 1
+            except Exception:
+                logger.exception("Failed to render PDF for invoice %s", invoice.pk)
+                stats["failed"] += 1
+
+    logger.info("Invoice PDFs: %(rendered)d rendered, %(cached)d cached, %(failed)d failed", stats)
+    return stats
@@ -0,0 +1,168 @@
+"""
+Batched invoice reminder / overdue notification dispatcher.
+
+Overdue invoices are flipped with a single UPDATE. Notices are built in
+chunks, skipping any already recorded in InvoiceNotification, and handed to a
+bounded pool of sender threads. Each sender opens one mail connection and
+reuses it for every message it sends; successful sends are recorded so a
+re-run only picks up what is still missing.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Invoice, InvoiceNotification
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FROM = getattr(settings, "DEFAULT_FROM_EMAIL", "no-reply@example.com")
+REMINDER_STATUSES = [Invoice.Status.DRAFT, Invoice.Status.SENT, Invoice.Status.PARTIALLY_PAID]
+NOTICE_FIELDS = ("id", "invoice_number", "client_name", "client_email", "due_date", "total_amount")
+
+
+def mark_overdue_invoices(today=None):
+    """Flip every unpaid invoice past its due date to OVERDUE. Returns the row count."""
+    today = today or timezone.now().date()
+    return (
+        Invoice.objects.filter(due_date__lt=today)
+        .exclude(status__in=[Invoice.Status.PAID, Invoice.Status.OVERDUE])
+        .update(status=Invoice.Status.OVERDUE, updated_at=timezone.now())
+    )
+
+
+def _reminder_message(inv, days):
+    subject = f"Reminder: Invoice #{inv['invoice_number']} due in {days} day(s)"
+    body = (
+        f"Invoice #{inv['invoice_number']} for {inv['client_name']} "
+        f"is due on {inv['due_date']}. Total: {inv['total_amount']}"
+    )
+    return EmailMessage(subject, body, DEFAULT_FROM, [inv["client_email"]])
+
+
+def _overdue_message(inv, finance_recipients):
+    subject = f"Overdue: Invoice #{inv['invoice_number']}"
+    body = (
+        f"Invoice #{inv['invoice_number']} for {inv['client_name']} "
+        f"is overdue since {inv['due_date']}. Total: {inv['total_amount']}"
+    )
+    # finance gets the same message as a blind copy instead of a second send
+    return EmailMessage(subject, body, DEFAULT_FROM, [inv["client_email"]], bcc=finance_recipients)
+
+
+def _pending(qs, key):
+    """`qs` restricted to invoices that have no notification recorded under `key`."""
+    return qs.filter(~Exists(InvoiceNotification.objects.filter(invoice_id=OuterRef("pk"), key=key)))
+
+
+def _notices(today, reminder_days, finance_recipients):
+    """Yield (invoice_id, key, message) for every notice still to be sent."""
+    for days in reminder_days:
+        target_date = today + timezone.timedelta(days=days)
+        key = f"reminder:{days}:{target_date}"
+        qs = _pending(Invoice.objects.filter(due_date=target_date, status__in=REMINDER_STATUSES), key)
+        for inv in qs.values(*NOTICE_FIELDS).order_by("pk").iterator(chunk_size=2000):
+            yield inv["id"], key, _reminder_message(inv, days)
+
+    key = f"overdue:{today}"
+    qs = _pending(Invoice.objects.filter(due_date__lt=today).exclude(status=Invoice.Status.PAID), key)
+    for inv in qs.values(*NOTICE_FIELDS).order_by("pk").iterator(chunk_size=2000):
+        yield inv["id"], key, _overdue_message(inv, finance_recipients)
+
+
+class _Senders:
+    """Per-thread mail connections, opened once and closed when the pool is done."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = get_connection(fail_silently=False)
+            conn.open()
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def send(self, batch):
+        """Send a batch of (invoice_id, key, message); return the ones that went out."""
+        conn = self.connection()
+        sent = []
+        for invoice_id, key, message in batch:
+            message.connection = conn
+            try:
+                if conn.send_messages([message]):
+                    sent.append((invoice_id, key))
+            except Exception:
+                logger.exception("Failed to send %s for invoice %s", key, invoice_id)
+        return sent
+
+    def close(self):
+        for conn in self._connections:
+            try:
+                conn.close()
+            except Exception:
+                logger.exception("Failed to close mail connection")
+
+
+def _record(sent):
+    InvoiceNotification.objects.bulk_create(
+        [InvoiceNotification(invoice_id=invoice_id, key=key) for invoice_id, key in sent],
+        batch_size=1000, ignore_conflicts=True,
+    )
+
+
+def dispatch_invoice_notifications(today=None, workers=None, batch_size=None):
+    """
+    Mark overdue invoices and send all due reminder and overdue notices.
+    Returns {"overdue_marked", "sent", "failed"}.
+    """
+    today = today or timezone.now().date()
+    workers = workers or getattr(settings, "INVOICE_REMINDER_SEND_WORKERS", 4)
+    batch_size = batch_size or getattr(settings, "INVOICE_REMINDER_BATCH_SIZE", 200)
+    reminder_days = getattr(settings, "INVOICE_REMINDER_DAYS_BEFORE", [7, 3, 1])
+    finance_recipients = list(getattr(settings, "FINANCE_NOTIFICATION_EMAILS", []))
+
+    stats = {"overdue_marked": mark_overdue_invoices(today), "sent": 0, "failed": 0}
+    senders = _Senders()
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            batch_len = in_flight.pop(future)
+            sent = future.result()
+            _record(sent)
+            stats["sent"] += len(sent)
+            stats["failed"] += batch_len - len(sent)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            batch = []
+            for notice in _notices(today, reminder_days, finance_recipients):
+                batch.append(notice)
+                if len(batch) < batch_size:
+                    continue
+                # keep the queue bounded: wait for a sender before building more messages
+                if len(in_flight) >= workers * 2:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                in_flight[pool.submit(senders.send, batch)] = len(batch)
+                batch = []
+            if batch:
+                in_flight[pool.submit(senders.send, batch)] = len(batch)
+            collect(wait(in_flight).done)
+    finally:
+        senders.close()
+
+    logger.info(
+        "Invoice notifications: %d marked overdue, %d sent, %d failed",
+        stats["overdue_marked"], stats["sent"], stats["failed"],
+    )
+    return stats
@@ -0,0 +1,218 @@
+"""
+Batch tax recomputation, e.g. after a TaxRule rate change.
+
+Invoices in scope are processed in keyset-ordered batches. Per batch, item
+subtotals come from one grouped query, taxes are computed for whole arrays
+of subtotals at once in integer cents with NumPy (same ROUND_HALF_UP results
+as CompiledTaxRule.apply), and only invoices whose numbers actually change get
+a new TaxRecord version, written with bulk_create/bulk_update.
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Max, OuterRef, Subquery, Sum, Value, When
+from django.utils import timezone
+
+from api.financial_analytics import currency as fx
+from .models import Invoice, InvoiceItem, TaxRecord
+from .pdf import invalidate_invoice_pdfs
+from .tax_rules import rule_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 2000
+INT64_LIMIT = 2 ** 62
+
+
+def _cents(value):
+    return int((value or Decimal("0")).scaleb(2))
+
+
+def _money(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _tax_cents(subtotals, rate):
+    """ROUND_HALF_UP(subtotal * rate / 100) in cents, for an int array of subtotal cents."""
+    exponent = max(0, -rate.as_tuple().exponent)
+    numerator = int(rate.scaleb(exponent))
+    denominator = 100 * 10 ** exponent
+    if subtotals.size and int(subtotals.max()) * numerator >= INT64_LIMIT:
+        subtotals = subtotals.astype(object)  # exact Python ints instead of overflowing int64
+    return (subtotals * numerator + denominator // 2) // denominator
+
+
+def compute_taxes(subtotals, rule):
+    """
+    Vectorised CompiledTaxRule.apply: returns (tax cents array, {component: cents array}).
+    `subtotals` is an int array of subtotal cents.
+    """
+    if rule is None:
+        return np.zeros_like(subtotals), {}
+    if rule.components:
+        parts = {name: _tax_cents(subtotals, rate) for name, rate in rule.components}
+        return sum(parts.values()), parts
+    tax = _tax_cents(subtotals, rule.rate)
+    return tax, {"tax": tax}
+
+
+def _scope(country=None, organization_id=None, start=None, end=None, statuses=None, include_paid=False):
+    """Invoices to re-tax. Paid invoices are settled amounts and only included on request."""
+    if statuses and Invoice.Status.PAID in statuses and not include_paid:
+        raise ValueError("Re-taxing paid invoices requires include_paid=True.")
+    qs = Invoice.objects.all()
+    if not include_paid:
+        qs = qs.exclude(status=Invoice.Status.PAID)
+    if country:
+        qs = qs.filter(client_country__iexact=country)
+    if organization_id:
+        qs = qs.filter(organization_id=organization_id)
+    if start:
+        qs = qs.filter(created_at__date__gte=start)
+    if end:
+        qs = qs.filter(created_at__date__lte=end)
+    if statuses:
+        qs = qs.filter(status__in=statuses)
+    return qs
+
+
+def _subtotals(invoice_ids):
+    line = ExpressionWrapper(F("quantity") * F("unit_price"), output_field=DecimalField(max_digits=20, decimal_places=2))
+    rows = (
+        InvoiceItem.objects.filter(invoice_id__in=invoice_ids)
+        .values("invoice_id").annotate(subtotal=Sum(line)).order_by()
+    )
+    return {r["invoice_id"]: r["subtotal"] for r in rows}
+
+
+def _retax_batch(invoice_ids):
+    """Lock a batch and return [(invoice, rule_id, subtotal, tax, total, breakdown)] for invoices that change."""
+    invoices = list(
+        Invoice.objects.select_for_update(of=("self",))
+        .filter(pk__in=invoice_ids).select_related("current_tax_record")
+        .only(
+            "id", "invoice_number", "organization_id", "client_country", "client_state", "status", "due_date",
+            "subtotal_amount", "tax_amount", "total_amount", "current_tax_record",
+        )
+        .order_by("pk")
+    )
+    subtotals = _subtotals(invoice_ids)
+
+    by_rule = defaultdict(list)
+    for inv in invoices:
+        by_rule[rule_for(inv.client_country, inv.client_state)].append(inv)
+
+    changes = []
+    for rule, group in by_rule.items():
+        sub_cents = np.array([_cents(subtotals.get(inv.pk)) for inv in group], dtype=np.int64)
+        tax_cents, parts = compute_taxes(sub_cents, rule)
+        for i, inv in enumerate(group):
+            subtotal, tax = _money(sub_cents[i]), _money(tax_cents[i])
+            total = subtotal + tax
+            breakdown = {name: str(_money(cents[i])) for name, cents in parts.items()} if rule else None
+            current = inv.current_tax_record
+            rule_id = rule.rule_id if rule else None
+            unchanged = (
+                current is not None
+                and (current.subtotal, current.tax_amount, current.total) == (subtotal, tax, total)
+                and current.tax_rule_id == rule_id and current.breakdown == breakdown
+                and (inv.subtotal_amount, inv.tax_amount, inv.total_amount) == (subtotal, tax, total)
+            )
+            if not unchanged:
+                changes.append((inv, rule_id, subtotal, tax, total, breakdown))
+    return changes
+
+
+def _write_changes(changes):
+    invoice_ids = [inv.pk for inv, *_ in changes]
+    missing_pointer = [inv.pk for inv, *_ in changes if inv.current_tax_record is None]
+    last_versions = dict(
+        TaxRecord.objects.filter(invoice_id__in=missing_pointer)
+        .values("invoice_id").annotate(v=Max("version")).values_list("invoice_id", "v")
+    ) if missing_pointer else {}
+
+    TaxRecord.objects.filter(invoice_id__in=invoice_ids, is_active=True).update(is_active=False)
+
+    records = []
+    now = timezone.now()
+    for inv, rule_id, subtotal, tax, total, breakdown in changes:
+        current = inv.current_tax_record
+        version = (current.version if current else last_versions.get(inv.pk) or 0) + 1
+        record = TaxRecord(
+            invoice_id=inv.pk, tax_rule_id=rule_id, version=version, is_active=True,
+            subtotal=subtotal, tax_amount=tax, total=total, breakdown=breakdown or None,
+            metadata={"source": "batch_retax"},
+        )
+        records.append(record)
+        inv.subtotal_amount, inv.tax_amount, inv.total_amount = subtotal, tax, total
+        inv.current_tax_record = record
+        inv.updated_at = now
+    TaxRecord.objects.bulk_create(records, batch_size=1000)
+    # one set-based UPDATE copying from the new active records; much cheaper
+    # than bulk_update's per-row CASE expressions at this batch size
+    active = TaxRecord.objects.filter(invoice_id=OuterRef("pk"), is_active=True)
+    Invoice.objects.filter(pk__in=invoice_ids).update(
+        subtotal_amount=Subquery(active.values("subtotal")[:1]),
+        tax_amount=Subquery(active.values("tax_amount")[:1]),
+        total_amount=Subquery(active.values("total")[:1]),
+        total_amount_base=Subquery(active.values("total")[:1]) * F("exchange_rate"),
+        # as Invoice._sync_base_amount: the rate is relative to the stored base, else the current one
+        base_currency=Case(When(base_currency="", then=Value(fx.base_currency())), default=F("base_currency")),
+        current_tax_record=Subquery(active.values("pk")[:1]),
+        updated_at=now,
+    )
+    invalidate_invoice_pdfs(invoice_ids)
+
+    # bulk writes skip post_save, so refresh the paid-income rollups explicitly
+    from api.financial_analytics.rollups import schedule_income_rollup_refresh
+    for org_id, day in {(inv.organization_id, inv.due_date) for inv, *_ in changes if inv.status == Invoice.Status.PAID}:
+        schedule_income_rollup_refresh(org_id, day)
+
+
+def retax_invoices(*, country=None, organization_id=None, start=None, end=None, statuses=None,
+                   include_paid=False, dry_run=False, batch_size=DEFAULT_BATCH_SIZE, diff_limit=1000):
+    """
+    Recompute tax for every invoice in scope with the current TaxRule table.
+    Paid invoices are left alone unless `include_paid`. With dry_run nothing
+    is written. Returns {"scanned", "changed", "tax_delta", "diff"} where diff
+    lists up to `diff_limit` changed invoices with their old and new amounts.
+    """
+    scope = (
+        _scope(country, organization_id, start, end, statuses, include_paid)
+        .order_by("pk").values_list("pk", flat=True)
+    )
+    result = {"scanned": 0, "changed": 0, "tax_delta": Decimal("0.00"), "diff": []}
+    last_pk = 0
+    while True:
+        invoice_ids = list(scope.filter(pk__gt=last_pk)[:batch_size])
+        if not invoice_ids:
+            break
+        last_pk = invoice_ids[-1]
+        old = {}
+        with transaction.atomic():
+            changes = _retax_batch(invoice_ids)
+            for inv, *_ in changes:
+                old[inv.pk] = (inv.subtotal_amount, inv.tax_amount, inv.total_amount)
+            if changes and not dry_run:
+                _write_changes(changes)
+
+        result["scanned"] += len(invoice_ids)
+        result["changed"] += len(changes)
+        for inv, rule_id, subtotal, tax, total, _ in changes:
+            old_subtotal, old_tax, old_total = old[inv.pk]
+            result["tax_delta"] += tax - old_tax
+            if len(result["diff"]) < diff_limit:
+                result["diff"].append({
+                    "invoice_id": inv.pk, "invoice_number": inv.invoice_number,
+                    "old": {"subtotal": str(old_subtotal), "tax": str(old_tax), "total": str(old_total)},
+                    "new": {"subtotal": str(subtotal), "tax": str(tax), "total": str(total)},
+                })
+
+    logger.info(
+        "Re-tax%s: %d invoices scanned, %d changed, tax delta %s",
+        " (dry run)" if dry_run else "", result["scanned"], result["changed"], result["tax_delta"],
+    )
+    return result
@@ -1,9 +1,11 @@
 from rest_framework import serializers
 from decimal import Decimal
+from django.db import transaction
 from .models import (
     Invoice, InvoiceItem, Payment, RevenueCategory,
     OrgPartnerShare, InvoicePartnerShare, PartnerAllocation, InvoiceAuditLog , TaxRecord , TaxRule
 )
+from .utils import invoice_recompute_batch, bulk_create_invoice_items, mark_invoice_dirty
 
 
 class InvoiceItemSerializer(serializers.ModelSerializer):
@@ -47,12 +49,14 @@ class InvoiceSerializer(serializers.ModelSerializer):
             "client_name", "client_email", "client_country", "client_state",
             "due_date", "status", "currency", "exchange_rate",
             "subtotal_amount", "tax_amount", "total_amount", "paid_amount",
+            "total_amount_base", "base_currency",
             "created_at", "updated_at", "sent_at", "paid_at",
             "items", "payments", "pdf_file", "audit_logs",
         ]
         read_only_fields = [
             "id", "invoice_number", "status", "subtotal_amount",
             "tax_amount", "total_amount", "paid_amount",
+            "total_amount_base", "base_currency",
             "created_at", "updated_at", "sent_at", "paid_at",
             "pdf_file",
               "owner", 
@@ -82,14 +86,12 @@ class InvoiceSerializer(serializers.ModelSerializer):
         if not owner or not org:
             raise serializers.ValidationError("Owner or organization not provided.")
 
-        # Create invoice
-        invoice = Invoice.objects.create(owner=owner, organization=org, **validated_data)
+        # Create invoice and items; totals/tax are recomputed once on commit
+        with transaction.atomic(), invoice_recompute_batch():
+            invoice = Invoice.objects.create(owner=owner, organization=org, **validated_data)
+            bulk_create_invoice_items([InvoiceItem(invoice=invoice, **it) for it in items])
 
-        # Create invoice items
-        for it in items:
-            InvoiceItem.objects.create(invoice=invoice, **it)
-
-        invoice.recalc_totals()
+        invoice.refresh_from_db()
         return invoice
 
     def update(self, instance, validated_data):
@@ -97,16 +99,17 @@ class InvoiceSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Paid invoice cannot be edited.")
 
         items = validated_data.pop("items", None)
-        for attr, val in validated_data.items():
-            setattr(instance, attr, val)
-        instance.save()
+        with transaction.atomic(), invoice_recompute_batch():
+            for attr, val in validated_data.items():
+                setattr(instance, attr, val)
+            instance.save()
 
-        if items is not None:
-            instance.items.all().delete()
-            for it in items:
-                InvoiceItem.objects.create(invoice=instance, **it)
+            if items is not None:
+                instance.items.all().delete()
+                bulk_create_invoice_items([InvoiceItem(invoice=instance, **it) for it in items])
+            mark_invoice_dirty(instance.pk)
 
-        instance.recalc_totals()
+        instance.refresh_from_db()
         return instance
 
 
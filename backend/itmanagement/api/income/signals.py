@@ -1,12 +1,15 @@
 
 import logging
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, post_init
 from django.dispatch import receiver
 from django.conf import settings
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from .models import Invoice, InvoiceItem , InvoiceItem, Payment
-from .utils import compute_and_store_tax , allocate_payment
+from .models import Invoice, InvoiceItem , InvoiceItem, Payment , InvoicePartnerShare , OrgPartnerShare , TaxRule, PartnerAllocation
+from .allocation import invalidate_allocation_plans
+from .pdf import invalidate_invoice_pdfs
+from .tax_rules import invalidate_tax_rule_table
+from .utils import allocate_payment , mark_invoice_dirty
 
 
 logger = logging.getLogger(__name__)
@@ -15,10 +18,8 @@ logger = logging.getLogger(__name__)
 @receiver(post_save, sender=InvoiceItem)
 @receiver(post_delete, sender=InvoiceItem)
 def on_invoice_items_change(sender, instance, **kwargs):
-    try:
-        instance.invoice.recalc_totals()
-    except Exception:
-        logger.exception("Failed to recalc totals for invoice %s", getattr(instance, "invoice_id", None))
+    """Totals and the TaxRecord are rebuilt once per invoice on commit, not per item."""
+    mark_invoice_dirty(getattr(instance, "invoice_id", None))
 
 
 @receiver(post_save, sender=Payment)
@@ -52,17 +53,83 @@ def on_payment_created(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=Invoice)
 def _invoice_saved(sender, instance, created, **kwargs):
+    # Only compute on creation, updates may already trigger via items/payments
+    if created:
+        mark_invoice_dirty(instance.pk)
+
+
+def _rollup_state(invoice):
+    d = invoice.__dict__
+    return (d.get("organization_id"), d.get("due_date"), d.get("status"))
+
+
+def _schedule_rollup(state):
+    from api.financial_analytics.rollups import schedule_income_rollup_refresh
+    organization_id, due_date, status = state
+    if status == Invoice.Status.PAID:
+        schedule_income_rollup_refresh(organization_id, due_date)
+
+
+@receiver(post_init, sender=Invoice)
+def _remember_rollup_state(sender, instance, **kwargs):
+    instance._rollup_state = _rollup_state(instance)
+
+
+@receiver(post_save, sender=Invoice)
+def _refresh_income_rollup(sender, instance, **kwargs):
+    """Only paid invoices are rolled up, so unpaid edits cost nothing here."""
+    previous, current = getattr(instance, "_rollup_state", None), _rollup_state(instance)
     try:
-        # Only compute on creation, updates may already trigger via items/payments
-        if created:
-            compute_and_store_tax(instance)
-    except Exception as e:
-        logger.exception("Tax computation failed for invoice %s", instance.id)
+        _schedule_rollup(current)
+        # the old bucket needs its own refresh unless the current one covers it
+        if previous and previous != current and (previous[:2] != current[:2] or current[2] != Invoice.Status.PAID):
+            _schedule_rollup(previous)
+    except Exception:
+        logger.exception("Failed to schedule rollup refresh for invoice %s", instance.id)
+    instance._rollup_state = current
+
+
+@receiver(post_delete, sender=Invoice)
+def _invoice_deleted_rollup(sender, instance, **kwargs):
+    _schedule_rollup(getattr(instance, "_rollup_state", None) or _rollup_state(instance))
+
 
 @receiver([post_save, post_delete], sender=InvoiceItem)
-def _invoice_item_changed(sender, instance, **kwargs):
+def _invoice_item_rollup(sender, instance, **kwargs):
+    """Item changes move revenue between categories of an already paid invoice."""
     try:
-        compute_and_store_tax(instance.invoice)
-    except Exception as e:
-        logger.exception("Tax recompute failed after item change for invoice %s", instance.invoice_id)
+        _schedule_rollup(_rollup_state(instance.invoice))
+    except Exception:
+        logger.exception("Failed to schedule rollup refresh for invoice %s", instance.invoice_id)
+
+
+@receiver([post_save, post_delete], sender=InvoicePartnerShare)
+@receiver([post_save, post_delete], sender=OrgPartnerShare)
+def _partner_shares_changed(sender, instance, **kwargs):
+    # after commit, like the tax rules, so no process rebuilds plans from uncommitted shares
+    transaction.on_commit(invalidate_allocation_plans)
+
+
+@receiver([post_save, post_delete], sender=TaxRule)
+def _tax_rules_changed(sender, instance, **kwargs):
+    # bump after commit so other processes cannot rebuild from pre-commit rows
+    transaction.on_commit(invalidate_tax_rule_table)
+
+
+@receiver(post_save, sender=Invoice)
+def _invoice_pdf_stale(sender, instance, **kwargs):
+    # a later save() of this instance must not write the previous hash back
+    instance.pdf_hash = invalidate_invoice_pdfs([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=InvoiceItem)
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=InvoicePartnerShare)
+def _invoice_part_pdf_stale(sender, instance, **kwargs):
+    invalidate_invoice_pdfs([instance.invoice_id])
+
 
+@receiver([post_save, post_delete], sender=PartnerAllocation)
+def _allocation_pdf_stale(sender, instance, **kwargs):
+    # the payment may be going too (cascade), so it is looked up rather than dereferenced
+    invalidate_invoice_pdfs(Payment.objects.filter(pk=instance.payment_id).values_list("invoice_id", flat=True))
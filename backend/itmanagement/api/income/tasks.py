@@ -1,12 +1,16 @@
 
 import logging
+import time
 from django.conf import settings
-from django.core.mail import EmailMessage, send_mail
+from background_task import background
 from django.utils import timezone
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, OuterRef, Max, When
 
-from .models import Invoice, Payment
-from .utils import allocate_payment
+from .models import Invoice, Payment, PartnerAllocation, ReconciliationRun
+from .utils import allocate_payment, compact_tax_records
+from .allocation import prime_allocation_plans, resolve_allocation_plan
+from .pdf import invalidate_invoice_pdfs
 
 logger = logging.getLogger(__name__)
 DEFAULT_FROM = getattr(settings, "DEFAULT_FROM_EMAIL", "no-reply@example.com")
@@ -60,59 +64,157 @@ def allocate_payment_task(payment_id):
 
 def run_invoice_reminder_jobs():
     """Send reminders for due invoices and mark overdue ones."""
-    reminder_days = getattr(settings, "INVOICE_REMINDER_DAYS_BEFORE", [7, 3, 1])
-    today = timezone.now().date()
-
-    # Send reminders BEFORE due date
-    for days in reminder_days:
-        target_date = today + timezone.timedelta(days=days)
-        qs = Invoice.objects.filter(
-            due_date=target_date,
-            status__in=[
-                Invoice.Status.DRAFT,
-                Invoice.Status.SENT,
-                Invoice.Status.PARTIALLY_PAID,
-            ],
+    from .reminders import dispatch_invoice_notifications
+    return dispatch_invoice_notifications()
+
+
+def _next_unallocated_chunk(run):
+    """Keyset page of unallocated payments after the run's cursor."""
+    has_allocation = PartnerAllocation.objects.filter(payment_id=OuterRef("pk"))
+    return list(
+        Payment.objects.filter(pk__gt=run.cursor, pk__lte=run.upper_bound)
+        .filter(~Exists(has_allocation))
+        .select_related("invoice")
+        .only("id", "amount", "invoice__id", "invoice__organization_id")
+        .order_by("pk")[: run.chunk_size]
+    )
+
+
+@transaction.atomic
+def _reconcile_chunk(run_id):
+    """
+    Allocate the next chunk of a run. The run row stays locked for the chunk,
+    so workers sharing a run take turns, each continuing from the cursor the
+    previous chunk committed. Returns (run, payments handled); 0 means the run
+    is finished or was stopped elsewhere.
+    """
+    run = ReconciliationRun.objects.select_for_update().get(pk=run_id)
+    if run.status != ReconciliationRun.Status.RUNNING:
+        return run, 0
+    started = time.perf_counter()
+    payments = _next_unallocated_chunk(run)
+    if not payments:
+        run.status = ReconciliationRun.Status.COMPLETED
+        run.finished_at = timezone.now()
+        run.save(update_fields=["status", "finished_at", "updated_at"])
+        return run, 0
+
+    prime_allocation_plans({p.invoice_id: p.invoice for p in payments}.values())
+    allocations = []
+    allocated = 0
+    for p in payments:
+        splits = resolve_allocation_plan(p.invoice).split(p.amount)
+        allocated += bool(splits)
+        allocations.extend(
+            PartnerAllocation(payment_id=p.pk, partner_id=partner_id, amount=amount)
+            for partner_id, amount in splits
         )
-        for inv in qs.iterator():
-            try:
-                subject = f"Reminder: Invoice #{inv.invoice_number} due in {days} day(s)"
-                body = (
-                    f"Invoice #{inv.invoice_number} for {inv.client_name} "
-                    f"is due on {inv.due_date}. Total: {inv.total_amount}"
-                )
-                send_mail(subject, body, DEFAULT_FROM, [inv.client_email], fail_silently=True)
-                logger.info("Sent reminder for invoice %s to %s", inv.invoice_number, inv.client_email)
-            except Exception:
-                logger.exception("Failed to send reminder for invoice %s", inv.id)
-
-    # Mark overdue and notify finance
-    overdue_qs = Invoice.objects.filter(due_date__lt=today).exclude(status=Invoice.Status.PAID)
-    finance_recipients = list(getattr(settings, "FINANCE_NOTIFICATION_EMAILS", []))
-    for inv in overdue_qs.iterator():
+    PartnerAllocation.objects.bulk_create(allocations, batch_size=1000)
+    invalidate_invoice_pdfs({p.invoice_id for p in payments})
+
+    # progress is committed together with the allocations it describes
+    run.cursor = payments[-1].pk
+    run.payments_scanned += len(payments)
+    run.payments_allocated += allocated
+    run.allocations_created += len(allocations)
+    run.elapsed_seconds += time.perf_counter() - started
+    run.save(update_fields=[
+        "cursor", "payments_scanned", "payments_allocated", "allocations_created", "elapsed_seconds", "updated_at",
+    ])
+    return run, len(payments)
+
+
+RESUMABLE = [ReconciliationRun.Status.RUNNING, ReconciliationRun.Status.FAILED]
+
+
+def _claim_run(chunk_size, restart):
+    """
+    The run to work on: the running run, else the newest failed one, else a
+    new run. `restart` abandons every resumable run first. Only one run may be
+    running, so a caller racing another one onto a new or failed run retries
+    and joins it.
+    """
+    for attempt in range(3):
         try:
-            if inv.status != Invoice.Status.OVERDUE:
-                inv.status = Invoice.Status.OVERDUE
-                inv.save(update_fields=["status", "updated_at"])
-            subject = f"Overdue: Invoice #{inv.invoice_number}"
-            body = (
-                f"Invoice #{inv.invoice_number} for {inv.client_name} "
-                f"is overdue since {inv.due_date}. Total: {inv.total_amount}"
+            with transaction.atomic():
+                resumable = ReconciliationRun.objects.select_for_update().filter(status__in=RESUMABLE)
+                if restart:
+                    now = timezone.now()
+                    resumable.update(status=ReconciliationRun.Status.ABANDONED, finished_at=now, updated_at=now)
+                    restart = False
+                    run = None
+                else:
+                    run = resumable.order_by(
+                        Case(When(status=ReconciliationRun.Status.RUNNING, then=0), default=1), "-started_at", "-pk",
+                    ).first()
+                if run is None:
+                    upper_bound = Payment.objects.aggregate(m=Max("pk"))["m"] or 0
+                    return ReconciliationRun.objects.create(upper_bound=upper_bound, chunk_size=chunk_size)
+                if run.status == ReconciliationRun.Status.FAILED:
+                    logger.info("Resuming reconciliation %s from payment %s", run.pk, run.cursor)
+                    run.status = ReconciliationRun.Status.RUNNING
+                    run.last_error = ""
+                run.chunk_size = chunk_size
+                run.save(update_fields=["status", "chunk_size", "last_error", "updated_at"])
+                return run
+        except IntegrityError:
+            if attempt == 2:
+                raise
+            logger.info("Another reconciliation started meanwhile; joining it")
+
+
+def reconcile_allocations_for_unallocated_payments(chunk_size=1000, max_chunks=None, restart=False):
+    """
+    Allocate every payment that has no allocations yet, in keyset-ordered
+    chunks. Progress is stored on a ReconciliationRun, so an interrupted run is
+    picked up from its cursor by the next call (unless `restart`), and
+    concurrent calls work the same run chunk by chunk. Payments whose invoice
+    has no partner shares are skipped and stay unallocated.
+    Returns the ReconciliationRun.
+    """
+    run = _claim_run(chunk_size, restart)
+    chunks = 0
+    try:
+        while max_chunks is None or chunks < max_chunks:
+            started = time.perf_counter()
+            run, handled = _reconcile_chunk(run.pk)
+            if not handled:
+                break
+            chunks += 1
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Reconciliation %s: %d payments in %.2fs (%.0f/s), cursor %s/%s",
+                run.pk, handled, elapsed, handled / elapsed if elapsed else 0, run.cursor, run.upper_bound,
             )
-            send_mail(subject, body, DEFAULT_FROM, [inv.client_email], fail_silently=True)
-            if finance_recipients:
-                send_mail(subject, body, DEFAULT_FROM, finance_recipients, fail_silently=True)
-            logger.info("Overdue notification sent for invoice %s", inv.invoice_number)
-        except Exception:
-            logger.exception("Failed processing overdue invoice %s", inv.id)
-
-
-def reconcile_allocations_for_unallocated_payments():
-    """Try allocating all payments that don’t have allocations yet."""
-    payments = Payment.objects.annotate(num_alloc=Count("allocations")).filter(num_alloc=0)
-    for p in payments:
-        try:
-            allocate_payment(p)
-            logger.info("Reconciled allocation for payment %s", p.id)
-        except Exception:
-            logger.exception("Allocation failed for payment %s", p.id)
+    except Exception as exc:
+        logger.exception("Reconciliation %s failed at payment %s", run.pk, run.cursor)
+        ReconciliationRun.objects.filter(pk=run.pk, status=ReconciliationRun.Status.RUNNING).update(
+            status=ReconciliationRun.Status.FAILED, last_error=str(exc), updated_at=timezone.now(),
+        )
+        run.refresh_from_db()
+
+    logger.info(
+        "Reconciliation %s %s: %d scanned, %d allocated, %d allocations, %.0f payments/s",
+        run.pk, run.status, run.payments_scanned, run.payments_allocated,
+        run.allocations_created, run.payments_per_second,
+    )
+    return run
+
+
+@background(schedule=0)
+def compact_tax_records_task(keep_versions=None, min_age_days=None):
+    """Background task: fold superseded TaxRecord versions into TaxRecordHistory."""
+    compact_tax_records(keep_versions=keep_versions, min_age_days=min_age_days)
+
+
+@background(schedule=0)
+def retax_invoices_task(country=None, organization_id=None, start=None, end=None, include_paid=False):
+    """Background task: batch re-tax invoices after a TaxRule change (dates as YYYY-MM-DD)."""
+    from datetime import date
+    from .retax import retax_invoices
+    retax_invoices(
+        country=country, organization_id=organization_id,
+        start=date.fromisoformat(start) if start else None,
+        end=date.fromisoformat(end) if end else None,
+        include_paid=include_paid,
+    )
@@ -0,0 +1,99 @@
+"""
+Process-local compiled TaxRule table.
+
+All active TaxRules are compiled once into a dict keyed by normalized
+(country, state); state "" is the country-wide rule. Both Invoice.recalc_totals
+and compute_and_store_tax resolve rates here, so they can no longer disagree.
+The table is rebuilt after any TaxRule save/delete: locally on commit, and in
+every other process once the stamp read from the TaxRule table itself
+(latest updated_at and row count) changes. Deriving it from the table keeps
+it correct whatever cache backend is configured.
+"""
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NamedTuple
+
+from django.db.models import Count, Max
+
+from .models import TaxRule
+
+VERSION_CHECK_INTERVAL = 1.0  # seconds between table stamp checks
+
+TWOPLACES = Decimal("0.01")
+
+
+def _q2(v):
+    return Decimal(v).quantize(TWOPLACES, rounding=ROUND_HALF_UP)
+
+
+def normalize(value):
+    return (value or "").strip().lower()
+
+
+class CompiledTaxRule(NamedTuple):
+    rule_id: object
+    rate: Decimal
+    components: tuple  # ((name, rate), ...) or ()
+
+    def apply(self, subtotal):
+        """Return (tax_amount, breakdown) for a subtotal."""
+        if self.components:
+            breakdown = {}
+            total_component = Decimal("0.00")
+            for name, comp_rate in self.components:
+                comp_tax = _q2(subtotal * comp_rate / Decimal("100"))
+                breakdown[name] = str(comp_tax)
+                total_component += comp_tax
+            return _q2(total_component), breakdown
+        tax_amount = _q2(subtotal * self.rate / Decimal("100"))
+        return tax_amount, {"tax": str(tax_amount)}
+
+
+def compile_rule(rule):
+    components = tuple((k, Decimal(str(v))) for k, v in (rule.components or {}).items())
+    return CompiledTaxRule(rule.pk, Decimal(rule.rate_percentage), components)
+
+
+_table = None
+_table_version = None
+_version_checked_at = 0.0
+
+
+def _build_table():
+    table = {}
+    # lowest priority first so the preferred rule for a key is written last
+    for rule in TaxRule.objects.filter(active=True).order_by("precedence", "updated_at"):
+        table[(normalize(rule.country), normalize(rule.state))] = compile_rule(rule)
+    return table
+
+
+def _table_stamp():
+    """Changes whenever a TaxRule row is saved (auto_now updated_at) or deleted."""
+    stamp = TaxRule.objects.aggregate(last_updated=Max("updated_at"), rules=Count("id"))
+    return stamp["last_updated"], stamp["rules"]
+
+
+def _current_table():
+    global _table, _table_version, _version_checked_at
+    now = time.monotonic()
+    if _table is not None and now - _version_checked_at < VERSION_CHECK_INTERVAL:
+        return _table
+    _version_checked_at = now
+    version = _table_stamp()
+    if _table is None or version != _table_version:
+        _table = _build_table()
+        _table_version = version
+    return _table
+
+
+def invalidate_tax_rule_table():
+    """Rebuild on next use in this process; other processes follow the table stamp."""
+    global _table
+    _table = None
+
+
+def rule_for(country, state=""):
+    """The compiled rule for (country, state), falling back to the country-wide rule."""
+    table = _current_table()
+    country = normalize(country)
+    return table.get((country, normalize(state))) or table.get((country, ""))
@@ -1,3 +1,623 @@
-from django.test import TestCase
+import tempfile
+import threading
+import uuid
+from concurrent.futures import Future
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import IntegrityError, connection, transaction
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+
+from api.organizations.models import Organization
+from api.partners.models import Partner
+from api.users.models import User
+from . import allocation, pdf, tax_rules
+from .allocation import invalidate_allocation_plans, resolve_allocation_plan
+from .models import (
+    Invoice, InvoiceItem, InvoiceNotification, InvoiceNumberSequence, InvoicePartnerShare, OrgPartnerShare,
+    PartnerAllocation, Payment, ReconciliationRun, RevenueCategory, TaxRecord, TaxRecordHistory, TaxRule,
+)
+from .payment_import import import_payments, read_payment_rows
+from .pdf import get_invoice_pdf, render_invoices_for_period
+from .reminders import dispatch_invoice_notifications
+from .retax import retax_invoices
+from .tasks import reconcile_allocations_for_unallocated_payments
+from .tax_rules import invalidate_tax_rule_table, rule_for
+from .utils import bulk_create_invoice_items, compact_tax_records, compute_and_store_tax, invoice_recompute_batch, mark_invoice_dirty, reporting_aggregate
+
+
+def make_org(name="Acme"):
+    return Organization.objects.create(
+        name=name, legal_name=name, registration_number=uuid.uuid4().hex, company_email="finance@example.com",
+        company_phone="1", address="1 Main St", city="Pune", state="MH", postal_code="411001", country="India",
+        business_license="org/docs/license.pdf",
+    )
+
+
+def make_partner(org, username):
+    user = User.objects.create(username=username, user_type="partner")
+    return Partner.objects.create(user=user, organization=org)
+
+
+def make_invoice(org, lines=(), **fields):
+    """Invoice with (quantity, unit_price, category) lines, totals and tax computed."""
+    fields.setdefault("client_name", "Client")
+    fields.setdefault("client_email", "client@example.com")
+    invoice = Invoice.objects.create(organization=org, **fields)
+    for quantity, unit_price, category in lines:
+        InvoiceItem.objects.create(
+            invoice=invoice, description="line", quantity=quantity, unit_price=Decimal(unit_price), revenue_category=category,
+        )
+    compute_and_store_tax(invoice)
+    invoice.refresh_from_db()
+    return invoice
+
+
+class IncomeTestCase(TestCase):
+    def setUp(self):
+        # tax rules and allocation plans are compiled per process; start every test from its own rows
+        invalidate_tax_rule_table()
+        invalidate_allocation_plans()
+        self.org = make_org()
+
+
+class ReportingAggregateTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        TaxRule.objects.update_or_create(country="India", state="", name="GST", defaults={"rate_percentage": Decimal("18.00")})
+        invalidate_tax_rule_table()
+        self.services = RevenueCategory.objects.create(organization=self.org, name="Services")
+        self.licenses = RevenueCategory.objects.create(organization=self.org, name="Licenses")
+
+    def test_groups_by_client_and_category(self):
+        make_invoice(self.org, [(2, "100.00", self.services), (1, "50.00", self.licenses)], client_name="Alpha")
+        make_invoice(self.org, [(1, "100.00", self.services)], client_name="Beta")
+
+        report = reporting_aggregate(organization_id=self.org.pk)
+
+        self.assertEqual(report["totals"], {"subtotal": "350.00", "tax": "63.00", "invoiced": "413.00"})
+        self.assertEqual(
+            [(c["client_name"], c["invoiced"], c["tax"]) for c in report["by_client"]],
+            [("Alpha", "295.00", "45.00"), ("Beta", "118.00", "18.00")],
+        )
+        # line tax is tax * round(line / subtotal, 2): 45 * 0.80 + 18 * 1.00 and 45 * 0.20
+        self.assertEqual(
+            [(c["category_name"], c["invoiced"], c["tax"]) for c in report["by_category"]],
+            [("Licenses", "50.00", "9.00"), ("Services", "300.00", "54.00")],
+        )
+
+    def test_superseded_tax_records_are_not_counted(self):
+        invoice = make_invoice(self.org, [(1, "100.00", self.services)])
+        compute_and_store_tax(invoice)
+
+        report = reporting_aggregate(organization_id=self.org.pk)
+
+        self.assertEqual(invoice.tax_records.count(), 2)
+        self.assertEqual(report["totals"]["invoiced"], "118.00")
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for i in range(5):
+            make_invoice(self.org, [(1, "10.00", self.services), (3, "5.00", None)], client_name=f"Client {i}")
+
+        with CaptureQueriesContext(connection) as ctx:
+            report = reporting_aggregate(organization_id=self.org.pk)
+
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertIn("Uncategorized", [c["category_name"] for c in report["by_category"]])
+
+
+class InvoiceRecomputeTests(IncomeTestCase):
+    def test_item_changes_recompute_each_invoice_once_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(organization=self.org, client_name="Alpha", client_email="a@example.com")
+            for price in ("10.00", "20.00", "30.00"):
+                InvoiceItem.objects.create(invoice=invoice, description="line", quantity=1, unit_price=Decimal(price))
+
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.subtotal_amount, invoice.total_amount), (Decimal("60.00"), Decimal("70.80")))
+        self.assertEqual(invoice.tax_records.count(), 1)
+
+    def test_rolled_back_marks_are_discarded(self):
+        with mock.patch("api.income.utils.recompute_invoices") as recompute:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    mark_invoice_dirty(1)
+                    raise RuntimeError
+                mark_invoice_dirty(2)
+
+        recompute.assert_called_once_with([2])
+
+    def test_error_inside_a_batch_keeps_the_marks_of_the_transaction(self):
+        with mock.patch("api.income.utils.recompute_invoices") as recompute:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(RuntimeError), invoice_recompute_batch():
+                    mark_invoice_dirty(1)
+                    raise RuntimeError
+                # the failed batch must not swallow later marks
+                mark_invoice_dirty(2)
+
+        recompute.assert_called_once()
+        self.assertEqual(sorted(recompute.call_args.args[0]), [1, 2])
+
+    def test_batch_defers_recompute_in_autocommit_mode(self):
+        with mock.patch("api.income.utils.recompute_invoices") as recompute, \
+                mock.patch.object(connection, "in_atomic_block", False):
+            with invoice_recompute_batch():
+                mark_invoice_dirty(1)
+                mark_invoice_dirty(1)
+                with invoice_recompute_batch():
+                    mark_invoice_dirty(2)
+                recompute.assert_not_called()
+
+        recompute.assert_called_once()
+        self.assertEqual(sorted(recompute.call_args.args[0]), [1, 2])
+
+
+class InvoiceNumberTests(IncomeTestCase):
+    def _create(self, org, **fields):
+        fields.setdefault("client_email", "a@example.com")
+        return Invoice.objects.create(organization=org, client_name="Alpha", **fields)
+
+    def test_each_organization_has_its_own_series(self):
+        other = make_org("Other")
+        year = timezone.now().year
+
+        numbers = [self._create(org).invoice_number for org in (self.org, other, self.org)]
+
+        prefix, other_prefix = self.org.pk.hex[:8].upper(), other.pk.hex[:8].upper()
+        self.assertEqual(numbers, [f"{prefix}-{year}-0001", f"{other_prefix}-{year}-0001", f"{prefix}-{year}-0002"])
+        self.assertEqual(
+            dict(InvoiceNumberSequence.objects.values_list("organization_id", "last_value")),
+            {self.org.pk: 2, other.pk: 1},
+        )
+
+    def test_failed_insert_does_not_use_up_a_number(self):
+        first = self._create(self.org)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._create(self.org, client_email=None)
+
+        second = self._create(self.org)
+
+        self.assertEqual(int(second.invoice_number[-4:]), int(first.invoice_number[-4:]) + 1)
+
+    def test_counter_continues_numbers_issued_before_it_existed(self):
+        year = timezone.now().year
+        series = InvoiceNumberSequence.series_for(self.org)
+        Invoice.objects.filter(pk=self._create(self.org).pk).update(invoice_number=f"{series}-{year}-0041")
+        InvoiceNumberSequence.objects.all().delete()
+
+        self.assertEqual(self._create(self.org).invoice_number, f"{series}-{year}-0042")
+
+
+class PaymentImportTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_partner(self.org, "alice"), make_partner(self.org, "bob")
+        OrgPartnerShare.objects.create(organization=self.org, partner=self.alice, share_value=Decimal("60.00"), priority=1)
+        OrgPartnerShare.objects.create(organization=self.org, partner=self.bob, share_value=Decimal("40.00"), priority=2)
+        self.invoice = Invoice.objects.create(
+            organization=self.org, client_name="Alpha", client_email="a@example.com", total_amount=Decimal("100.00"),
+        )
+
+    def test_csv_import_records_payments_and_allocations(self):
+        statement = (
+            "invoice,amount,method,reference,received_at\n"
+            f"{self.invoice.invoice_number},40.00,neft,r1,2025-03-01\n"
+            f"{self.invoice.pk},60.00,neft,r2,2025-03-02T10:00:00\n"
+        )
+
+        result = import_payments(read_payment_rows(statement.encode(), "csv"), batch_size=1)
+
+        self.assertEqual(result, {"created": 2, "allocations": 4, "failed": []})
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.paid_amount, self.invoice.status), (Decimal("100.00"), Invoice.Status.PAID))
+        shares = PartnerAllocation.objects.filter(partner=self.alice).values_list("amount", flat=True)
+        self.assertEqual(sorted(shares), [Decimal("24.00"), Decimal("36.00")])
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = [
+            {"invoice": self.invoice.invoice_number, "amount": "10.00"},
+            ["not", "an", "object"],
+            {"invoice": self.invoice.invoice_number, "amount": "10.00", "received_at": "2025-02-30"},
+            {"invoice": self.invoice.invoice_number, "amount": "10.00", "received_at": "2025-02-30T10:00:00"},
+            {"invoice": "missing", "amount": "10.00"},
+            {"invoice": self.invoice.invoice_number, "amount": "-1"},
+        ]
+
+        result = import_payments(rows)
+
+        self.assertEqual(result["created"], 1)
+        self.assertEqual([f["row"] for f in result["failed"]], [2, 3, 4, 5, 6])
+        self.assertIn("expected an object", result["failed"][0]["error"])
+        self.assertIn("invalid received_at", result["failed"][1]["error"])
+
+    def test_undecodable_ndjson_lines_fail_individually(self):
+        statement = (
+            f'{{"invoice": "{self.invoice.invoice_number}", "amount": "5.00"}}\n'
+            '{"invoice": \n'
+            '"just a string"\n'
+            f'{{"invoice": "{self.invoice.invoice_number}", "amount": "7.00"}}\n'
+        )
+
+        result = import_payments(read_payment_rows(statement.encode(), "ndjson"))
+
+        self.assertEqual(result["created"], 2)
+        self.assertEqual([f["row"] for f in result["failed"]], [2, 3])
+        self.assertIn("invalid JSON", result["failed"][0]["error"])
+        self.assertEqual(Payment.objects.filter(invoice=self.invoice).count(), 2)
+
+    def test_json_document_must_be_an_array(self):
+        for document in (b'{"invoice": 1}', b"[{"):
+            result = import_payments(read_payment_rows(document, "json"))
+            self.assertEqual((result["created"], len(result["failed"])), (0, 1))
+
+
+class AllocationPlanTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice, self.bob = make_partner(self.org, "alice"), make_partner(self.org, "bob")
+        OrgPartnerShare.objects.create(organization=self.org, partner=self.alice, share_value=Decimal("30.00"), priority=1)
+        self.invoice = Invoice.objects.create(organization=self.org, client_name="Alpha", client_email="a@example.com")
+
+    def test_remainder_goes_to_the_first_organization_partner(self):
+        InvoicePartnerShare.objects.create(invoice=self.invoice, partner=self.bob, share_type="fixed", share_value=Decimal("25.00"))
+
+        plan = resolve_allocation_plan(self.invoice)
+
+        self.assertEqual(plan.split(Decimal("100.00")), [(self.bob.pk, Decimal("25.00")), (self.alice.pk, Decimal("75.00"))])
+
+    def test_share_changes_invalidate_plans_only_after_commit(self):
+        resolve_allocation_plan(self.invoice)
+        with self.captureOnCommitCallbacks() as callbacks:
+            OrgPartnerShare.objects.create(organization=self.org, partner=self.bob, share_value=Decimal("70.00"), priority=2)
+        self.assertEqual(len(resolve_allocation_plan(self.invoice).rules), 1)
+
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(len(resolve_allocation_plan(self.invoice).rules), 2)
+
+    def test_plans_follow_the_shared_version(self):
+        resolve_allocation_plan(self.invoice)
+        OrgPartnerShare.objects.filter(partner=self.alice).update(share_value=Decimal("50.00"))
+        # another process committed a share change and bumped the shared stamp
+        cache.set(allocation.PLAN_VERSION_KEY, uuid.uuid4().hex, None)
+        allocation._version_checked_at = 0.0
+
+        self.assertEqual(resolve_allocation_plan(self.invoice).rules[0].share_value, Decimal("50.00"))
+
+
+def make_unallocated_payments(org, count):
+    """Payments on an invoice of `org` with one 100% partner share, created without allocating them."""
+    partner = make_partner(org, f"partner-{uuid.uuid4().hex[:8]}")
+    OrgPartnerShare.objects.create(organization=org, partner=partner, share_value=Decimal("100.00"))
+    invoice = Invoice.objects.create(organization=org, client_name="Alpha", client_email="a@example.com")
+    return Payment.objects.bulk_create(Payment(invoice=invoice, amount=Decimal("10.00")) for _ in range(count))
+
+
+class ReconciliationTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payments = make_unallocated_payments(self.org, 5)
+
+    def test_interrupted_run_is_resumed_from_its_cursor(self):
+        first = reconcile_allocations_for_unallocated_payments(chunk_size=2, max_chunks=1)
+        self.assertEqual((first.status, first.payments_scanned), (ReconciliationRun.Status.RUNNING, 2))
+
+        run = reconcile_allocations_for_unallocated_payments(chunk_size=2)
+
+        self.assertEqual(run.pk, first.pk)
+        self.assertEqual((run.status, run.payments_scanned, run.allocations_created), (ReconciliationRun.Status.COMPLETED, 5, 5))
+        self.assertEqual(PartnerAllocation.objects.count(), 5)
+
+    def test_failed_run_is_resumed(self):
+        run = reconcile_allocations_for_unallocated_payments(chunk_size=2, max_chunks=1)
+        ReconciliationRun.objects.filter(pk=run.pk).update(status=ReconciliationRun.Status.FAILED, last_error="boom")
+
+        resumed = reconcile_allocations_for_unallocated_payments(chunk_size=2)
+
+        self.assertEqual((resumed.pk, resumed.status, resumed.last_error), (run.pk, ReconciliationRun.Status.COMPLETED, ""))
+
+    def test_restart_abandons_the_run_for_good(self):
+        old = reconcile_allocations_for_unallocated_payments(chunk_size=2, max_chunks=1)
+        ReconciliationRun.objects.filter(pk=old.pk).update(status=ReconciliationRun.Status.FAILED)
+
+        restarted = reconcile_allocations_for_unallocated_payments(chunk_size=2, max_chunks=1, restart=True)
+        latest = reconcile_allocations_for_unallocated_payments(chunk_size=2)
+
+        old.refresh_from_db()
+        self.assertEqual(old.status, ReconciliationRun.Status.ABANDONED)
+        self.assertEqual((latest.pk, latest.status), (restarted.pk, ReconciliationRun.Status.COMPLETED))
+        self.assertEqual(PartnerAllocation.objects.count(), 5)
+
+    def test_only_one_run_can_be_running(self):
+        ReconciliationRun.objects.create()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReconciliationRun.objects.create()
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentReconciliationTests(TransactionTestCase):
+    def setUp(self):
+        # rules compiled by earlier tests point at rows their transactions rolled back
+        invalidate_tax_rule_table()
+        invalidate_allocation_plans()
+
+    def test_concurrent_calls_share_one_run(self):
+        invalidate_allocation_plans()
+        payments = make_unallocated_payments(make_org(), 40)
+        errors = []
+        barrier = threading.Barrier(4)
+
+        def reconcile():
+            try:
+                barrier.wait()
+                reconcile_allocations_for_unallocated_payments(chunk_size=3)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reconcile) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        run = ReconciliationRun.objects.get()
+        self.assertEqual((run.status, run.payments_scanned, run.allocations_created), (ReconciliationRun.Status.COMPLETED, 40, 40))
+        self.assertEqual(PartnerAllocation.objects.filter(payment__in=payments).count(), 40)
+
+
+@override_settings(INVOICE_REMINDER_DAYS_BEFORE=[3], FINANCE_NOTIFICATION_EMAILS=["finance@example.com"])
+class InvoiceNotificationTests(IncomeTestCase):
+    today = date(2025, 3, 10)
+
+    def _invoice(self, due_date, status=Invoice.Status.SENT, email="client@example.com"):
+        return Invoice.objects.create(
+            organization=self.org, client_name="Alpha", client_email=email, due_date=due_date, status=status,
+        )
+
+    def test_notices_are_sent_once(self):
+        due_soon = self._invoice(self.today + timedelta(days=3))
+        late = self._invoice(self.today - timedelta(days=1))
+        self._invoice(self.today - timedelta(days=1), status=Invoice.Status.PAID)
+
+        stats = dispatch_invoice_notifications(today=self.today, workers=2, batch_size=1)
+        again = dispatch_invoice_notifications(today=self.today, workers=2, batch_size=1)
+
+        self.assertEqual(stats, {"overdue_marked": 1, "sent": 2, "failed": 0})
+        self.assertEqual(again, {"overdue_marked": 0, "sent": 0, "failed": 0})
+        late.refresh_from_db()
+        self.assertEqual(late.status, Invoice.Status.OVERDUE)
+        self.assertEqual(
+            set(InvoiceNotification.objects.values_list("invoice_id", "key")),
+            {(due_soon.pk, "reminder:3:2025-03-13"), (late.pk, "overdue:2025-03-10")},
+        )
+        overdue = next(m for m in mail.outbox if m.subject.startswith("Overdue"))
+        self.assertEqual((overdue.to, overdue.bcc), (["client@example.com"], ["finance@example.com"]))
+
+    def test_failed_sends_are_retried_by_the_next_run(self):
+        self._invoice(self.today - timedelta(days=1))
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("down")), \
+                self.assertLogs("api.income.reminders", "ERROR"):
+            stats = dispatch_invoice_notifications(today=self.today)
+
+        self.assertEqual((stats["sent"], stats["failed"]), (0, 1))
+        self.assertFalse(InvoiceNotification.objects.exists())
+        self.assertEqual(dispatch_invoice_notifications(today=self.today)["sent"], 1)
+
+
+class _InlinePool:
+    """Stands in for the render process pool; 'renders' by encoding the HTML."""
+
+    def __init__(self, fail=False):
+        self.submitted = 0
+        self.fail = fail
+
+    def submit(self, fn, html):
+        self.submitted += 1
+        future = Future()
+        if self.fail:
+            future.set_exception(RuntimeError("render failed"))
+        else:
+            future.set_result(b"%PDF-" + html.encode("utf-8")[:32])
+        return future
+
+
+class InvoicePdfTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.pool = _InlinePool()
+        pool = mock.patch("api.income.pdf._get_pool", return_value=self.pool)
+        pool.start()
+        self.addCleanup(pool.stop)
+        self.invoice = make_invoice(self.org, [(1, "100.00", None)])
+
+    def test_unchanged_invoice_reuses_the_stored_pdf(self):
+        first = get_invoice_pdf(self.invoice.pk)
+        second = get_invoice_pdf(self.invoice.pk)
+
+        self.assertEqual(self.pool.submitted, 1)
+        self.assertEqual(second.pdf_file.name, first.pdf_file.name)
+        self.assertTrue(second.pdf_file.storage.exists(second.pdf_file.name))
+
+    def test_current_pdf_is_served_without_rendering(self):
+        get_invoice_pdf(self.invoice.pk)
+
+        with mock.patch("api.income.pdf.render_invoice_html") as render, self.assertNumQueries(1):
+            served = get_invoice_pdf(self.invoice.pk)
+
+        render.assert_not_called()
+        self.assertTrue(served.pdf_file.storage.exists(served.pdf_file.name))
+
+    def test_changes_render_a_new_pdf_and_drop_the_old_one(self):
+        old = get_invoice_pdf(self.invoice.pk)
+        Payment.objects.create(invoice=self.invoice, amount=Decimal("10.00"), reference="r1")
+
+        new = get_invoice_pdf(self.invoice.pk)
+
+        self.assertEqual(self.pool.submitted, 2)
+        self.assertNotEqual(new.pdf_hash, old.pdf_hash)
+        self.assertFalse(old.pdf_file.storage.exists(old.pdf_file.name))
+
+    def test_bulk_item_writes_invalidate_the_stored_pdf(self):
+        get_invoice_pdf(self.invoice.pk)
+        bulk_create_invoice_items([
+            InvoiceItem(invoice=self.invoice, description="extra", quantity=1, unit_price=Decimal("5.00")),
+        ])
+
+        get_invoice_pdf(self.invoice.pk)
+
+        self.assertEqual(self.pool.submitted, 2)
+
+    def test_render_racing_a_change_leaves_the_pdf_stale(self):
+        real_render = pdf.render_invoice_html
+
+        def render_then_change(invoice, *args, **kwargs):
+            html = real_render(invoice, *args, **kwargs)
+            InvoiceItem.objects.create(invoice=invoice, description="late", quantity=1, unit_price=Decimal("1.00"))
+            return html
+
+        with mock.patch("api.income.pdf.render_invoice_html", side_effect=render_then_change):
+            get_invoice_pdf(self.invoice.pk)
+        get_invoice_pdf(self.invoice.pk)
+
+        self.assertEqual(self.pool.submitted, 2)
+
+    def test_period_render_skips_current_pdfs_and_counts_failures(self):
+        make_invoice(self.org, [(2, "10.00", None)])
+        get_invoice_pdf(self.invoice.pk)
+
+        self.assertEqual(render_invoices_for_period(), {"rendered": 1, "cached": 1, "failed": 0})
+
+        self.pool.fail = True
+        with self.assertLogs("api.income.pdf", "ERROR"):
+            stats = render_invoices_for_period(force=True)
+        self.assertEqual(stats, {"rendered": 0, "cached": 0, "failed": 2})
+
+
+class TaxRecordTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoice(self.org, [(1, "100.00", None)])
+
+    def _versions(self, count):
+        for _ in range(count):
+            compute_and_store_tax(self.invoice)
+
+    def test_new_version_becomes_the_only_active_record(self):
+        self._versions(2)
+
+        self.invoice.refresh_from_db()
+        active = TaxRecord.objects.get(invoice=self.invoice, is_active=True)
+        self.assertEqual((active.version, self.invoice.current_tax_record_id), (3, active.pk))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TaxRecord.objects.create(invoice=self.invoice, version=4, is_active=True)
+
+    def test_compaction_keeps_recent_versions_as_rows(self):
+        self._versions(5)  # versions 1-5 superseded, 6 active
+        TaxRecord.objects.filter(invoice=self.invoice, version__lte=4).update(created_at=timezone.now() - timedelta(days=90))
+
+        stats = compact_tax_records(keep_versions=2, min_age_days=30)
+
+        self.assertEqual(stats, {"invoices": 1, "archived": 3})
+        self.assertEqual(sorted(self.invoice.tax_records.values_list("version", flat=True)), [4, 5, 6])
+        history = TaxRecordHistory.objects.get(invoice=self.invoice)
+        self.assertEqual(([v[0] for v in history.versions], history.archived_count), ([1, 2, 3], 3))
+        # the report only ever counts the active version
+        self.assertEqual(reporting_aggregate(organization_id=self.org.pk)["totals"]["invoiced"], "118.00")
+
+    def test_young_versions_are_not_compacted(self):
+        self._versions(5)
+
+        self.assertEqual(compact_tax_records(keep_versions=1, min_age_days=30), {"invoices": 0, "archived": 0})
+        self.assertEqual(self.invoice.tax_records.count(), 6)
+
+
+class TaxRuleTableTests(IncomeTestCase):
+    def _expire(self):
+        # as if VERSION_CHECK_INTERVAL had passed since the last stamp check
+        tax_rules._version_checked_at = 0.0
+
+    def test_state_rule_beats_the_country_rule(self):
+        self.assertEqual(rule_for(" india ", "GUJARAT").rate, Decimal("12.00"))
+        self.assertEqual(rule_for("India", "Kerala").rate, Decimal("18.00"))
+        self.assertIsNone(rule_for("Atlantis"))
+
+    def test_higher_precedence_wins(self):
+        TaxRule.objects.create(country="India", name="IGST", rate_percentage=Decimal("5.00"), precedence=500)
+        invalidate_tax_rule_table()
+
+        self.assertEqual(rule_for("India").rate, Decimal("5.00"))
+
+    def test_changes_from_other_processes_are_picked_up_from_the_table(self):
+        self.assertEqual(rule_for("India").rate, Decimal("18.00"))
+        # the on_commit invalidation never runs inside the test transaction, like in a process that did not save
+        TaxRule.objects.filter(country="India", state="").update(rate_percentage=Decimal("20.00"), updated_at=timezone.now())
+
+        self.assertEqual(rule_for("India").rate, Decimal("18.00"))
+        self._expire()
+        self.assertEqual(rule_for("India").rate, Decimal("20.00"))
+
+        TaxRule.objects.filter(country="India", state="Gujarat").delete()
+        self._expire()
+        self.assertEqual(rule_for("India", "Gujarat").rate, Decimal("20.00"))
+
+
+class RetaxTests(IncomeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sent = make_invoice(self.org, [(1, "100.00", None)], client_country="India", status=Invoice.Status.SENT)
+        self.paid = make_invoice(self.org, [(1, "100.00", None)], client_country="India", status=Invoice.Status.PAID)
+        TaxRule.objects.filter(country="India", state="").update(rate_percentage=Decimal("20.00"), updated_at=timezone.now())
+        invalidate_tax_rule_table()
+
+    def test_paid_invoices_are_skipped_by_default(self):
+        result = retax_invoices(country="India")
+
+        self.assertEqual((result["scanned"], result["changed"]), (1, 1))
+        self.sent.refresh_from_db()
+        self.paid.refresh_from_db()
+        self.assertEqual(self.sent.total_amount, Decimal("120.00"))
+        self.assertEqual(self.paid.total_amount, Decimal("118.00"))
+
+    def test_paid_invoices_need_the_explicit_flag(self):
+        with self.assertRaises(ValueError):
+            retax_invoices(country="India", statuses=[Invoice.Status.PAID])
+
+        result = retax_invoices(country="India", statuses=[Invoice.Status.PAID], include_paid=True)
+
+        self.assertEqual(result["changed"], 1)
+        self.paid.refresh_from_db()
+        self.assertEqual(self.paid.total_amount, Decimal("120.00"))
+
+    def test_dry_run_writes_nothing(self):
+        result = retax_invoices(country="India", include_paid=True, dry_run=True)
+
+        self.assertEqual(result["changed"], 2)
+        self.assertEqual(result["tax_delta"], Decimal("4.00"))
+        self.sent.refresh_from_db()
+        self.assertEqual(self.sent.total_amount, Decimal("118.00"))
+        self.assertEqual(self.sent.tax_records.count(), 1)
+
+    def test_base_amount_and_currency_follow_the_new_total(self):
+        Invoice.objects.filter(pk=self.sent.pk).update(exchange_rate=Decimal("2"), base_currency="")
+
+        retax_invoices(country="India")
+
+        self.sent.refresh_from_db()
+        self.assertEqual(self.sent.total_amount_base, Decimal("240.000000"))
+        self.assertEqual(self.sent.base_currency, self.paid.base_currency)
+        self.assertEqual(self.sent.current_tax_record.total, Decimal("120.00"))
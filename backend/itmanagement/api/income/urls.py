@@ -7,10 +7,12 @@ urlpatterns = [
     path("invoices/<int:pk>/", InvoiceDetailView.as_view(), name="invoice-detail"),
     path("invoices/<int:pk>/send/", InvoiceSendView.as_view(), name="invoice-send"),
     path("invoices/<int:pk>/paid/", InvoiceMarkPaidView.as_view(), name="invoice-mark-paid"),
+    path("invoices/export/", InvoiceExportView.as_view(), name="invoice-export"),
     path("invoices/check-overdue/", InvoiceCheckOverdueView.as_view(), name="invoice-check-overdue"),
     path("invoices/<int:pk>/pdf/", InvoicePDFView.as_view(), name="invoice-pdf"),
     path("invoices/<int:invoice_id>/generate-pdf/", InvoicePDFView.as_view(), name="generate-invoice-pdf"),
     path("invoices/<int:pk>/payment/", RecordPaymentView.as_view(), name="record-payment"),
+    path("payments/import/", PaymentImportView.as_view(), name="payment-import"),
 
     path("categories/", RevenueCategoryListCreateView.as_view(), name="revenue-categories"),
     path("categories/<uuid:pk>/", RevenueCategoryDetailView.as_view(), name="revenue-category-detail"),
@@ -8,10 +8,15 @@ from weasyprint import HTML
 from django.conf import settings
 from django.utils import timezone
 import logging
+import threading
+from contextlib import contextmanager
 from decimal import Decimal, ROUND_HALF_UP
 from django.db import transaction
-from django.db.models import Sum, F
-from .models import TaxRule, TaxRecord , PartnerAllocation , Invoice
+from django.db.models import Sum, F, Q, Count, ExpressionWrapper, DecimalField
+from .models import TaxRule, TaxRecord , TaxRecordHistory , PartnerAllocation , Invoice , InvoiceItem
+from .allocation import resolve_allocation_plan
+from .pdf import invalidate_invoice_pdfs
+from .tax_rules import rule_for, compile_rule
 from django.db.models import Max
 
 
@@ -24,57 +29,21 @@ def allocate_payment(payment):
     Allocate a Payment to partners according to invoice or org partner shares.
     Returns list of PartnerAllocation objects created.
     """
-    from decimal import Decimal, ROUND_HALF_UP
     invoice = payment.invoice
-
-    allocation_rules = invoice.partner_shares.all().order_by("priority")
-    if not allocation_rules.exists():
-        allocation_rules = invoice.organization.partner_shares.all().order_by("priority")
-
-    remaining = Decimal(payment.amount).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    allocations = []
+    plan = resolve_allocation_plan(invoice)
     logger.debug("Allocating payment %s for invoice %s amount=%s", payment.id, invoice.invoice_number, payment.amount)
 
-    # First pass: calculate shares
-    for rule in allocation_rules:
-        if remaining <= Decimal("0.00"):
-            break
-
-        if rule.share_type == "fixed":
-            share_amount = Decimal(rule.share_value).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            share_amount = min(share_amount, remaining)
-        else:  # percentage
-            pct = (Decimal(rule.share_value) / Decimal("100.00"))
-            raw = (Decimal(payment.amount) * pct)
-            share_amount = raw.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            share_amount = min(share_amount, remaining)
-
-        if share_amount <= Decimal("0.00"):
-            continue
-
-        pa = PartnerAllocation.objects.create(payment=payment, partner=rule.partner, amount=share_amount)
-        allocations.append(pa)
-        remaining -= share_amount
+    allocations = [
+        PartnerAllocation(payment=payment, partner_id=partner_id, amount=share_amount)
+        for partner_id, share_amount in plan.split(payment.amount)
+    ]
+    PartnerAllocation.objects.bulk_create(allocations)
+    invalidate_invoice_pdfs([payment.invoice_id])
 
-    # Assign remainder to fallback partner if any (to avoid unallocated cents)
+    allocated = sum((a.amount for a in allocations), Decimal("0.00"))
+    remaining = Decimal(payment.amount).quantize(TWOPLACES, rounding=ROUND_HALF_UP) - allocated
     if remaining > Decimal("0.00"):
-        fallback = None
-        try:
-            fallback = invoice.organization.partner_shares.first().partner if invoice.organization.partner_shares.exists() else None
-        except Exception:
-            fallback = None
-
-        if not fallback:
-            first_rule = (invoice.partner_shares.first() or invoice.organization.partner_shares.first())
-            fallback = getattr(first_rule, "partner", None)
-
-        if fallback:
-            pa = PartnerAllocation.objects.create(payment=payment, partner=fallback, amount=remaining)
-            allocations.append(pa)
-            remaining = Decimal("0.00")
-            logger.debug("Assigned remainder to fallback partner %s", fallback.pk)
-        else:
-            logger.warning("Payment %s left %s unallocated", payment.id, remaining)
+        logger.warning("Payment %s left %s unallocated", payment.id, remaining)
 
     logger.info("Created %d allocations for payment %s", len(allocations), payment.id)
     return allocations
@@ -87,15 +56,11 @@ def q2(v) -> Decimal:
     return (v if isinstance(v, Decimal) else Decimal(str(v))).quantize(TWOPLACES, rounding=ROUND_HALF_UP)
 
 
-def active_rule_for_country(country: str):
+def active_rule_for_country(country: str, state: str = ""):
+    """Compiled rule for a country (and optional state); a dict lookup, no query."""
     if not country:
         return None
-    return (
-        TaxRule.objects
-        .filter(country__iexact=country, active=True)
-        .order_by("-precedence", "-updated_at")
-        .first()
-    )
+    return rule_for(country, state)
 
 
 @transaction.atomic
@@ -112,7 +77,9 @@ def compute_and_store_tax(invoice, *, rule: TaxRule | None = None,
         for field in country_fallback_fields:
             if hasattr(invoice, field):
                 country = getattr(invoice, field) or country
-        rule = active_rule_for_country(country)
+        compiled = active_rule_for_country(country, invoice.client_state)
+    else:
+        compiled = compile_rule(rule)
 
     # subtotal from items
     subtotal = Decimal("0.00")
@@ -122,47 +89,33 @@ def compute_and_store_tax(invoice, *, rule: TaxRule | None = None,
         subtotal += qty * unit_price
     subtotal = q2(subtotal)
 
-    if rule is None:
+    if compiled is None:
         tax_amount = Decimal("0.00")
-        total = subtotal
         breakdown = {}
     else:
-        rate = Decimal(rule.rate_percentage)
-        if rule.components:
-            breakdown = {}
-            total_component = Decimal("0.00")
-            for k, v in rule.components.items():
-                comp_rate = Decimal(str(v))
-                comp_tax = q2(subtotal * comp_rate / Decimal("100"))
-                breakdown[k] = str(comp_tax)  # ✅ store as string
-                total_component += comp_tax
-            tax_amount = q2(total_component)
-        else:
-            tax_amount = q2(subtotal * rate / Decimal("100"))
-            breakdown = {"tax": str(tax_amount)}
-        total = q2(subtotal + tax_amount)
+        tax_amount, breakdown = compiled.apply(subtotal)
+    total = q2(subtotal + tax_amount)
 
-    # update invoice snapshot
-    invoice.subtotal_amount = subtotal
-    invoice.tax_amount = tax_amount
-    invoice.total_amount = total
-    invoice.save(update_fields=["subtotal_amount", "tax_amount", "total_amount"])
-
-    # deactivate old records
-    TaxRecord.objects.filter(invoice=invoice, is_active=True).update(is_active=False)
-
-    # next version
-    last_version = (
-        TaxRecord.objects.filter(invoice=invoice)
-        .aggregate(Max("version"))
-        .get("version__max") or 0
+    # deactivate the current record (at most one, enforced by a partial unique constraint)
+    previous = (
+        TaxRecord.objects.filter(invoice=invoice, is_active=True)
+        .only("version").order_by("-version").first()
     )
-    new_version = last_version + 1
+    if previous is not None:
+        TaxRecord.objects.filter(invoice=invoice, is_active=True).update(is_active=False)
+        new_version = previous.version + 1
+    else:
+        last_version = (
+            TaxRecord.objects.filter(invoice=invoice)
+            .aggregate(Max("version"))
+            .get("version__max") or 0
+        )
+        new_version = last_version + 1
 
     # create new record
     tr = TaxRecord.objects.create(
         invoice=invoice,
-        tax_rule=rule,
+        tax_rule_id=compiled.rule_id if compiled else None,
         subtotal=subtotal,
         tax_amount=tax_amount,
         total=total,
@@ -171,12 +124,188 @@ def compute_and_store_tax(invoice, *, rule: TaxRule | None = None,
         version=new_version,
         is_active=True,
     )
+
+    # update invoice snapshot
+    invoice.subtotal_amount = subtotal
+    invoice.tax_amount = tax_amount
+    invoice.total_amount = total
+    invoice.current_tax_record = tr
+    invoice.save(update_fields=["subtotal_amount", "tax_amount", "total_amount", "current_tax_record"])
     return tr
 
+def _history_entry(record):
+    return [
+        record["version"], record["created_at"].isoformat(), str(record["tax_rule_id"]) if record["tax_rule_id"] else None,
+        str(record["subtotal"]), str(record["tax_amount"]), str(record["total"]), record["breakdown"],
+    ]
+
+
+def compact_tax_records(*, keep_versions=None, min_age_days=None, batch_size=500):
+    """
+    Fold superseded TaxRecords into each invoice's TaxRecordHistory blob.
+
+    Retention: the active record, the newest `keep_versions` superseded
+    records and anything younger than `min_age_days` stay as rows (defaults:
+    settings.TAX_RECORD_KEEP_VERSIONS / TAX_RECORD_MIN_AGE_DAYS). Invoices are
+    processed in keyset-ordered batches, one transaction each.
+    Returns {"invoices", "archived"}.
+    """
+    keep_versions = getattr(settings, "TAX_RECORD_KEEP_VERSIONS", 5) if keep_versions is None else keep_versions
+    min_age_days = getattr(settings, "TAX_RECORD_MIN_AGE_DAYS", 30) if min_age_days is None else min_age_days
+    cutoff = timezone.now() - timezone.timedelta(days=min_age_days)
+
+    candidates = (
+        TaxRecord.objects.filter(is_active=False)
+        .values("invoice_id")
+        .annotate(superseded=Count("id"))
+        .filter(superseded__gt=keep_versions)
+        .order_by("invoice_id")
+    )
+    stats = {"invoices": 0, "archived": 0}
+    last_invoice_id = 0
+    while True:
+        invoice_ids = list(
+            candidates.filter(invoice_id__gt=last_invoice_id).values_list("invoice_id", flat=True)[:batch_size]
+        )
+        if not invoice_ids:
+            break
+        last_invoice_id = invoice_ids[-1]
+        archived = _compact_tax_record_batch(invoice_ids, keep_versions, cutoff)
+        stats["invoices"] += sum(1 for n in archived.values() if n)
+        stats["archived"] += sum(archived.values())
+
+    logger.info("Compacted %(archived)d tax records across %(invoices)d invoices", stats)
+    return stats
+
+
+@transaction.atomic
+def _compact_tax_record_batch(invoice_ids, keep_versions, cutoff):
+    # lock the invoices so compute_and_store_tax cannot add versions meanwhile
+    list(Invoice.objects.select_for_update().filter(pk__in=invoice_ids).values_list("pk", flat=True))
+    superseded = (
+        TaxRecord.objects.filter(invoice_id__in=invoice_ids, is_active=False)
+        .order_by("invoice_id", "-version")
+        .values("id", "invoice_id", "version", "created_at", "tax_rule_id", "subtotal", "tax_amount", "total", "breakdown")
+    )
+    to_archive = {}
+    seen = {}
+    for record in superseded:
+        n = seen[record["invoice_id"]] = seen.get(record["invoice_id"], 0) + 1
+        if n > keep_versions and record["created_at"] < cutoff:
+            to_archive.setdefault(record["invoice_id"], []).append(record)
+    if not to_archive:
+        return {}
+
+    histories = {h.invoice_id: h for h in TaxRecordHistory.objects.filter(invoice_id__in=to_archive)}
+    new_histories = []
+    now = timezone.now()
+    for invoice_id, records in to_archive.items():
+        history = histories.get(invoice_id)
+        if history is None:
+            history = TaxRecordHistory(invoice_id=invoice_id, versions=[])
+            new_histories.append(history)
+        history.versions = sorted(history.versions + [_history_entry(r) for r in records], key=lambda e: e[0])
+        history.archived_count += len(records)
+        history.updated_at = now
+    TaxRecordHistory.objects.bulk_create(new_histories)
+    TaxRecordHistory.objects.bulk_update(
+        [h for h in histories.values() if h.invoice_id in to_archive], ["versions", "archived_count", "updated_at"]
+    )
+    TaxRecord.objects.filter(pk__in=[r["id"] for records in to_archive.values() for r in records]).delete()
+    return {invoice_id: len(records) for invoice_id, records in to_archive.items()}
+
+
+# Unit of work for invoice recomputation: item/invoice changes only mark the
+# invoice dirty, and each dirty invoice is recomputed once after commit. The
+# pending set is the transaction's on_commit callback itself, so a rollback
+# discards it together with the callback.
+_dirty = threading.local()
+
+
+class _PendingInvoices(set):
+    """Invoice ids queued in one transaction; called once it commits."""
+
+    def __call__(self):
+        recompute_invoices(list(self))
+
+
+def _pending_invoice_ids():
+    """The current transaction's pending set, registered with on_commit on first use."""
+    connection = transaction.get_connection()
+    pending = getattr(_dirty, "pending", None)
+    # a set whose callback already ran or was dropped by a rollback belongs to an ended transaction
+    if pending is None or not any(func is pending for _, func, _ in connection.run_on_commit):
+        pending = _dirty.pending = _PendingInvoices()
+        transaction.on_commit(pending)
+    return pending
+
+
+def _queue_recompute(invoice_ids):
+    """Recompute when the current transaction commits, or right away in autocommit mode."""
+    if not invoice_ids:
+        return
+    if not transaction.get_connection().in_atomic_block:
+        recompute_invoices(list(invoice_ids))
+        return
+    _pending_invoice_ids().update(invoice_ids)
+
+
+def mark_invoice_dirty(invoice_id):
+    """Queue a totals/tax recompute for the invoice when the current transaction commits."""
+    if invoice_id is None:
+        return
+    batch = getattr(_dirty, "batch", None)
+    if batch is not None:
+        batch.add(invoice_id)
+    else:
+        _queue_recompute({invoice_id})
+
+
+def recompute_invoices(invoice_ids):
+    for invoice in Invoice.objects.filter(pk__in=invoice_ids).prefetch_related("items"):
+        try:
+            invoice.recalc_totals()
+            compute_and_store_tax(invoice)
+        except Exception:
+            logger.exception("Failed to recompute invoice %s", invoice.pk)
+
+
+@contextmanager
+def invoice_recompute_batch():
+    """
+    Defer recomputation for everything marked dirty inside the block; the
+    collected invoices are recomputed once when the enclosing transaction
+    commits (when the block exits in autocommit mode, even on an error, since
+    the writes made so far are committed). Blocks may be nested.
+    """
+    if getattr(_dirty, "batch", None) is not None:
+        yield
+        return
+    batch = _dirty.batch = set()
+    try:
+        yield
+    finally:
+        _dirty.batch = None
+        _queue_recompute(batch)
+
+
+def bulk_create_invoice_items(items, batch_size=500):
+    """bulk_create InvoiceItems (no per-row signals) and queue each touched invoice once."""
+    created = InvoiceItem.objects.bulk_create(items, batch_size=batch_size)
+    invalidate_invoice_pdfs({item.invoice_id for item in created})
+    for invoice_id in {item.invoice_id for item in created}:
+        mark_invoice_dirty(invoice_id)
+    return created
+
+
 def reporting_aggregate(*, start=None, end=None, organization_id=None):
-    from income.models import Invoice, InvoiceItem
+    """
+    Grouped income report. Totals, client and category rollups (including the
+    proportional tax share of each invoice line) are computed by the database,
+    so the report costs a fixed number of queries regardless of row count.
+    """
+    from .models import InvoiceItem
 
-    tr_qs = TaxRecord.objects.select_related("invoice", "tax_rule")
     def with_date_filters(qs):
         date_field = "invoice__issue_date" if hasattr(Invoice, "issue_date") else "invoice__created_at"
         if start:
@@ -185,7 +314,8 @@ def reporting_aggregate(*, start=None, end=None, organization_id=None):
             qs = qs.filter(**{f"{date_field}__lte": end})
         return qs
 
-    tr_qs = with_date_filters(tr_qs)
+    # only the active version of each invoice counts; superseded ones are history
+    tr_qs = with_date_filters(TaxRecord.objects.filter(is_active=True))
     if organization_id:
         tr_qs = tr_qs.filter(invoice__organization_id=organization_id)
 
@@ -199,41 +329,58 @@ def reporting_aggregate(*, start=None, end=None, organization_id=None):
     subtotal_sum = totals["subtotal"] or Decimal("0.00")
 
     # Client-wise
-    client_map = {}
-    for rec in tr_qs:
-        client = getattr(rec.invoice, "client_name", "UNKNOWN")
-        if client not in client_map:
-            client_map[client] = {"invoiced": Decimal("0.00"), "tax": Decimal("0.00")}
-        client_map[client]["invoiced"] += rec.total
-        client_map[client]["tax"] += rec.tax_amount
-
+    client_rows = (
+        tr_qs.values("invoice__client_name")
+        .annotate(invoiced=Sum("total"), tax=Sum("tax_amount"))
+        .order_by("invoice__client_name")
+    )
     client_list = [
-        {"client_name": c, "invoiced": str(q2(v["invoiced"])), "tax": str(q2(v["tax"]))}
-        for c, v in client_map.items()
+        {
+            "client_name": row["invoice__client_name"],
+            "invoiced": str(q2(row["invoiced"] or Decimal("0.00"))),
+            "tax": str(q2(row["tax"] or Decimal("0.00"))),
+        }
+        for row in client_rows
     ]
 
-    # Category-wise
-    item_qs = with_date_filters(InvoiceItem.objects.select_related("invoice", "revenue_category"))
+    # Category-wise: each line carries round(tax * round(line / subtotal, 2), 2)
+    # of its invoice's active tax record, matching the per-line quantization.
+    # Lines are grouped by the values that rule reads, and the rule is applied
+    # to the groups in Python: dividing in SQL truncates on backends that
+    # store whole decimals as integers.
+    item_qs = with_date_filters(InvoiceItem.objects.all())
     if organization_id:
         item_qs = item_qs.filter(invoice__organization_id=organization_id)
 
-    cat_map = {}
-    for it in item_qs:
-        cat = getattr(it, "revenue_category", None)
-        key = (getattr(cat, "id", None), getattr(cat, "name", "Uncategorized"))
-        if key not in cat_map:
-            cat_map[key] = {"invoiced": Decimal("0.00"), "tax": Decimal("0.00")}
-        line = q2(Decimal(getattr(it, "quantity", 1)) * Decimal(getattr(it, "unit_price", getattr(it, "price", "0.00"))))
-        cat_map[key]["invoiced"] += line
-
-        inv_tr = it.invoice.active_tax_record()
-        if inv_tr and inv_tr.subtotal > 0:
-            prop = q2(line / inv_tr.subtotal)
-            cat_map[key]["tax"] += q2(inv_tr.tax_amount * prop)
-
+    money = DecimalField(max_digits=20, decimal_places=2)
+    line_rows = (
+        item_qs.annotate(line_total=ExpressionWrapper(F("quantity") * F("unit_price"), output_field=money))
+        .values(
+            "revenue_category_id", "revenue_category__name", "line_total",
+            "invoice__current_tax_record__subtotal", "invoice__current_tax_record__tax_amount",
+        )
+        .annotate(lines=Count("id"))
+        .order_by()
+    )
+    categories = {}
+    for row in line_rows:
+        # uncategorized lines sort last, as NULL names do in the database
+        key = (row["revenue_category__name"] is None, row["revenue_category__name"] or "", str(row["revenue_category_id"]))
+        category = categories.setdefault(key, {
+            "category_id": row["revenue_category_id"],
+            "category_name": row["revenue_category__name"] or "Uncategorized",
+            "invoiced": Decimal("0.00"),
+            "tax": Decimal("0.00"),
+        })
+        line_total = Decimal(row["line_total"] or 0)
+        subtotal = row["invoice__current_tax_record__subtotal"]
+        category["invoiced"] += line_total * row["lines"]
+        if subtotal:
+            line_prop = (line_total / Decimal(subtotal)).quantize(TWOPLACES, rounding=ROUND_HALF_UP)
+            category["tax"] += q2(Decimal(row["invoice__current_tax_record__tax_amount"] or 0) * line_prop) * row["lines"]
     category_list = [
-        {"category_id": k[0], "category_name": k[1], "invoiced": str(q2(v["invoiced"])), "tax": str(q2(v["tax"]))}
-        for k, v in cat_map.items()
+        {**category, "invoiced": str(q2(category["invoiced"])), "tax": str(q2(category["tax"]))}
+        for _, category in sorted(categories.items(), key=lambda item: item[0])
     ]
 
     return {
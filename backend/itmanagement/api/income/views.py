@@ -2,7 +2,7 @@ from decimal import Decimal
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.http import FileResponse, Http404
 from django.utils.encoding import smart_str
 from django.db import transaction
@@ -15,11 +15,11 @@ from .models import *
 from .serializers import *
 from .tasks import allocate_payment_task
 from .utils import reporting_aggregate
+from .payment_import import import_payments, read_payment_rows
+from .pdf import get_invoice_pdf
 from .permissions import IsOwnerOrStaff
-from django.http import HttpResponse
-from django.template.loader import render_to_string
+from api.financial_analytics.exports import ExportError, export_queryset
 from django.views import View
-import weasyprint
 
 
 logger = logging.getLogger(__name__)
@@ -43,6 +43,47 @@ class InvoiceListCreateView(generics.ListCreateAPIView):
         serializer.save(owner=self.request.user, organization=org)
 
 
+
+class InvoiceExportView(APIView):
+    """
+    GET /income/invoices/export/?export=csv|ndjson|xlsx[&start=YYYY-MM-DD&end=YYYY-MM-DD&status=]
+    Streams the caller's invoices (same scope as the invoice list), CSV by default.
+    """
+    permission_classes = [IsAuthenticated]
+
+    FIELDS = [
+        "invoice_number",
+        ("organization", "organization__name"),
+        ("owner", "owner__username"),
+        "client_name", "client_email", "client_country", "client_state",
+        "status", "currency", "exchange_rate",
+        "subtotal_amount", "tax_amount", "total_amount", "paid_amount",
+        "total_amount_base", "base_currency",
+        "due_date", "created_at", "sent_at", "paid_at",
+        ("cost_center", "cost_center__name"),
+        ("period", "period__name"),
+    ]
+
+    def get(self, request):
+        org = getattr(request.user, "organization", None)
+        qs = Invoice.objects.filter(organization=org) if org else Invoice.objects.filter(owner=request.user)
+        try:
+            start = request.query_params.get("start")
+            end = request.query_params.get("end")
+            if start:
+                qs = qs.filter(created_at__date__gte=datetime.strptime(start, "%Y-%m-%d").date())
+            if end:
+                qs = qs.filter(created_at__date__lte=datetime.strptime(end, "%Y-%m-%d").date())
+        except ValueError:
+            return Response({"error": "start/end must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        if request.query_params.get("status"):
+            qs = qs.filter(status=request.query_params["status"])
+
+        try:
+            return export_queryset(qs.order_by("pk"), self.FIELDS, "invoices", request=request)
+        except ExportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 class InvoiceDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Invoice.objects.all().prefetch_related("items", "payments")
     serializer_class = InvoiceSerializer
@@ -68,79 +109,16 @@ class InvoiceSendView(APIView):
 
 
 class InvoicePDFView(View):
-    template_name = "invoice.html"  
     filename = "invoice.pdf"
 
-    def get_invoice_context(self, invoice_id):
-        """Build invoice data dynamically from the database"""
-        invoice = Invoice.objects.prefetch_related("items", "payments", "partner_shares__partner__allocations").get(id=invoice_id)
-
-        items = [
-            {
-                "description": item.description,
-                "quantity": item.quantity,
-                "unit_price": item.unit_price,
-                "total": item.total_price(),
-                "revenue_category": item.revenue_category.name if item.revenue_category else "",
-            }
-            for item in invoice.items.all()
-        ]
-
-        payments = [
-            {
-                "amount": p.amount,
-                "method": p.method,
-                "reference": p.reference,
-                "date": p.received_at.strftime("%d-%b-%Y"),
-            }
-            for p in invoice.payments.all()
-        ]
-
-        partners = [
-            {
-                "name": ps.partner.user.username,
-                "share_type": ps.share_type,
-                "share_value": ps.share_value,
-                "allocated_amount": sum(a.amount for a in ps.partner.allocations.filter(payment__invoice=invoice)),
-            }
-            for ps in invoice.partner_shares.all()
-        ]
-
-        context = {
-            "invoice_number": invoice.invoice_number,
-            "date": invoice.created_at.strftime("%d-%b-%Y"),
-            "due_date": invoice.due_date.strftime("%d-%b-%Y") if invoice.due_date else "",
-            "status": invoice.status,
-            "currency": invoice.currency,
-            "client": {
-                "name": invoice.client_name,
-                "email": invoice.client_email,
-                "country": invoice.client_country,
-                "state": invoice.client_state,
-            },
-            "items": items,
-            "subtotal": invoice.subtotal_amount,
-            "tax": invoice.tax_amount,
-            "total": invoice.total_amount,
-            "payments": payments,
-            "partners": partners,
-            "organization": {
-                "name": invoice.organization.name
-            }
-        }
-
-        return context
-
-    def get(self, request, invoice_id, *args, **kwargs):
-        """Generate PDF and return as response"""
-        context = self.get_invoice_context(invoice_id)
-        html = render_to_string(self.template_name, context)
-
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="{self.filename}"'
-        weasyprint.HTML(string=html).write_pdf(response)
-
-        return response
+    def get(self, request, invoice_id=None, pk=None, *args, **kwargs):
+        """Stream the invoice PDF, rendering it first only if the stored copy is stale."""
+        try:
+            invoice = get_invoice_pdf(invoice_id or pk)
+        except Invoice.DoesNotExist:
+            raise Http404("Invoice not found")
+        return FileResponse(invoice.pdf_file.open("rb"), as_attachment=True,
+                            filename=self.filename, content_type="application/pdf")
 
 
 class InvoiceMarkPaidView(APIView):
@@ -193,6 +171,31 @@ class RecordPaymentView(APIView):
         return Response({"detail": "Payment recorded.", "invoice": InvoiceSerializer(invoice).data}, status=status.HTTP_200_OK)
 
 
+class PaymentImportView(APIView):
+    """
+    POST /income/payments/import/
+    Upload a statement as multipart `file` (csv/json/ndjson, by extension or
+    `format`), or send a JSON list of payment rows as the body.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def post(self, request):
+        upload = request.FILES.get("file")
+        if upload is not None:
+            fmt = request.data.get("format") or upload.name.rsplit(".", 1)[-1].lower()
+            if fmt not in ("csv", "json", "ndjson"):
+                return Response({"detail": "Unsupported format."}, status=status.HTTP_400_BAD_REQUEST)
+            rows = read_payment_rows(upload.file, fmt)
+        elif isinstance(request.data, list):
+            rows = request.data
+        else:
+            return Response({"detail": "Provide a file or a list of payments."}, status=status.HTTP_400_BAD_REQUEST)
+
+        result = import_payments(rows)
+        code = status.HTTP_200_OK if not result["failed"] else status.HTTP_207_MULTI_STATUS
+        return Response(result, status=code)
+
+
 class InvoiceCheckOverdueView(APIView):
     permission_classes = [IsAuthenticated]
 
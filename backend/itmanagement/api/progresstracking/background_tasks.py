@@ -1,7 +1,6 @@
 import datetime
 import uuid
 import os
-import csv
 import logging
 
 from django.conf import settings
@@ -9,11 +8,15 @@ from background_task import background
 from django.utils import timezone
 from django.core.files import File
 from django.contrib.auth import get_user_model
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from decimal import Decimal
 
 from .models import ProgressReport
-from .utils import burndown_series, gantt_payload, performance_metrics, ensure_report_dir, _get_task_logged_hours
+from .utils import burndown_series, gantt_payload, performance_metrics, ensure_report_dir
 from api.dailytask.models import DailyTask
 from api.projects.models import Project
+from api.financial_analytics.exports import iter_csv
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -75,40 +78,29 @@ def generate_progress_report(project_id, user_id=None):
         filename = f"progress_report_{project.id}_{ts}.csv"
         filepath = os.path.join(out_dir, filename)
 
-        tasks = DailyTask.objects.filter(project=project).select_related("assigned_to", "sprint")
-
-        with open(filepath, "w", newline="", encoding="utf-8") as fh:
-            writer = csv.writer(fh)
-            writer.writerow([
-                "Task ID", "Title", "Assignee", "Status", "Priority", "Category",
-                "Estimated Hours", "Logged Hours", "Remaining Hours", "Start Date", "Due Date"
-            ])
-            for t in tasks:
-                est = getattr(t, "estimated_hours", 0) or 0
-                try:
-                    logged = _get_task_logged_hours(t) or 0
-                except Exception:
-                    logged = getattr(t, "logged_hours", 0) or 0
-
-                remaining = ""
-                try:
-                    remaining = float(est) - float(logged)
-                except Exception:
-                    pass
-
-                writer.writerow([
-                    t.id,
-                    getattr(t, "title", getattr(t, "name", "")),
-                    getattr(getattr(t, "assigned_to", None), "username", ""),
-                    getattr(t, "status", ""),
-                    getattr(t, "priority", ""),
-                    getattr(t, "category", ""),
-                    est,
-                    logged,
-                    remaining,
-                    t.start_date.isoformat() if getattr(t, "start_date", None) else "",
-                    t.due_date.isoformat() if getattr(t, "due_date", None) else "",
-                ])
+        tasks = (
+            DailyTask.objects.filter(project=project)
+            .annotate(logged=Coalesce(Sum("time_logs__hours_spent"), Decimal("0")))
+            .order_by("due_date", "id")
+            .values_list("id", "title", "assigned_to__username", "status", "priority", "category", "logged", "due_date")
+        )
+
+        def rows():
+            # DailyTask has no estimate or start date; the columns are kept for the report layout
+            est = 0
+            for task_id, title, assignee, status, priority, category, logged, due_date in tasks.iterator(chunk_size=2000):
+                yield [
+                    task_id, title, assignee or "", status, priority, category,
+                    est, float(logged), est - float(logged), "", due_date,
+                ]
+
+        headers = [
+            "Task ID", "Title", "Assignee", "Status", "Priority", "Category",
+            "Estimated Hours", "Logged Hours", "Remaining Hours", "Start Date", "Due Date"
+        ]
+        with open(filepath, "wb") as fh:
+            for chunk in iter_csv(headers, rows()):
+                fh.write(chunk)
     except Exception as e:
         logger.exception(f"Failed to generate CSV for project {project_id}: {e}")
         filepath = None
@@ -11,9 +11,9 @@ def _get_task_logged_hours(task):
     otherwise look for attribute 'logged_hours' on the task.
     """
     try:
-        # If TaskTimeLog model exists and references DailyTask via 'task' FK and has 'hours' field
+        # If TaskTimeLog model exists and references DailyTask via 'task' FK and has 'hours_spent' field
         logs = TaskTimeLog.objects.filter(task=task)
-        total = logs.aggregate(total=Sum("hours"))["total"] or 0
+        total = logs.aggregate(total=Sum("hours_spent"))["total"] or 0
         return float(total)
     except Exception:
         # fallback to attribute on model
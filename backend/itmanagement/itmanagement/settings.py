@@ -85,6 +85,20 @@ CHANNEL_LAYERS = {
 DEFAULT_FROM_EMAIL = "khokhariavidhya@example.com"
 FINANCE_NOTIFICATION_EMAILS = ["finance@example.com"]
 INVOICE_REMINDER_DAYS_BEFORE = [7, 3, 1]
+INVOICE_REMINDER_SEND_WORKERS = 4  # parallel mail connections used by the reminder dispatcher
+INVOICE_REMINDER_BATCH_SIZE = 200
+INVOICE_PDF_WORKERS = None  # PDF render processes; None = one per CPU
+TAX_RECORD_KEEP_VERSIONS = 5  # superseded TaxRecords kept as rows per invoice before compaction
+TAX_RECORD_MIN_AGE_DAYS = 30  # younger superseded TaxRecords are never compacted
+FINANCE_BASE_CURRENCY = "INR"  # reporting currency of Invoice.total_amount_base and the rollups
+FX_RATE_CACHE_SIZE = 4096  # (currency, base, date) rates kept in each process
+PAYROLL_WORKERS = None  # payslip computation processes; None = one per CPU
+PAYROLL_CHUNK_SIZE = 500  # employees per payroll chunk (one transaction each)
+EXPENSE_REPORT_REFRESH_DELAY = 30  # seconds changes are batched before stored expense reports are refreshed
+UTILIZATION_BATCH_SIZE = 1000  # employees loaded per batch by the utilization engine
+UTILIZATION_BAND_CACHE_TIMEOUT = 15 * 60  # seconds cached organization utilization bands are served
+UTILIZATION_REFRESH_DELAY = 60  # seconds changes are batched before queued utilization weeks are recomputed
+UTILIZATION_HORIZON_WEEKS = 26  # future weeks queued for recomputation when assignments or leave change
 INVOICE_ALLOCATE_ASYNC = False  # True to run partner allocation in background
 
 
@@ -129,6 +143,17 @@ DATABASES = {
     'default': dj_database_url.config(default=config('DATABASE_URL'))
 }
 
+# Shared by every worker process: cached reports, the version stamps that
+# invalidate per-process tables (allocation plans, tax rules) and refresh
+# debouncing only work if all processes see the same cache. The default
+# database table is created by the income migrations.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='itmanagement_cache'),
+    }
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 